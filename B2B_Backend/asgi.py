@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'B2B_Backend.settings')
 
 application = get_asgi_application()
+
+if settings.ADMISSION_CONTROL:
+    from utils.admission import AdmissionControlMiddleware
+
+    # Shed requests before they queue up in Django when the worker is saturated
+    application = AdmissionControlMiddleware(application)
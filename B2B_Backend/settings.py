@@ -51,24 +51,53 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = 'Webshop.CustomUser'
 
 MIDDLEWARE = [
+    'Webshop.middleware.metrics_middleware',
+    'Webshop.middleware.profiler_middleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    # Sessions, CSRF, messages and clickjacking protection are skipped for API requests with a bearer token
+    'Webshop.middleware.BrowserSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'Webshop.middleware.BrowserCsrfViewMiddleware',
+    'Webshop.middleware.BrowserAuthenticationMiddleware',
+    'Webshop.middleware.BrowserMessageMiddleware',
+    'Webshop.middleware.BrowserXFrameOptionsMiddleware',
+    'Webshop.middleware.primary_pin_middleware',
 ]
 
+API_PATH_PREFIX = '/web/api/'
+
+# Throttling of the API, the login and the password reset, see REST_FRAMEWORK and THROTTLE_BUCKETS
+THROTTLING = os.getenv('DJANGO_THROTTLING', 'True').lower() in ('true', '1', 't')
+
 REST_FRAMEWORK = {
+    # JWT first: API clients are answered without looking at sessions. Basic authentication
+    # is not offered, it would hash the password on every request.
     'DEFAULT_AUTHENTICATION_CLASSES': (
+        'Webshop.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
     ),
+    # Token bucket throttling per user and kind of credentials, or per IP address for anonymous
+    # requests. Views select a rate with `throttle_scope`, an empty rate disables a scope.
+    'DEFAULT_THROTTLE_CLASSES': ('Webshop.throttling.TokenBucketThrottle',) if THROTTLING else (),
+    'DEFAULT_THROTTLE_RATES': {
+        'default': os.getenv('DJANGO_THROTTLE_RATE_DEFAULT', '600/min'),
+        'catalog': os.getenv('DJANGO_THROTTLE_RATE_CATALOG', '300/min'),
+        'cart': os.getenv('DJANGO_THROTTLE_RATE_CART', '120/min'),
+        'login': os.getenv('DJANGO_THROTTLE_RATE_LOGIN', '30/min'),
+        'password_reset': os.getenv('DJANGO_THROTTLE_RATE_PASSWORD_RESET', '10/hour'),
+    },
+    # Proxies in front of the app that append to X-Forwarded-For (nginx), for the client IP of throttles
+    'NUM_PROXIES': int(os.getenv('DJANGO_NUM_PROXIES', 1)),
+}
+
+SIMPLE_JWT = {
+    # Adds the token_version claim checked by Webshop.authentication.CachedJWTAuthentication
+    'TOKEN_OBTAIN_SERIALIZER': 'Webshop.serializers.TokenObtainPairSerializer',
+    # Rejects refresh tokens of an older token_version
+    'TOKEN_REFRESH_SERIALIZER': 'Webshop.serializers.TokenRefreshSerializer',
 }
 
 ROOT_URLCONF = 'B2B_Backend.urls'
@@ -106,6 +135,70 @@ DATABASES = {
     }
 }
 
+# SQLite production mode: every connection gets SQLITE_PRAGMAS (WAL journal, see Webshop.signals)
+# and transactions take the write lock at BEGIN, so concurrent writers wait for each other
+# within busy_timeout instead of failing with "database is locked" on lock upgrades.
+SQLITE_PRODUCTION_MODE = os.getenv('DJANGO_SQLITE_PRODUCTION_MODE', 'True').lower() in ('true', '1', 't')
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.getenv('DJANGO_SQLITE_BUSY_TIMEOUT', 5000)),  # milliseconds
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -32000,  # KiB
+    'temp_store': 'MEMORY',
+}
+if SQLITE_PRODUCTION_MODE and DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default']['OPTIONS'] = {'transaction_mode': 'IMMEDIATE'}
+# Attempts of write paths decorated with utils.sqlite.retry_on_lock, and the initial backoff in seconds
+SQLITE_WRITE_ATTEMPTS = int(os.getenv('DJANGO_SQLITE_WRITE_ATTEMPTS', 5))
+SQLITE_RETRY_DELAY = 0.05
+
+# Read replicas as a comma-separated list: SQLite file names in data/db (e.g. "replica.sqlite3"),
+# or "host[:port][/name]" for other engines. Safe requests of the catalog, order and shopping list
+# endpoints read from them; everything else uses the primary.
+DATABASE_REPLICAS = []
+for index, replica in enumerate(filter(None, os.getenv('DJANGO_DB_REPLICAS', '').split(',')), start=1):
+    alias = f'replica_{index}'
+    DATABASES[alias] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+    if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+        DATABASES[alias]['NAME'] = BASE_DIR / 'data' / 'db' / replica.strip()
+    else:
+        address, _, name = replica.strip().partition('/')
+        host, _, port = address.partition(':')
+        DATABASES[alias].update(HOST=host, PORT=port or DATABASES['default']['PORT'],
+                                NAME=name or DATABASES['default']['NAME'])
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['utils.db_routing.ReadReplicaRouter']
+# Seconds a user's reads stay on the primary after a write. Needs a shared cache with several workers.
+DATABASE_REPLICA_PIN_SECONDS = int(os.getenv('DJANGO_DB_REPLICA_PIN_SECONDS', 10))
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# The default local-memory cache is per worker process; configure a shared backend
+# (e.g. django.core.cache.backends.redis.RedisCache) to share caches between workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('DJANGO_CACHE_LOCATION', ''),
+    }
+}
+
+# Seconds a company group's price index stays cached (invalidated on price list changes)
+PRICE_INDEX_CACHE_TIMEOUT = int(os.getenv('DJANGO_PRICE_INDEX_CACHE_TIMEOUT', 300))
+
+# Seconds the user behind a JWT stays cached (invalidated on save). Other workers only see
+# revocations after this time unless DJANGO_CACHE_BACKEND is a shared cache.
+PRINCIPAL_CACHE_TIMEOUT = int(os.getenv('DJANGO_PRINCIPAL_CACHE_TIMEOUT', 60))
+
+# Where throttles keep their token buckets: utils.throttling.LocalBuckets counts per worker
+# and keeps at most THROTTLE_MAX_BUCKETS clients, utils.throttling.CacheBuckets shares the
+# buckets of all workers in the THROTTLE_CACHE cache.
+THROTTLE_BUCKETS = os.getenv('DJANGO_THROTTLE_BUCKETS', 'utils.throttling.LocalBuckets')
+THROTTLE_MAX_BUCKETS = int(os.getenv('DJANGO_THROTTLE_MAX_BUCKETS', 100000))
+THROTTLE_CACHE = os.getenv('DJANGO_THROTTLE_CACHE', 'default')
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -145,6 +238,89 @@ STATIC_ROOT = BASE_DIR / 'data' / 'static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'data' / 'media'
 
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    # Item images are stored once per content under immutable, hash-based names
+    'item_images': {'BACKEND': 'utils.storage.ContentAddressedStorage'},
+}
+
+# Uploaded product feeds, kept outside of MEDIA_ROOT
+IMPORT_FILES_ROOT = BASE_DIR / 'data' / 'imports'
+
+# Run product import jobs in a thread of the web worker. Disable when a dedicated
+# `manage.py process_import_jobs --loop` worker is running.
+IMPORT_JOBS_IN_PROCESS = os.getenv('DJANGO_IMPORT_JOBS_IN_PROCESS', 'True').lower() in ('true', '1', 't')
+# Running jobs without progress for this many seconds are resumed by process_import_jobs
+IMPORT_JOB_STALE_AFTER = int(os.getenv('DJANGO_IMPORT_JOB_STALE_AFTER', 600))
+# Seconds the result of an import preview is kept, older previews are deleted with the next one
+IMPORT_PREVIEW_RETENTION = int(os.getenv('DJANGO_IMPORT_PREVIEW_RETENTION', 3600))
+# Image archives with more members or more uncompressed bytes are rejected before anything is extracted
+IMAGE_IMPORT_MAX_FILES = int(os.getenv('DJANGO_IMAGE_IMPORT_MAX_FILES', 20000))
+IMAGE_IMPORT_MAX_SIZE = int(os.getenv('DJANGO_IMAGE_IMPORT_MAX_SIZE', 2 * 1024 ** 3))
+
+# Serve the hot read endpoints (items, shopping cart, order list) with async views under ASGI
+ASYNC_READ_VIEWS = os.getenv('DJANGO_ASYNC_READ_VIEWS', 'True').lower() in ('true', '1', 't')
+
+# Serve JSON logins and token refreshes with async views that hash passwords in a dedicated
+# thread pool of PASSWORD_HASHING_WORKERS threads. Logins beyond PASSWORD_HASHING_QUEUE waiting
+# hashes are answered with 503 and a Retry-After of PASSWORD_HASHING_RETRY_AFTER seconds.
+ASYNC_LOGIN = os.getenv('DJANGO_ASYNC_LOGIN', 'True').lower() in ('true', '1', 't')
+PASSWORD_HASHING_WORKERS = int(os.getenv('DJANGO_PASSWORD_HASHING_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+PASSWORD_HASHING_QUEUE = int(os.getenv('DJANGO_PASSWORD_HASHING_QUEUE', 64))
+PASSWORD_HASHING_RETRY_AFTER = int(os.getenv('DJANGO_PASSWORD_HASHING_RETRY_AFTER', 2))
+
+# Server-sent events (/web/api/me/events/). EVENT_BROKER distributes the events between the
+# worker processes of a host through Unix sockets in EVENTS_DIR. A stream keeps up to
+# SSE_QUEUE_SIZE undelivered events before it asks the client to resync, and sends a
+# heartbeat every SSE_HEARTBEAT_INTERVAL seconds. Clients reconnect after SSE_RETRY_INTERVAL seconds.
+EVENT_BROKER = os.getenv('DJANGO_EVENT_BROKER', 'utils.events.LocalBroker')
+EVENTS_DIR = Path(os.getenv('DJANGO_EVENTS_DIR', BASE_DIR / 'data' / 'events'))
+SSE_QUEUE_SIZE = int(os.getenv('DJANGO_SSE_QUEUE_SIZE', 100))
+SSE_HEARTBEAT_INTERVAL = int(os.getenv('DJANGO_SSE_HEARTBEAT_INTERVAL', 15))
+SSE_RETRY_INTERVAL = int(os.getenv('DJANGO_SSE_RETRY_INTERVAL', 5))
+
+# Admission control of each uvicorn worker (utils.admission): at most ADMISSION_MAX_CONCURRENCY
+# requests run at once, up to ADMISSION_QUEUE_SIZE more wait by priority class for at most the
+# seconds in ADMISSION_QUEUE_TIMEOUTS. Everything else gets 503 with a Retry-After of
+# ADMISSION_RETRY_AFTER seconds.
+ADMISSION_CONTROL = os.getenv('DJANGO_ADMISSION_CONTROL', 'True').lower() in ('true', '1', 't')
+ADMISSION_MAX_CONCURRENCY = int(os.getenv('DJANGO_ADMISSION_MAX_CONCURRENCY', 32))
+ADMISSION_QUEUE_SIZE = int(os.getenv('DJANGO_ADMISSION_QUEUE_SIZE', 128))
+ADMISSION_QUEUE_TIMEOUTS = {
+    'critical': float(os.getenv('DJANGO_ADMISSION_TIMEOUT_CRITICAL', 10)),
+    'default': float(os.getenv('DJANGO_ADMISSION_TIMEOUT_DEFAULT', 5)),
+    'catalog': float(os.getenv('DJANGO_ADMISSION_TIMEOUT_CATALOG', 2)),
+    'docs': float(os.getenv('DJANGO_ADMISSION_TIMEOUT_DOCS', 1)),
+}
+ADMISSION_RETRY_AFTER = int(os.getenv('DJANGO_ADMISSION_RETRY_AFTER', 2))
+
+# Request metrics: per-process files merged by /web/metrics, which requires
+# "Authorization: Bearer <DJANGO_METRICS_TOKEN>" when a token is set
+METRICS_DIR = os.getenv('DJANGO_METRICS_DIR', BASE_DIR / 'data' / 'metrics')
+METRICS_FLUSH_INTERVAL = 5  # seconds
+METRICS_TOKEN = os.getenv('DJANGO_METRICS_TOKEN', '')
+# Report total, SQL and serializer time of each response in a Server-Timing header
+SERVER_TIMING = os.getenv('DJANGO_SERVER_TIMING', 'True').lower() in ('true', '1', 't')
+
+# Sampling profiler: staff users profile a request with the header "X-Profile: 1" or "?_profile=1",
+# DJANGO_PROFILER_SAMPLE_RATES profiles a random fraction of requests per route name, e.g.
+# "items-list=0.01,my-orders-list=0.05" ("*" for all other routes). Profiles are listed in the admin.
+PROFILER_ENABLED = os.getenv('DJANGO_PROFILER', 'False').lower() in ('true', '1', 't')
+PROFILER_INTERVAL = float(os.getenv('DJANGO_PROFILER_INTERVAL', 0.005))  # seconds between samples
+PROFILER_SAMPLE_RATES = {
+    route.strip(): float(rate)
+    for route, _, rate in (entry.partition('=') for entry in os.getenv('DJANGO_PROFILER_SAMPLE_RATES', '').split(','))
+    if rate
+}
+PROFILER_MAX_PROFILES = 1000
+
+# Versioned OpenAPI schema artifacts, see `manage.py generate_api_schema`
+API_SCHEMA_DIR = BASE_DIR / 'data' / 'schema'
+# The Swagger and ReDoc UIs load the precomputed schema instead of generating it per request
+SWAGGER_SETTINGS = {'SPEC_URL': ('schema-json', {'format': '.json'})}
+REDOC_SETTINGS = {'SPEC_URL': ('schema-json', {'format': '.json'})}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
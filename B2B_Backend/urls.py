@@ -17,13 +17,14 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
-from Webshop.views import default_view
+from Webshop.views import default_view, metrics_view
 
 url_prefix = 'web'
 
 # URL patterns for the project
 urlpatterns = [
     path(f'{url_prefix}/', default_view),
+    path(f'{url_prefix}/metrics', metrics_view, name='metrics'),
     path(f'{url_prefix}/admin/', admin.site.urls),
     path(f'{url_prefix}/api/', include('Webshop.urls')),  # Include app's URLs under /api/
 ]
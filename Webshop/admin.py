@@ -1,11 +1,26 @@
+import csv
+import zipfile
+
+from django.conf import settings
 from django.contrib import admin, messages
-from django.shortcuts import redirect, render
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.core.paginator import Paginator
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect, render
 from django.contrib.auth import get_user_model
-from rest_framework.exceptions import ValidationError
+from django.urls import reverse
+from django.utils.html import format_html, format_html_join
+
+from utils.profiling import hot_functions, parse_collapsed
+from .models import ItemDetails, ItemImage, Item, OrderInfo, Order, OrderItem, CartItem, Address, ImportJob, \
+    ImportJobKind, ImportJobStatus, ItemCategory, CompanyGroup, CompanyGroupMembership, GroupInvitation, ShoppingList, \
+    ShoppingListItem, PriceList, PriceListEntry, RequestProfile
 
-from utils.product_upload import process_product_upload
-from .models import ItemDetails, ItemImage, Item, OrderInfo, Order, OrderItem, CartItem, Address, \
-    ItemCategory, CompanyGroup, CompanyGroupMembership, GroupInvitation, ShoppingList, ShoppingListItem
+IMPORT_PREVIEW_PAGE_SIZE = 50
+
+# The import, export and image modules load pandas, chardet and Pillow. They are only
+# imported by the admin views that use them, to keep them out of every web worker.
 
 
 class ItemImageInline(admin.TabularInline):  # Inline for Item Images
@@ -25,17 +40,29 @@ class ItemDetailsAdmin(admin.ModelAdmin):
     inlines = [ItemImageInline, ItemInline]
     search_fields = ('item_name', 'item_description', 'items__article_id')
     ordering = ('item_name',)
+    actions = ['export_csv', 'export_ndjson']
 
     def get_urls(self):
         from django.urls import path
         urls = super().get_urls()
         custom_urls = [
             path('upload-csv/', self.admin_site.admin_view(self.upload_csv), name='itemdetails_upload_csv'),
+            path('upload-csv/<int:job_id>/preview/', self.admin_site.admin_view(self.import_preview),
+                 name='itemdetails_import_preview'),
+            path('upload-csv/<int:job_id>/', self.admin_site.admin_view(self.import_job_progress),
+                 name='itemdetails_import_job'),
+            path('upload-csv/<int:job_id>/status/', self.admin_site.admin_view(self.import_job_status),
+                 name='itemdetails_import_job_status'),
+            path('upload-csv/<int:job_id>/errors.csv', self.admin_site.admin_view(self.import_job_errors),
+                 name='itemdetails_import_job_errors'),
+            path('upload-images/', self.admin_site.admin_view(self.upload_images), name='itemdetails_upload_images'),
+            path('export/<str:export_format>/', self.admin_site.admin_view(self.export_catalog),
+                 name='itemdetails_export'),
         ]
         return custom_urls + urls
 
     def upload_csv(self, request):
-        """CSV-Upload für Produkte über das Admin-Panel."""
+        """CSV-Upload für Produkte über das Admin-Panel, verarbeitet als Hintergrund-Job."""
         if request.method == "POST":
             csv_file = request.FILES.get("csv_file")
 
@@ -43,23 +70,210 @@ class ItemDetailsAdmin(admin.ModelAdmin):
                 messages.error(request, "Keine Datei hochgeladen!")
                 return redirect("admin:itemdetails_upload_csv")
 
+            replace_stock = bool(request.POST.get("replace_stock"))
+            if request.POST.get("dry_run"):
+                return self._preview_csv(request, csv_file, replace_stock)
+
+            from utils.import_jobs import enqueue_import
+
             try:
-                process_product_upload(csv_file)  # CSV-Datei verarbeiten
-                messages.success(request, "Produkte erfolgreich hochgeladen!")
-                return redirect("admin:Webshop_itemdetails_changelist")
+                job = enqueue_import(csv_file, user=request.user, replace_stock=replace_stock)
+                messages.info(request, "Der Import wurde gestartet.")
+                return redirect("admin:itemdetails_import_job", job_id=job.pk)
+            except Exception as e:
+                messages.error(request, f"Unerwarteter Fehler: {e}")
 
+        return render(request, "admin/csv_upload.html", {"title": "CSV-Upload"})
+
+    def upload_images(self, request):
+        """ZIP-Archiv mit Produktbildern hochladen, verarbeitet als Hintergrund-Job."""
+        context = {"title": "Bilder-Upload", "max_files": settings.IMAGE_IMPORT_MAX_FILES,
+                   "max_size": settings.IMAGE_IMPORT_MAX_SIZE}
+        if request.method == "POST":
+            zip_file = request.FILES.get("zip_file")
+            if not zip_file:
+                messages.error(request, "Keine Datei hochgeladen!")
+                return redirect("admin:itemdetails_upload_images")
+
+            from utils.import_jobs import enqueue_image_import
+
+            try:
+                job = enqueue_image_import(zip_file, user=request.user)
+                messages.info(request, "Der Bilderimport wurde gestartet.")
+                return redirect("admin:itemdetails_import_job", job_id=job.pk)
+            except zipfile.BadZipFile:
+                messages.error(request, "Die Datei ist kein gültiges ZIP-Archiv.")
             except ValidationError as e:
-                messages.error(request, f"Fehler beim Upload: {e}")
+                messages.error(request, e.message)
             except Exception as e:
                 messages.error(request, f"Unerwarteter Fehler: {e}")
 
-        return render(request, "admin/csv_upload.html", {"title": "CSV-Upload"})
+        return render(request, "admin/image_upload.html", context)
+
+    def _preview_csv(self, request, csv_file, replace_stock=False):
+        """Probelauf als Hintergrund-Job, das Ergebnis liegt für alle Worker am Job."""
+        from utils.import_jobs import enqueue_import
+
+        try:
+            job = enqueue_import(csv_file, user=request.user, replace_stock=replace_stock, kind=ImportJobKind.PREVIEW)
+        except Exception as e:
+            messages.error(request, f"Fehler bei der Vorschau: {e}")
+            return redirect("admin:itemdetails_upload_csv")
+        messages.info(request, "Die Vorschau wird berechnet.")
+        return redirect("admin:itemdetails_import_job", job_id=job.pk)
+
+    def import_preview(self, request, job_id):
+        from utils.import_jobs import PreviewChanges
+
+        job = get_object_or_404(ImportJob, pk=job_id, kind=ImportJobKind.PREVIEW)
+        if job.status != ImportJobStatus.COMPLETED:
+            return redirect("admin:itemdetails_import_job", job_id=job.pk)
+        if not job.result_file:
+            messages.error(request, "Die Vorschau ist abgelaufen. Bitte die Datei erneut hochladen.")
+            return redirect("admin:itemdetails_upload_csv")
+
+        page = Paginator(PreviewChanges(job), IMPORT_PREVIEW_PAGE_SIZE).get_page(request.GET.get('page'))
+        return render(request, "admin/import_preview.html", {
+            "title": f"Vorschau: {job.source}",
+            "summary": job.result,
+            "page": page,
+            "changes": page.object_list.to_dict('records'),
+        })
+
+    def import_job_progress(self, request, job_id):
+        job = get_object_or_404(ImportJob, pk=job_id)
+        return render(request, "admin/import_job.html", {"title": f"Import: {job.source}", "job": job})
+
+    def import_job_status(self, request, job_id):
+        """Lightweight progress endpoint polled by the import job page."""
+        job = get_object_or_404(ImportJob.objects.defer('errors'), pk=job_id)
+        return JsonResponse({
+            'status': job.status,
+            'status_display': job.get_status_display(),
+            'finished': job.is_finished,
+            'rows_processed': job.rows_processed,
+            'rows_created': job.rows_created,
+            'rows_updated': job.rows_updated,
+            'rows_invalid': job.rows_invalid,
+            'throughput': round(job.throughput, 1),
+            'error_message': job.error_message,
+            'preview_url': reverse('admin:itemdetails_import_preview', args=[job.pk])
+            if job.kind == ImportJobKind.PREVIEW and job.status == ImportJobStatus.COMPLETED else None,
+        })
+
+    def import_job_errors(self, request, job_id):
+        job = get_object_or_404(ImportJob, pk=job_id)
+        response = HttpResponse(content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="import-{job.pk}-fehler.csv"'
+        writer = csv.writer(response, delimiter=';')
+        writer.writerow(['datei' if job.kind == ImportJobKind.IMAGES else 'zeile', 'fehler'])
+        writer.writerows(job.errors)
+        return response
+
+    def export_catalog(self, request, export_format):
+        """Gesamten Katalog im Importformat herunterladen."""
+        from utils.product_export import EXPORT_FORMATS
+
+        if export_format not in EXPORT_FORMATS:
+            raise Http404
+        return self._export_response(request, export_format)
+
+    def export_csv(self, request, queryset):
+        return self._export_response(request, 'csv', queryset)
+
+    export_csv.short_description = "Ausgewählte Produkte als CSV exportieren"
+
+    def export_ndjson(self, request, queryset):
+        return self._export_response(request, 'ndjson', queryset)
+
+    export_ndjson.short_description = "Ausgewählte Produkte als NDJSON exportieren"
+
+    def _export_response(self, request, export_format, queryset=None):
+        """
+        Stream the export page by page. Under ASGI the async variant is used, since Django
+        would otherwise read a sync iterator completely into memory before sending it.
+        """
+        from utils.product_export import EXPORT_FORMATS, aexport_catalog, export_catalog
+
+        item_ids = None if queryset is None else Item.objects.filter(item_details__in=queryset).values('item_id')
+        export = aexport_catalog if isinstance(request, ASGIRequest) else export_catalog
+        response = StreamingHttpResponse(export(export_format, item_ids=item_ids),
+                                         content_type=EXPORT_FORMATS[export_format])
+        response['Content-Disposition'] = f'attachment; filename="produkte.{export_format}"'
+        return response
 
     def changelist_view(self, request, extra_context=None):
         extra_context = extra_context or {}
         extra_context['upload_form'] = True
         return super().changelist_view(request, extra_context)
 
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('source', 'kind', 'status', 'rows_processed', 'rows_created', 'rows_updated', 'rows_invalid',
+                    'created_by', 'created_at', 'progress_link')
+    list_filter = ('kind', 'status')
+    search_fields = ('source',)
+    ordering = ('-created_at',)
+    exclude = ('errors', 'file', 'result_file')
+    readonly_fields = [field.name for field in ImportJob._meta.fields
+                       if field.name not in ('errors', 'file', 'result_file')]
+
+    def has_add_permission(self, request):
+        return False
+
+    def progress_link(self, obj):
+        return format_html('<a href="{}">Fortschritt</a>', reverse('admin:itemdetails_import_job', args=[obj.pk]))
+
+    progress_link.short_description = 'Fortschritt'
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('route', 'method', 'status_code', 'duration_ms', 'sample_count', 'trigger', 'user', 'created_at',
+                    'download_link')
+    list_filter = ('trigger', 'method', 'route')
+    search_fields = ('path', 'route')
+    ordering = ('-created_at',)
+    exclude = ('stacks',)
+    readonly_fields = [field.name for field in RequestProfile._meta.fields if field.name != 'stacks'] \
+        + ['hot_functions', 'download_link']
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_urls(self):
+        from django.urls import path
+        custom_urls = [
+            path('<int:profile_id>/stacks.folded', self.admin_site.admin_view(self.download_stacks),
+                 name='webshop_requestprofile_stacks'),
+        ]
+        return custom_urls + super().get_urls()
+
+    def download_stacks(self, request, profile_id):
+        """Stacks im Collapsed-Format für flamegraph.pl oder speedscope.app."""
+        profile = get_object_or_404(RequestProfile, pk=profile_id)
+        response = HttpResponse(profile.stacks, content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="profile-{profile.pk}-{profile.route}.folded"'
+        return response
+
+    def download_link(self, obj):
+        return format_html('<a href="{}">Stacks</a>', reverse('admin:webshop_requestprofile_stacks', args=[obj.pk]))
+
+    download_link.short_description = 'Flamegraph'
+
+    def hot_functions(self, obj):
+        rows = hot_functions(parse_collapsed(obj.stacks))
+        if not rows:
+            return '-'
+        return format_html(
+            '<table><tr><th>Funktion</th><th>Samples</th><th>Anteil</th></tr>{}</table>',
+            format_html_join('', '<tr><td>{}</td><td>{}</td><td>{} %</td></tr>', (
+                (function, samples, f"{samples * 100 / obj.sample_count:.1f}") for function, samples in rows
+            )),
+        )
+
+    hot_functions.short_description = 'Meiste Samples (Self)'
+
+
 @admin.register(ItemCategory)
 class ItemCategoryAdmin(admin.ModelAdmin):
     list_display = ('category_name',)
@@ -158,12 +372,37 @@ class ShoppingListAdmin(admin.ModelAdmin):
     search_fields = ('title', 'group__name', 'created_by__email')
     inlines = [ShoppingListItemInline]
     list_display = ('title', 'created_by', 'created_at', 'status', 'number_of_items')
+    actions = ['convert_to_orders']
 
     def number_of_items(self, obj):
         return obj.shopping_list_items.count()
 
     number_of_items.short_description = 'Anzahl der Artikel'
 
+    @admin.action(description='Freigegebene Einkaufslisten in Bestellungen umwandeln')
+    def convert_to_orders(self, request, queryset):
+        try:
+            order_ids = Order.objects.create_from_shopping_lists(queryset.values_list('pk', flat=True))
+        except ValueError as e:
+            messages.error(request, f"Fehler beim Umwandeln: {e}")
+            return
+        messages.success(request, f"{len(order_ids)} Bestellung(en) angelegt: "
+                                  f"{', '.join(str(order_id) for order_id in order_ids.values())}")
+
+class PriceListEntryInline(admin.TabularInline):
+    model = PriceListEntry
+    extra = 1
+    fields = ('item', 'category', 'min_quantity', 'price', 'discount_percent')
+    autocomplete_fields = ('category',)
+    raw_id_fields = ('item',)
+
+@admin.register(PriceList)
+class PriceListAdmin(admin.ModelAdmin):
+    list_display = ('name', 'group', 'is_active', 'valid_from', 'valid_until')
+    list_filter = ('is_active',)
+    search_fields = ('name', 'group__name')
+    inlines = [PriceListEntryInline]
+
 @admin.register(GroupInvitation)
 class GroupInvitationAdmin(admin.ModelAdmin):
     list_display = ('email', 'group', 'invited_by', 'status', 'created_at')
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class WebshopConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Webshop'
+
+    def ready(self):
+        from . import signals  # noqa: F401
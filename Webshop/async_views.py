@@ -0,0 +1,368 @@
+"""
+Async implementations of the hot read endpoints and of the JWT login for the ASGI deployment.
+
+The views authenticate bearer tokens, load their data with the async ORM and
+serialize prefetched objects without further queries, so a request does not
+occupy a thread for its whole lifetime. Everything outside of this happy path,
+e.g. writes, the browsable API, session authentication, invalid tokens,
+invalid filters and missing objects, is delegated to the regular DRF viewset,
+which produces the exact same responses as before. JSON logins and refreshes work
+the same way, with the password hashing in the pool of utils.password_hashing.
+The event stream pushes order status and stock changes as server-sent events, an
+idle connection only holds a coroutine and a queue of utils.events.
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, update_last_login
+from django.db import connections
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import path, re_path
+from django.utils.module_loading import import_string
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import (
+    APIException, AuthenticationFailed, MethodNotAllowed, NotAuthenticated, Throttled, ValidationError,
+)
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.views import TokenRefreshView
+
+from utils.db_routing import can_read_from_replica, replica_reads
+from utils.events import get_broker, item_topic, user_topic
+from utils.password_hashing import HashingPoolFull, amake_password, averify_password
+from utils.pricing import PriceResolver
+from utils.principals import aget_principal, token_version
+from .authentication import CachedJWTAuthentication
+from .models import CartItem, CustomUser
+from .serializers import ItemSerializer, OrderSerializer, ShoppingCartSerializer
+from .throttling import DEFAULT_SCOPE, throttle_wait
+from .views import ItemViewSet, LoginView, OrderViewSet, ShoppingCartViewSet
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+class Fallback(Exception):
+    """Raised by an async handler to let the sync viewset answer the request."""
+
+
+async def authenticate(request):
+    """
+    Return the user of a bearer token, AnonymousUser for requests without credentials,
+    or None if the request has to be authenticated by DRF (session, bad token).
+    """
+    header = request.headers.get('Authorization')
+    if header is None:
+        if settings.SESSION_COOKIE_NAME in request.COOKIES:
+            return None
+        return AnonymousUser()
+
+    authentication = CachedJWTAuthentication()
+    raw_token = authentication.get_raw_token(header.encode())
+    if raw_token is None:
+        return None
+    try:
+        token = authentication.get_validated_token(raw_token)
+        user_id = token[jwt_settings.USER_ID_CLAIM]
+    except (InvalidToken, TokenError, KeyError):
+        return None
+
+    try:
+        return authentication.check_user(await aget_principal(user_id, token_version(token)), token)
+    except AuthenticationFailed:
+        return None
+
+
+def async_read_view(handler, fallback, replica=False):
+    """
+    Build a view that answers JSON GET requests with `handler` and everything else with
+    the sync `fallback` view generated by the router. With `replica` the handler reads
+    from the read replicas like the ReplicaReadMixin viewsets.
+    """
+    fallback = sync_to_async(fallback)
+
+    async def view(request, *args, **kwargs):
+        if request.method in READ_METHODS and request.GET.get('format', 'json') == 'json' \
+                and 'text/html' not in request.headers.get('Accept', ''):
+            user = await authenticate(request)
+            if user is not None:
+                use_replica = replica and bool(settings.DATABASE_REPLICAS) \
+                    and await sync_to_async(can_read_from_replica)(request, user)
+                try:
+                    with replica_reads(use_replica):
+                        return await handler(request, user, *args, **kwargs)
+                except Throttled as exc:
+                    return throttled_json_response(exc.wait)
+                except (Fallback, APIException):
+                    pass
+        return await fallback(request, *args, **kwargs)
+
+    return csrf_exempt(view)
+
+
+def get_viewset(viewset_class, request, user, action, **kwargs):
+    """
+    Instantiate a viewset like DRF does for a dispatched request, to reuse its
+    queryset, filters and serializer configuration without going through dispatch.
+    Throttles are left to `check_throttles`.
+    """
+    drf_request = Request(request)
+    drf_request.user = user
+    viewset = viewset_class(request=drf_request, args=(), kwargs=kwargs, action=action, format_kwarg=None)
+    viewset.headers = {}
+    for permission in viewset.get_permissions():
+        if not permission.has_permission(drf_request, viewset):
+            raise Fallback
+    return viewset
+
+
+def check_throttles(viewset):
+    """
+    Run the viewset's throttles. Handlers call it once they no longer fall back, as the
+    sync view charges the request again.
+    """
+    for throttle in viewset.get_throttles():
+        if not throttle.allow_request(viewset.request, viewset):
+            raise Throttled(throttle.wait())
+
+
+async def get_serializer_context(viewset, user):
+    context = viewset.get_serializer_context()
+    context['price_resolver'] = await sync_to_async(PriceResolver.for_user)(user)
+    return context
+
+
+def json_response(data, status=200, allow='GET, HEAD, OPTIONS'):
+    response = HttpResponse(JSONRenderer().render(data), content_type='application/json', status=status)
+    response['Vary'] = 'Accept'
+    response['Allow'] = allow
+    return response
+
+
+def throttled_json_response(wait, allow='GET, HEAD, OPTIONS'):
+    """The response of DRF's exception handler for Throttled."""
+    exc = Throttled(wait)
+    response = json_response({'detail': exc.detail}, status=exc.status_code, allow=allow)
+    response['Retry-After'] = str(exc.wait)
+    return response
+
+
+async def item_list(request, user):
+    viewset = get_viewset(ItemViewSet, request, user, 'list')
+    check_throttles(viewset)
+    items = [item async for item in viewset.filter_queryset(viewset.get_queryset())]
+    context = await get_serializer_context(viewset, user)
+    return json_response(ItemSerializer(items, many=True, context=context).data)
+
+
+async def item_detail(request, user, pk):
+    viewset = get_viewset(ItemViewSet, request, user, 'retrieve', pk=pk)
+    item = await viewset.filter_queryset(viewset.get_queryset()).filter(pk=pk).afirst()
+    if item is None:
+        raise Fallback
+    check_throttles(viewset)
+    context = await get_serializer_context(viewset, user)
+    return json_response(ItemSerializer(item, context=context).data)
+
+
+async def shopping_cart_list(request, user):
+    viewset = get_viewset(ShoppingCartViewSet, request, user, 'list')
+    check_throttles(viewset)
+    carts = [cart async for cart in viewset.filter_queryset(viewset.get_queryset())]
+    context = await get_serializer_context(viewset, user)
+    # Load the categories needed for negotiated prices before serializing
+    await sync_to_async(context['price_resolver'].prime)(
+        cart_item.item for cart in carts for cart_item in cart.cartitem_set.all()
+    )
+    return json_response(ShoppingCartSerializer(carts, many=True, context=context).data)
+
+
+async def order_list(request, user):
+    viewset = get_viewset(OrderViewSet, request, user, 'list')
+    check_throttles(viewset)
+    orders = [order async for order in viewset.filter_queryset(viewset.get_queryset())]
+    context = await get_serializer_context(viewset, user)
+    return json_response(OrderSerializer(orders, many=True, context=context).data)
+
+
+def async_read_urls(router, me_router):
+    """
+    URL patterns of the async read views. They are matched before the router URLs and
+    fall back to the router's own views, so all other behaviour stays unchanged. They
+    carry the route names of the router URLs they replace.
+    """
+    views = {pattern.name: pattern.callback for urls in (router.urls, me_router.urls) for pattern in urls}
+    return [
+        re_path(r'^items/$', async_read_view(item_list, views['items-list'], replica=True), name='items-list'),
+        re_path(r'^items/(?P<pk>[^/.]+)/$', async_read_view(item_detail, views['items-detail'], replica=True),
+                name='items-detail'),
+        re_path(r'^me/shopping-cart/$', async_read_view(shopping_cart_list, views['my-shoppingcart-list']),
+                name='my-shoppingcart-list'),
+        re_path(r'^me/orders/$', async_read_view(order_list, views['my-orders-list'], replica=True),
+                name='my-orders-list'),
+    ]
+
+
+def async_token_view(handler, fallback):
+    """
+    Build a view that answers JSON POST requests with `handler` and everything else
+    (forms, the browsable API, invalid input) with the sync simplejwt `fallback` view.
+    """
+    fallback = sync_to_async(fallback)
+
+    async def view(request, *args, **kwargs):
+        if request.method == 'POST' and request.content_type == 'application/json':
+            try:
+                return await handler(request, json.loads(request.body))
+            except (ValueError, Fallback):
+                pass
+        return await fallback(request, *args, **kwargs)
+
+    return csrf_exempt(view)
+
+
+def token_error_response(serializer_class, status=401):
+    response = json_response({'detail': str(serializer_class.default_error_messages['no_active_account'])},
+                             status=status, allow='POST, OPTIONS')
+    response['WWW-Authenticate'] = f'{jwt_settings.AUTH_HEADER_TYPES[0]} realm="api"'
+    return response
+
+
+async def token_obtain_pair(request, data):
+    """TokenObtainPairView, with ModelBackend's password check and hash upgrade done in the hashing pool."""
+    serializer_class = import_string(jwt_settings.TOKEN_OBTAIN_SERIALIZER)
+    try:
+        attrs = serializer_class().to_internal_value(data)
+    except ValidationError:
+        raise Fallback
+    password = attrs['password']
+    # Throttled like LoginView, before any password is hashed
+    wait = throttle_wait(LoginView.throttle_scope, request)
+    if wait:
+        return throttled_json_response(wait, allow='POST, OPTIONS')
+
+    try:
+        user = await CustomUser._default_manager.filter(
+            **{CustomUser.USERNAME_FIELD: attrs[CustomUser.USERNAME_FIELD]}).afirst()
+        if user is None:
+            # Hash anyway, so unknown e-mail addresses take as long as wrong passwords
+            await amake_password(password, operation='dummy')
+            return token_error_response(serializer_class)
+        is_correct, must_update = await averify_password(password, user.password)
+        if not is_correct or not jwt_settings.USER_AUTHENTICATION_RULE(user):
+            return token_error_response(serializer_class)
+        if must_update:
+            user.password = await amake_password(password)
+            await user.asave(update_fields=['password'])
+    except HashingPoolFull:
+        response = json_response({'detail': "Zu viele gleichzeitige Anmeldungen, bitte später erneut versuchen."},
+                                 status=503, allow='POST, OPTIONS')
+        response['Retry-After'] = settings.PASSWORD_HASHING_RETRY_AFTER
+        return response
+
+    refresh = serializer_class.get_token(user)
+    if jwt_settings.UPDATE_LAST_LOGIN:
+        await sync_to_async(update_last_login)(None, user)
+    return json_response({'refresh': str(refresh), 'access': str(refresh.access_token)}, allow='POST, OPTIONS')
+
+
+async def token_refresh(request, data):
+    """TokenRefreshView with the user from the principal cache. Rotation and blacklisting stay with simplejwt."""
+    if jwt_settings.ROTATE_REFRESH_TOKENS:
+        raise Fallback
+    serializer_class = import_string(jwt_settings.TOKEN_REFRESH_SERIALIZER)
+    try:
+        refresh = serializer_class.token_class(serializer_class().to_internal_value(data)['refresh'])
+    except (ValidationError, TokenError):
+        raise Fallback
+
+    user_id = refresh.payload.get(jwt_settings.USER_ID_CLAIM)
+    user = await aget_principal(user_id, token_version(refresh)) if user_id else None
+    if user_id and user is None:
+        raise Fallback
+    # Throttled like the sync TokenRefreshView, once this view answers
+    wait = throttle_wait(getattr(TokenRefreshView, 'throttle_scope', None) or DEFAULT_SCOPE, request)
+    if wait:
+        return throttled_json_response(wait, allow='POST, OPTIONS')
+    # A raised token_version revokes the refresh tokens issued before, like the access tokens
+    if user is not None and (not jwt_settings.USER_AUTHENTICATION_RULE(user)
+                             or user.token_version != token_version(refresh)):
+        return token_error_response(serializer_class)
+    return json_response({'access': str(refresh.access_token)}, allow='POST, OPTIONS')
+
+
+def async_auth_urls(auth_patterns):
+    """URL patterns of the async login and refresh, to be matched before the simplejwt views they fall back to."""
+    views = {pattern.name: pattern.callback for pattern in auth_patterns}
+    return [
+        path('login/', async_token_view(token_obtain_pair, views['token_obtain_pair']), name='token_obtain_pair'),
+        path('refresh/', async_token_view(token_refresh, views['token_refresh']), name='token_refresh'),
+    ]
+
+
+def server_sent_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+# Not in the thread of the request, which stays alive as long as the stream and keeps the memory of deep calls
+@sync_to_async(thread_sensitive=False)
+def event_topics(user):
+    """The topics of a user's stream: their orders and the stock of the items in their cart."""
+    try:
+        item_ids = CartItem.objects.filter(cart__user=user).values_list('item_id', flat=True)
+        return {user_topic(user.pk)} | {item_topic(item_id) for item_id in item_ids}
+    finally:
+        # Streams are rare and long-lived, the pool threads should not keep a connection for them
+        connections.close_all()
+
+
+async def events(user):
+    subscription = get_broker().subscribe(await event_topics(user))
+    try:
+        yield f"retry: {settings.SSE_RETRY_INTERVAL * 1000}\n" + server_sent_event('ready', {'user_id': user.pk})
+        while True:
+            try:
+                _, data = await asyncio.wait_for(subscription.get(), settings.SSE_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing the idle connection
+                yield ": heartbeat\n\n"
+                continue
+            if subscription.overflowed:
+                # Events were lost, the client reloads its data and reconnects
+                yield server_sent_event('resync', {})
+                return
+            if data['type'] == 'cart':
+                subscription.update(await event_topics(user))
+            yield server_sent_event(data['type'], data)
+    finally:
+        subscription.close()
+
+
+@csrf_exempt
+async def event_stream(request):
+    """
+    Server-sent events for the authenticated user: `order_status` when one of their
+    orders is placed or changes its status, `item_stock` when the stock of an item in
+    their cart changes and `cart` when the cart itself changes. A `resync` event ends
+    the stream when the client did not keep up, it then reloads and reconnects.
+    """
+    if request.method != 'GET':
+        detail = MethodNotAllowed.default_detail.format(method=request.method)
+        return json_response({'detail': detail}, status=405, allow='GET')
+    user = await authenticate(request)
+    if user is None and hasattr(request, 'auser'):
+        # Session authentication of the browser stack
+        user = await request.auser()
+    if user is None or not user.is_authenticated:
+        response = json_response({'detail': str(NotAuthenticated.default_detail)}, status=401, allow='GET')
+        response['WWW-Authenticate'] = f'{jwt_settings.AUTH_HEADER_TYPES[0]} realm="api"'
+        return response
+
+    response = StreamingHttpResponse(events(user), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Let nginx pass every event on immediately instead of buffering the response
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,32 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from utils.principals import get_principal, token_version
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that takes the user from the principal cache instead of querying it
+    on every request, and rejects tokens issued before the last token_version change of the
+    user (password change, deactivation).
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        return self.check_user(get_principal(user_id, token_version(validated_token)), validated_token)
+
+    @staticmethod
+    def check_user(user, validated_token):
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code='user_inactive')
+        if user.token_version != token_version(validated_token):
+            raise AuthenticationFailed(_("Das Token wurde widerrufen."), code='token_revoked')
+        return user
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.product_export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, export_catalog
+
+
+class Command(BaseCommand):
+    help = "Export the full catalog in the format of import_products, as ';'-separated CSV or NDJSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help="Output file, stdout if omitted")
+        parser.add_argument('--format', dest='export_format', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE, help="Rows per query")
+
+    def handle(self, *args, **options):
+        blocks = export_catalog(options['export_format'], chunk_size=options['chunk_size'])
+        if not options['path']:
+            for block in blocks:
+                self.stdout.write(block, ending='')
+            return
+
+        try:
+            with open(options['path'], 'w', encoding='utf-8', newline='') as file:
+                file.writelines(blocks)
+        except OSError as e:
+            raise CommandError(e)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from utils.api_schema import SCHEMA_FORMATS, generate_schema, schema_path, schema_version, write_schema
+
+
+class Command(BaseCommand):
+    help = "Generate the OpenAPI schema artifacts of the current code version, served by /swagger.json and /swagger.yaml."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Regenerate even if the artifacts exist")
+
+    def handle(self, *args, **options):
+        if not options['force'] and all(schema_path(schema_format).exists() for schema_format in SCHEMA_FORMATS):
+            self.stdout.write(f"Schema version {schema_version()} is up to date.")
+            return
+        write_schema(generate_schema())
+        self.stdout.write(self.style.SUCCESS(f"Generated schema version {schema_version()}."))
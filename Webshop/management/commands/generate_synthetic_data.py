@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.synthetic_data import SYNTHETIC_PASSWORD, generate_synthetic_data
+
+
+class Command(BaseCommand):
+    help = ("Fill the database with a reproducible synthetic dataset for benchmarks and load tests. "
+            "All sizes are multiplied by --scale.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1, help="Factor for all sizes")
+        parser.add_argument('--items', type=int, default=1000)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--years', type=int, default=2, help="Years of order history")
+        parser.add_argument('--orders-per-month', type=float, default=2, help="Average orders per user and month")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, equal seeds give equal datasets")
+
+    def handle(self, *args, **options):
+        scale = options['scale']
+        try:
+            counts = generate_synthetic_data(
+                items=round(options['items'] * scale),
+                categories=max(1, round(options['categories'] * scale ** 0.5)),
+                users=round(options['users'] * scale),
+                groups=round(options['groups'] * scale),
+                years=options['years'],
+                orders_per_month=options['orders_per_month'],
+                seed=options['seed'],
+                log=self.stdout.write,
+            )
+        except ValueError as e:
+            raise CommandError(e)
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {sum(counts.values())} rows. Users log in as synthetic-<n>@example.com "
+            f"with the password '{SYNTHETIC_PASSWORD}'."
+        ))
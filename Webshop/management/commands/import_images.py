@@ -0,0 +1,35 @@
+import zipfile
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.image_import import IMAGE_IMPORT_WORKERS, import_images_from_zip
+from utils.image_processing import MAX_IMAGE_EDGE
+
+
+class Command(BaseCommand):
+    help = "Attach the images of a ZIP archive to items, matched by article_id in the file names (P001.jpg, P001_2.jpg)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Path of the ZIP archive")
+        parser.add_argument('--workers', type=int, default=IMAGE_IMPORT_WORKERS, help="Image processing processes")
+        parser.add_argument('--max-edge', type=int, default=MAX_IMAGE_EDGE,
+                            help="Maximum width and height of the stored images in pixels")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], 'rb') as file:
+                stats = import_images_from_zip(file, max_edge=options['max_edge'], workers=options['workers'])
+        except (OSError, zipfile.BadZipFile) as e:
+            raise CommandError(e)
+        except ValidationError as e:
+            raise CommandError(e.message)
+
+        for name in stats['unmatched']:
+            self.stderr.write(f"{name}: no item with this article_id")
+        for error in stats['invalid']:
+            self.stderr.write(error)
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['files']} images: {stats['created']} attached, {stats['existing']} already attached, "
+            f"{stats['duplicates']} duplicates, {len(stats['unmatched'])} unmatched, {len(stats['invalid'])} invalid."
+        ))
@@ -0,0 +1,58 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.product_upload import STREAM_CHUNK_SIZE, preview_product_upload, stream_product_upload
+
+
+class Command(BaseCommand):
+    help = "Import a product CSV file in chunks with bounded memory. Unfinished imports of the same file are resumed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Path of the ';'-separated product CSV file")
+        parser.add_argument('--chunk-size', type=int, default=STREAM_CHUNK_SIZE,
+                            help="Rows per chunk and transaction")
+        parser.add_argument('--no-resume', action='store_true',
+                            help="Start from the beginning even if an unfinished import of this file exists")
+        parser.add_argument('--replace-stock', action='store_true',
+                            help="Set the stock to the value of the file instead of adding it, e.g. for edited exports")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only show what the import would change, without writing to the database")
+        parser.add_argument('--limit', type=int, default=50, help="Changes to list with --dry-run")
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            return self.preview(options)
+
+        try:
+            with open(options['path'], 'rb') as file:
+                stats = stream_product_upload(
+                    file,
+                    source=options['path'],
+                    chunk_size=options['chunk_size'],
+                    resume=not options['no_resume'],
+                    replace_stock=options['replace_stock'],
+                )
+        except (OSError, ValidationError) as e:
+            raise CommandError(e)
+
+        for error in stats['errors']:
+            self.stderr.write(error)
+        if stats['resumed_at_row']:
+            self.stdout.write(f"Resumed after row {stats['resumed_at_row']}.")
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['rows']} rows imported: {stats['created']} created, {stats['updated']} updated, "
+            f"{stats['categories_created']} new categories, {stats['invalid_rows']} invalid rows skipped."
+        ))
+
+    def preview(self, options):
+        try:
+            with open(options['path'], 'rb') as file:
+                summary, changes = preview_product_upload(file, chunk_size=options['chunk_size'],
+                                                          replace_stock=options['replace_stock'])
+        except (OSError, ValidationError) as e:
+            raise CommandError(e)
+
+        for key, value in summary.items():
+            self.stdout.write(f"{key}: {', '.join(value) if isinstance(value, list) else value}")
+        if not changes.empty:
+            self.stdout.write(changes.head(options['limit']).to_string(index=False))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from utils.import_jobs import claim_job, claimable_job_ids, run_import_job
+
+
+class Command(BaseCommand):
+    help = "Run pending product import jobs and resume jobs whose worker stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep polling for new jobs")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds between polls with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            for job_id in claimable_job_ids():
+                if claim_job(job_id):
+                    self.stdout.write(f"Running import job {job_id}")
+                    run_import_job(job_id)
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
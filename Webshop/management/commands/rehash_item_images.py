@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from utils.storage import ContentAddressedStorage
+from Webshop.models import ItemImage
+from Webshop.signals import release_item_image_file
+
+
+class Command(BaseCommand):
+    help = "Move item images stored under their upload names to content-addressed names and remove duplicate files."
+
+    def handle(self, *args, **options):
+        storage = ItemImage._meta.get_field('image').storage
+        renamed = missing = 0
+        old_names = set()
+
+        for image in ItemImage.objects.order_by('pk').iterator():
+            name = image.image.name
+            if ContentAddressedStorage.content_hash(name):
+                continue
+            if not storage.exists(name):
+                self.stderr.write(f"{name}: file not found")
+                missing += 1
+                continue
+
+            # Rows first, then the file, like every other writer of the storage
+            with storage.open(name) as file:
+                new_name = storage.hashed_name(name, file)
+                ItemImage.objects.filter(image=name).update(
+                    image=new_name, content_hash=ContentAddressedStorage.content_hash(new_name)
+                )
+                storage.save(new_name, file)
+            old_names.add(name)
+            renamed += 1
+
+        for name in old_names:
+            release_item_image_file(name)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{renamed} files moved to content-addressed names, {missing} missing files."
+        ))
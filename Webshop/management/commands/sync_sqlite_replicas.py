@@ -0,0 +1,27 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ("Copy the SQLite primary database into the replica files configured with DJANGO_DB_REPLICAS. "
+            "Stands in for replication when testing read replicas locally.")
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES['default']
+        if primary['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError("Only SQLite databases can be copied, other engines replicate themselves.")
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("No replicas configured, set DJANGO_DB_REPLICAS.")
+
+        with sqlite3.connect(primary['NAME']) as source:
+            for alias in settings.DATABASE_REPLICAS:
+                name = settings.DATABASES[alias]['NAME']
+                with sqlite3.connect(name) as target:
+                    # The backup API copies a consistent snapshot, even while the primary is in use
+                    source.backup(target)
+                target.close()
+                self.stdout.write(f"{alias}: {name}")
+        source.close()
+        self.stdout.write(self.style.SUCCESS(f"{len(settings.DATABASE_REPLICAS)} replicas updated."))
@@ -0,0 +1,244 @@
+import threading
+import time
+from importlib import import_module
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.exceptions import MiddlewareNotUsed
+from django.middleware.clickjacking import XFrameOptionsMiddleware
+from django.middleware.csrf import CsrfViewMiddleware
+from django.utils.decorators import sync_and_async_middleware
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from utils.db_routing import pin_to_primary
+from utils.metrics import REGISTRY, measure_request, record_request
+from utils.principals import aget_principal, token_version
+from utils.profiling import StackSampler, requested_profile, sampled_profile, store_profile
+from .authentication import CachedJWTAuthentication
+from .models import CustomUser, ProfileTrigger
+
+
+def _record_metrics(request, response, metrics):
+    total = record_request(request, response, metrics)
+    if settings.SERVER_TIMING:
+        response['Server-Timing'] = metrics.server_timing(total)
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """
+    Measure total time, SQL queries, serializer time and response size of every request,
+    aggregate them per route name for /web/metrics and report them in a Server-Timing header.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            REGISTRY.start_flusher()
+            with measure_request() as metrics:
+                response = await get_response(request)
+            _record_metrics(request, response, metrics)
+            return response
+    else:
+        def middleware(request):
+            REGISTRY.start_flusher()
+            with measure_request() as metrics:
+                response = get_response(request)
+            _record_metrics(request, response, metrics)
+            return response
+    return middleware
+
+
+def _bearer_token(request):
+    """The validated JWT of the Authorization header, None if there is none or it is invalid."""
+    authentication = CachedJWTAuthentication()
+    raw_token = authentication.get_raw_token(request.META['HTTP_AUTHORIZATION'].encode())
+    if raw_token is None:
+        return None
+    try:
+        return authentication.get_validated_token(raw_token)
+    except InvalidToken:
+        return None
+
+
+def _session_store(session_key):
+    return import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+
+
+def _staff_users(user_id):
+    return CustomUser.objects.filter(pk=user_id, is_staff=True, is_active=True)
+
+
+def _requested_by_staff(request):
+    """
+    Whether a request that asks to be profiled comes from a staff user, by its bearer
+    token or session cookie. It runs before authentication, so requests of other
+    clients do not start a sampler; the authenticated user is checked again afterwards.
+    """
+    if 'HTTP_AUTHORIZATION' in request.META:
+        token = _bearer_token(request)
+        try:
+            return token is not None and CachedJWTAuthentication().get_user(token).is_staff
+        except (InvalidToken, AuthenticationFailed):
+            return False
+    session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not session_key:
+        return False
+    user_id = _session_store(session_key).get(SESSION_KEY)
+    return user_id is not None and _staff_users(user_id).exists()
+
+
+async def _arequested_by_staff(request):
+    """_requested_by_staff without leaving the event loop."""
+    if 'HTTP_AUTHORIZATION' in request.META:
+        token = _bearer_token(request)
+        if token is None:
+            return False
+        try:
+            user_id = token[jwt_settings.USER_ID_CLAIM]
+            user = CachedJWTAuthentication.check_user(await aget_principal(user_id, token_version(token)), token)
+        except (KeyError, AuthenticationFailed):
+            return False
+        return user.is_staff
+    session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not session_key:
+        return False
+    user_id = await _session_store(session_key).aget(SESSION_KEY)
+    return user_id is not None and await _staff_users(user_id).aexists()
+
+
+def _profile_trigger(request, requested):
+    if requested:
+        return ProfileTrigger.REQUESTED
+    if sampled_profile(request):
+        return ProfileTrigger.SAMPLED
+    return None
+
+
+def _profile(get_response, request, trigger, thread_ids=()):
+    sampler = StackSampler({threading.get_ident(), *thread_ids}, settings.PROFILER_INTERVAL).start()
+    start = time.perf_counter()
+    try:
+        response = get_response(request)
+    finally:
+        stacks = sampler.stop()
+    duration = time.perf_counter() - start
+
+    # Checked again with the authenticated user, requested profiles of other users are discarded
+    user = getattr(request, 'user', None)
+    if trigger == ProfileTrigger.REQUESTED and not (user is not None and user.is_staff):
+        return response
+    response['X-Profile-Id'] = store_profile(request, response, stacks, duration, trigger).pk
+    return response
+
+
+@sync_and_async_middleware
+def profiler_middleware(get_response):
+    """
+    Profile requests of staff users that ask for it and a sample of all requests per
+    route with a StackSampler and store the stacks as RequestProfile.
+    Only active with PROFILER_ENABLED.
+    """
+    if not settings.PROFILER_ENABLED:
+        raise MiddlewareNotUsed
+
+    if iscoroutinefunction(get_response):
+        sync_get_response = async_to_sync(get_response)
+
+        async def middleware(request):
+            trigger = _profile_trigger(request, requested_profile(request) and await _arequested_by_staff(request))
+            if trigger is None:
+                return await get_response(request)
+            # Sync views of a profiled request run in the thread of this sync_to_async call,
+            # async code in the event loop thread, so both are sampled
+            return await sync_to_async(_profile)(sync_get_response, request, trigger, (threading.get_ident(),))
+    else:
+        def middleware(request):
+            trigger = _profile_trigger(request, requested_profile(request) and _requested_by_staff(request))
+            if trigger is None:
+                return get_response(request)
+            return _profile(get_response, request, trigger)
+    return middleware
+
+
+def _wrote(request, response):
+    user = getattr(request, 'user', None)
+    return (request.method not in SAFE_METHODS and response.status_code < 400
+            and user is not None and user.is_authenticated)
+
+
+@sync_and_async_middleware
+def primary_pin_middleware(get_response):
+    """
+    After a successful write, keep the reads of the user on the primary database for
+    DATABASE_REPLICA_PIN_SECONDS, so they see their own changes despite replication lag.
+    Only active when read replicas are configured.
+    """
+    if not settings.DATABASE_REPLICAS:
+        raise MiddlewareNotUsed
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            response = await get_response(request)
+            if _wrote(request, response):
+                await sync_to_async(pin_to_primary)(request.user.pk)
+            return response
+    else:
+        def middleware(request):
+            response = get_response(request)
+            if _wrote(request, response):
+                pin_to_primary(request.user.pk)
+            return response
+    return middleware
+
+
+def bearer_api_request(request):
+    """Whether the request goes to the API with a bearer token instead of a browser session."""
+    return (request.path_info.startswith(settings.API_PATH_PREFIX)
+            and request.META.get('HTTP_AUTHORIZATION', '').startswith('Bearer '))
+
+
+class BrowserOnlyMiddlewareMixin:
+    """
+    Skip a middleware for bearer token API requests. Those are authenticated by the JWT
+    authentication of DRF and use neither sessions, messages nor CSRF cookies, while the
+    admin, the password reset pages and the browsable API keep the full stack. Under ASGI
+    this also saves the thread switch that every sync process_request/process_response costs.
+    """
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if bearer_api_request(request):
+            return self.get_response(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if bearer_api_request(request):
+            return await self.get_response(request)
+        return await super().__acall__(request)
+
+
+class BrowserSessionMiddleware(BrowserOnlyMiddlewareMixin, SessionMiddleware):
+    pass
+
+
+class BrowserCsrfViewMiddleware(BrowserOnlyMiddlewareMixin, CsrfViewMiddleware):
+    pass
+
+
+class BrowserAuthenticationMiddleware(BrowserOnlyMiddlewareMixin, AuthenticationMiddleware):
+    pass
+
+
+class BrowserMessageMiddleware(BrowserOnlyMiddlewareMixin, MessageMiddleware):
+    pass
+
+
+class BrowserXFrameOptionsMiddleware(BrowserOnlyMiddlewareMixin, XFrameOptionsMiddleware):
+    pass
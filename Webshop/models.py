@@ -1,14 +1,23 @@
 import uuid
+from collections import defaultdict
 from datetime import timedelta, datetime
 from ckeditor.fields import RichTextField
 from django.contrib.auth import get_user_model
+from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin, AbstractUser
+from django.core.files.storage import FileSystemStorage, storages
 from django.db import models, transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from utils.events import order_status_event, publish_on_commit, user_topic
 from utils.mail_service import send_registration_mail, send_group_invitation_mail
+from utils.sqlite import retry_on_lock
+from utils.storage import ContentAddressedStorage
 
 # Constants
 UPLOAD_PATH_ITEM_IMAGES = 'item_images/'
+UPLOAD_PATH_IMPORT_FILES = 'imports/'
 
 
 class ModelDateMixin(models.Model):
@@ -24,7 +33,7 @@ class ModelDateMixin(models.Model):
 
 class ItemCategory(ModelDateMixin, models.Model):
     category_id = models.AutoField(primary_key=True)
-    category_name = models.CharField(max_length=50)
+    category_name = models.CharField(max_length=50, db_index=True)
 
     def __str__(self):
         return self.category_name
@@ -36,7 +45,7 @@ class ItemCategory(ModelDateMixin, models.Model):
 
 class ItemDetails(ModelDateMixin, models.Model):
     item_details_id = models.AutoField(primary_key=True)
-    item_name = models.CharField(max_length=100)
+    item_name = models.CharField(max_length=100, db_index=True)
     categories = models.ManyToManyField(ItemCategory, related_name='items')
     item_description = RichTextField()
 
@@ -48,14 +57,32 @@ class ItemDetails(ModelDateMixin, models.Model):
         verbose_name_plural = 'Items'
 
 
+def item_image_storage():
+    return storages['item_images']
+
+
 class ItemImage(models.Model):
     image_id = models.AutoField(primary_key=True)
     item_details = models.ForeignKey(ItemDetails, related_name="images", on_delete=models.CASCADE)
-    image = models.ImageField(upload_to=UPLOAD_PATH_ITEM_IMAGES)
+    image = models.ImageField(upload_to=UPLOAD_PATH_ITEM_IMAGES, storage=item_image_storage)
+    # SHA-256 of the stored file. Files shared by several rows are deleted with the last of them.
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
 
     def __str__(self):
         return f"Image for {self.item_details.item_name}"
 
+    def save(self, *args, **kwargs):
+        # The content-addressed name carries the hash. The file is stored after the row
+        # is committed, a concurrent release of the same file then either sees the row
+        # or runs before the file is saved again.
+        if self.image and not self.image._committed:
+            storage, content = self.image.storage, self.image.file
+            name = storage.hashed_name(self.image.field.generate_filename(self, self.image.name), content)
+            self.image.name, self.image._committed = name, True
+            transaction.on_commit(lambda: storage.save(name, content))
+        self.content_hash = ContentAddressedStorage.content_hash(self.image.name) or self.content_hash
+        super().save(*args, **kwargs)
+
 
 class Item(ModelDateMixin, models.Model):
     item_id = models.AutoField(primary_key=True)
@@ -68,12 +95,119 @@ class Item(ModelDateMixin, models.Model):
         return f"{self.item_details.item_name} - ${self.item_price}"
 
 
+class ImportJobStatus(models.TextChoices):
+    PENDING = 'pending', _('Pending')
+    RUNNING = 'running', _('Running')
+    COMPLETED = 'completed', _('Completed')
+    FAILED = 'failed', _('Failed')
+
+
+class ImportJobKind(models.TextChoices):
+    PRODUCTS = 'products', _('Product import')
+    PREVIEW = 'preview', _('Product import preview')
+    IMAGES = 'images', _('Image import')
+
+
+def import_file_storage():
+    # Uploaded feeds are kept outside MEDIA_ROOT, which is publicly served
+    return FileSystemStorage(location=settings.IMPORT_FILES_ROOT)
+
+
+class ImportJob(ModelDateMixin, models.Model):
+    """
+    Progress and checkpoint of a streamed product import. The checkpoint is
+    updated in the same transaction as each imported chunk, so an interrupted
+    import resumes after the last committed chunk.
+    A preview job writes nothing but its summary (`result`) and the list of
+    changes (`result_file`), which every worker can read. An image job attaches
+    the images of a ZIP archive and stores its counters in `result`.
+    """
+    kind = models.CharField(max_length=20, choices=ImportJobKind.choices, default=ImportJobKind.PRODUCTS)
+    source = models.CharField(max_length=255)
+    file = models.FileField(upload_to=UPLOAD_PATH_IMPORT_FILES, storage=import_file_storage, blank=True)
+    result = models.JSONField(default=dict, blank=True)
+    result_file = models.FileField(upload_to=UPLOAD_PATH_IMPORT_FILES, storage=import_file_storage, blank=True)
+    fingerprint = models.CharField(max_length=64, db_index=True)
+    encoding = models.CharField(max_length=50)
+    chunk_size = models.PositiveIntegerField()
+    replace_stock = models.BooleanField(default=False)
+    chunks_committed = models.PositiveIntegerField(default=0)
+    rows_processed = models.PositiveIntegerField(default=0)
+    rows_created = models.PositiveIntegerField(default=0)
+    rows_updated = models.PositiveIntegerField(default=0)
+    rows_invalid = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)  # [row, message] pairs, capped
+    error_message = models.TextField(blank=True)
+    status = models.CharField(
+        max_length=20,
+        choices=ImportJobStatus.choices,
+        default=ImportJobStatus.RUNNING
+    )
+    created_by = models.ForeignKey('CustomUser', on_delete=models.SET_NULL, null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Import {self.source} ({self.get_status_display()})"
+
+    @staticmethod
+    def stale():
+        """Running jobs that made no progress for IMPORT_JOB_STALE_AFTER seconds, their worker died."""
+        stale_before = timezone.now() - timedelta(seconds=settings.IMPORT_JOB_STALE_AFTER)
+        return models.Q(status=ImportJobStatus.RUNNING, updated_at__lt=stale_before)
+
+    @property
+    def is_finished(self):
+        return self.status in (ImportJobStatus.COMPLETED, ImportJobStatus.FAILED)
+
+    @property
+    def throughput(self):
+        """
+        Processed rows per second.
+        """
+        if not self.started_at:
+            return 0.0
+        seconds = ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+        return self.rows_processed / seconds if seconds > 0 else 0.0
+
+
+class ProfileTrigger(models.TextChoices):
+    REQUESTED = 'requested', _('Requested')
+    SAMPLED = 'sampled', _('Sampled')
+
+
+class RequestProfile(models.Model):
+    """
+    Stack samples of one profiled request in the collapsed-stack format of flamegraph.pl
+    and speedscope: one "root;...;leaf count" line per distinct stack.
+    """
+    route = models.CharField(max_length=255, db_index=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=2048)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    sample_count = models.PositiveIntegerField()
+    stacks = models.TextField(blank=True)
+    trigger = models.CharField(max_length=20, choices=ProfileTrigger.choices)
+    user = models.ForeignKey('CustomUser', on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.method} {self.route} ({self.duration_ms:.0f} ms)"
+
+
 class OrderManager(models.Manager):
+    @retry_on_lock
     def create_with_info_and_items(self, order_info_data, items_data, **kwargs):
         """
         Create an order with associated OrderInfo and OrderItems in a single transaction.
-        Automatically calculates the order total.
+        Automatically calculates the order total from the buyer's effective prices.
         """
+        from utils.pricing import PriceResolver
+
+        price_resolver = PriceResolver.for_user(kwargs.get('user'))
+        price_resolver.prime(item_data['item'] for item_data in items_data if isinstance(item_data['item'], Item))
+
         with transaction.atomic():
             # Create the order
             order = self.create(**kwargs)
@@ -93,8 +227,9 @@ class OrderManager(models.Manager):
                     raise ValueError(f"Invalid item: {item}")
 
                 # Create the OrderItem
-                OrderItem.objects.create(order=order, item=item, quantity=quantity)
-                total += item.item_price * quantity
+                unit_price = price_resolver.unit_price(item, quantity)
+                OrderItem.objects.create(order=order, item=item, quantity=quantity, unit_price=unit_price)
+                total += unit_price * quantity
 
             # Update the order total
             order.order_total = total
@@ -102,6 +237,117 @@ class OrderManager(models.Manager):
 
             return order
 
+    @retry_on_lock
+    def create_from_shopping_lists(self, shopping_list_ids, order_info_data=None, user=None):
+        """
+        Convert approved shopping lists into orders in a single transaction.
+        Items and prices are loaded in bulk, order lines are bulk inserted, totals are
+        computed in SQL and all lists are marked as ordered with one UPDATE.
+        Group lists are priced with the group's price lists, personal lists with the
+        price lists of the ordering user.
+        Orders belong to `user` or, if not given, to the creator of each list.
+        Returns a dict mapping shopping list ids to the created order ids.
+        """
+        from utils.pricing import PriceResolver
+
+        shopping_list_ids = set(shopping_list_ids)
+        with transaction.atomic():
+            shopping_lists = list(
+                ShoppingList.objects.select_for_update()
+                .filter(pk__in=shopping_list_ids, status=ShoppingListStatus.APPROVED)
+                .select_related('created_by')
+                .order_by('pk')
+            )
+            not_approved = shopping_list_ids - {shopping_list.pk for shopping_list in shopping_lists}
+            if not_approved:
+                raise ValueError(f"Shopping lists not found or not approved: {sorted(not_approved)}")
+
+            # Load all lines with their current list prices in one query
+            lines_by_list = defaultdict(list)
+            lines = list(ShoppingListItem.objects.filter(shopping_list_id__in=shopping_list_ids).values_list(
+                'shopping_list_id', 'item_id', 'item__item_details_id', 'quantity', 'item__item_price'
+            ))
+            price_resolvers = {}
+            # One resolver per group and per buyer, their group memberships are queried once
+            shared_resolvers = {}
+            item_categories = {}
+            item_details_ids = {line[2] for line in lines}
+            for shopping_list in shopping_lists:
+                if shopping_list.group_id:
+                    key = ('group', shopping_list.group_id)
+                else:
+                    key = ('user', (user or shopping_list.created_by).pk)
+                if key not in shared_resolvers:
+                    if shopping_list.group_id:
+                        price_resolver = PriceResolver([shopping_list.group_id], item_categories=item_categories)
+                    else:
+                        price_resolver = PriceResolver.for_user(user or shopping_list.created_by,
+                                                                item_categories=item_categories)
+                    price_resolver.prime_categories(item_details_ids)
+                    shared_resolvers[key] = price_resolver
+                price_resolvers[shopping_list.pk] = shared_resolvers[key]
+
+            for shopping_list_id, item_id, item_details_id, quantity, item_price in lines:
+                unit_price = price_resolvers[shopping_list_id].resolve(item_id, item_details_id, item_price, quantity)
+                lines_by_list[shopping_list_id].append((item_id, quantity, unit_price))
+
+            empty = shopping_list_ids - lines_by_list.keys()
+            if empty:
+                raise ValueError(f"Shopping lists without items: {sorted(empty)}")
+
+            orders = self.bulk_create([
+                self.model(user=user or shopping_list.created_by, shopping_list=shopping_list)
+                for shopping_list in shopping_lists
+            ])
+
+            OrderInfo.objects.bulk_create(self._build_order_infos(orders, order_info_data))
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, item_id=item_id, quantity=quantity, unit_price=unit_price)
+                for order in orders
+                for item_id, quantity, unit_price in lines_by_list[order.shopping_list_id]
+            ])
+
+            # Compute all order totals in SQL
+            order_ids = [order.pk for order in orders]
+            line_totals = (
+                OrderItem.objects.filter(order=OuterRef('pk'))
+                .values('order')
+                .annotate(total=Sum(F('quantity') * F('unit_price'),
+                                    output_field=DecimalField(max_digits=10, decimal_places=2)))
+                .values('total')
+            )
+            self.filter(pk__in=order_ids).update(order_total=Subquery(line_totals))
+
+            ShoppingList.objects.filter(pk__in=shopping_list_ids).update(status=ShoppingListStatus.ORDERED)
+            publish_on_commit(order_status_event(order) for order in orders)
+
+            return {order.shopping_list_id: order.pk for order in orders}
+
+    @staticmethod
+    def _build_order_infos(orders, order_info_data=None):
+        """
+        Build OrderInfo rows for bulk creation. Without explicit order info the buyer
+        data is taken from the order's user and their billing address.
+        """
+        if order_info_data:
+            return [OrderInfo(order=order, **order_info_data) for order in orders]
+
+        user_ids = {order.user_id for order in orders if order.user_id}
+        billing_addresses = dict(
+            Address.objects.filter(user_id__in=user_ids, billing=True).values_list('user_id', 'address')
+        )
+        return [
+            OrderInfo(
+                order=order,
+                buyer_name=order.user.full_name,
+                buyer_email=order.user.email,
+                buyer_phone=order.user.phone,
+                buyer_address=billing_addresses.get(order.user_id, ''),
+            )
+            for order in orders
+            if order.user_id
+        ]
+
 
 class OrderStatus(models.TextChoices):
     PENDING = 'PENDING', _('Pending')
@@ -124,6 +370,8 @@ class Order(ModelDateMixin, models.Model):
     )
     items = models.ManyToManyField(Item, through="OrderItem")
     user = models.ForeignKey('CustomUser', on_delete=models.DO_NOTHING, null=True)
+    shopping_list = models.ForeignKey('ShoppingList', on_delete=models.SET_NULL, null=True, blank=True,
+                                      related_name='orders')
 
     objects = OrderManager()
 
@@ -146,6 +394,7 @@ class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
     item = models.ForeignKey(Item, on_delete=models.DO_NOTHING)
     quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
 
 
 class ShoppingCart(models.Model):
@@ -157,15 +406,25 @@ class ShoppingCart(models.Model):
     items = models.ManyToManyField('Item', through="CartItem")
     updated_at = models.DateTimeField(auto_now=True)
 
-    def get_total_price(self):
+    def get_total_price(self, price_resolver=None):
         """
-        Calculate the total price of all items in the shopping cart.
+        Calculate the total price of all items in the shopping cart,
+        using the negotiated prices of the user's company groups.
         """
+        from utils.pricing import PriceResolver
+
+        price_resolver = price_resolver or PriceResolver.for_user(self.user)
+        if 'cartitem_set' in getattr(self, '_prefetched_objects_cache', {}):
+            cart_items = self.cartitem_set.all()
+        else:
+            cart_items = self.cartitem_set.select_related('item')
+        price_resolver.prime(cart_item.item for cart_item in cart_items)
         return sum(
-            cart_item.item.item_price * cart_item.quantity
-            for cart_item in self.cartitem_set.all()
+            price_resolver.unit_price(cart_item.item, cart_item.quantity) * cart_item.quantity
+            for cart_item in cart_items
         )
 
+    @retry_on_lock
     def set_item(self, item, quantity=1):
         """
         Set the quantity of an item in the shopping cart.
@@ -175,12 +434,21 @@ class ShoppingCart(models.Model):
             self.cartitem_set.filter(item=item).delete()
         else:
             self.cartitem_set.update_or_create(item=item, defaults={'quantity': quantity})
+        self.publish_change()
 
+    @retry_on_lock
     def clear(self):
         """
         Remove all items from the shopping cart.
         """
         self.cartitem_set.all().delete()
+        self.publish_change()
+
+    def publish_change(self):
+        """
+        Tell the event streams of the user that the cart changed, they follow the stock of its items.
+        """
+        publish_on_commit([(user_topic(self.user_id), {'type': 'cart'})])
 
     def __str__(self):
         return f"Shopping Cart #{self.cart_id}"
@@ -258,9 +526,16 @@ class CustomUser(AbstractUser, PermissionsMixin):
     company_name = models.CharField(max_length=100, blank=True)
     phone = models.CharField(max_length=15, blank=True)
     verified = models.BooleanField(default=False)
+    # Carried by the JWTs of the user, raising it revokes all tokens issued before
+    token_version = models.PositiveIntegerField(default=0, editable=False)
 
     objects = CustomUserManager()
 
+    # Set on users rebuilt from the principal cache (utils.principals), which may be older than the row
+    from_principal_cache = False
+    # Never written from such a user, a stale copy must not undo a deactivation or a token revocation
+    PRINCIPAL_PROTECTED_FIELDS = frozenset({'is_active', 'is_staff', 'is_superuser', 'token_version'})
+
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['first_name', 'last_name']
 
@@ -290,6 +565,17 @@ class CustomUser(AbstractUser, PermissionsMixin):
     @transaction.atomic
     def save(self, *args, **kwargs):
         is_new = self._state.adding
+        # set_password() keeps the raw password until the next save, hash upgrades on login do not
+        if self._password is not None and not is_new:
+            self.token_version += 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'token_version'}
+        if self.from_principal_cache:
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                update_fields = {field.attname for field in self._meta.concrete_fields
+                                 if not field.primary_key} - self.get_deferred_fields()
+            kwargs['update_fields'] = set(update_fields) - self.PRINCIPAL_PROTECTED_FIELDS
         super().save(*args, **kwargs)
 
         if is_new:
@@ -303,7 +589,8 @@ class CustomUser(AbstractUser, PermissionsMixin):
     @transaction.atomic
     def set_inactive(self):
         self.is_active = False
-        self.save(update_fields=['is_active'])
+        self.token_version += 1
+        self.save(update_fields=['is_active', 'token_version'])
         self.shopping_cart.clear()
         self.save()
 
@@ -365,6 +652,7 @@ class ShoppingListStatus(models.TextChoices):
     SUBMITTED = 'submitted', _('Submitted')
     APPROVED = 'approved', _('Approved')
     REJECTED = 'rejected', _('Rejected')
+    ORDERED = 'ordered', _('Ordered')
 
 class ShoppingList(models.Model):
     title = models.CharField(max_length=150)
@@ -396,6 +684,49 @@ class ShoppingList(models.Model):
             )
         ]
 
+class PriceList(ModelDateMixin, models.Model):
+    """
+    Negotiated prices of a company group. Entries override the list price of single
+    items or whole categories, optionally with quantity breaks.
+    """
+    group = models.ForeignKey(CompanyGroup, on_delete=models.CASCADE, related_name='price_lists')
+    name = models.CharField(max_length=150)
+    is_active = models.BooleanField(default=True)
+    valid_from = models.DateField(null=True, blank=True)
+    valid_until = models.DateField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.group.name})"
+
+
+class PriceListEntry(models.Model):
+    price_list = models.ForeignKey(PriceList, on_delete=models.CASCADE, related_name='entries')
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, null=True, blank=True, related_name='price_list_entries')
+    category = models.ForeignKey(ItemCategory, on_delete=models.CASCADE, null=True, blank=True,
+                                 related_name='price_list_entries')
+    min_quantity = models.PositiveIntegerField(default=1)
+    price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    discount_percent = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+
+    def __str__(self):
+        target = self.item or self.category
+        return f"{target} ab {self.min_quantity} Stk. in {self.price_list.name}"
+
+    class Meta:
+        verbose_name = 'Price list entry'
+        verbose_name_plural = 'Price list entries'
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(item__isnull=False, category__isnull=True) | models.Q(item__isnull=True, category__isnull=False),
+                name="price_list_entry_item_or_category"
+            ),
+            models.CheckConstraint(
+                check=models.Q(price__isnull=False, discount_percent__isnull=True) | models.Q(price__isnull=True, discount_percent__isnull=False),
+                name="price_list_entry_price_or_discount"
+            ),
+        ]
+
+
 class GroupInvitationStatus(models.TextChoices):
     PENDING = 'pending', _('Pending')
     ACCEPTED = 'accepted', _('Accepted')
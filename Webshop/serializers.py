@@ -1,10 +1,18 @@
+from django.db.models import Q
 from rest_framework import serializers
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt import serializers as jwt_serializers
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from utils.metrics import TimedSerializerMixin
+from utils.pricing import PriceResolver
+from utils.principals import TOKEN_VERSION_CLAIM, token_version
 
 from .models import Item, Order, OrderInfo, OrderItem, ItemImage, ItemDetails, CustomUser, Address, ShoppingCart, \
-    CartItem, CompanyGroup, CompanyGroupMembership, GroupInvitation, ShoppingList, ShoppingListItem
+    CartItem, CompanyGroup, CompanyGroupMembership, GroupInvitation, ShoppingList, ShoppingListItem, ShoppingListStatus
 
 
-class ItemImageSerializer(serializers.ModelSerializer):
+class ItemImageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for ItemImage model.
     """
@@ -14,7 +22,7 @@ class ItemImageSerializer(serializers.ModelSerializer):
         fields = ['image_id', 'image']
 
 
-class ItemDetailSerializer(serializers.ModelSerializer):
+class ItemDetailSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for ItemDetails model, including associated images.
     """
@@ -25,9 +33,21 @@ class ItemDetailSerializer(serializers.ModelSerializer):
         fields = ['item_details_id', 'item_name', 'item_description', 'images', 'categories']
 
 
-class ItemSerializer(serializers.ModelSerializer):
+def get_price_resolver(context):
+    """
+    Return the price resolver shared by all serializers of a request.
+    Without a request the list prices are used.
+    """
+    if 'price_resolver' not in context:
+        request = context.get('request')
+        context['price_resolver'] = PriceResolver.for_user(getattr(request, 'user', None))
+    return context['price_resolver']
+
+
+class ItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for Item model, including nested ItemDetails.
+    The item price is the effective price for the requesting user.
     """
     item_details = ItemDetailSerializer(read_only=True)
 
@@ -35,20 +55,30 @@ class ItemSerializer(serializers.ModelSerializer):
         model = Item
         fields = ['item_id', 'item_price', 'item_details', 'item_stock', 'article_id']
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        unit_price = get_price_resolver(self.context).unit_price(instance)
+        data['item_price'] = self.fields['item_price'].to_representation(unit_price)
+        return data
+
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
-    Serializer for OrderItem model.
+    Serializer for OrderItem model. The unit price is the price the line was ordered
+    at, the nested item shows the current price for the requesting user.
     """
     item = ItemSerializer(read_only=True)  # Show item details for read
     item_id = serializers.PrimaryKeyRelatedField(queryset=Item.objects.all(), write_only=True, source='item')
 
     class Meta:
         model = OrderItem
-        fields = ['item', 'item_id', 'quantity']
+        fields = ['item', 'item_id', 'quantity', 'unit_price']
+        extra_kwargs = {
+            'unit_price': {'read_only': True},
+        }
 
 
-class OrderInfoSerializer(serializers.ModelSerializer):
+class OrderInfoSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for OrderInfo model.
     """
@@ -58,7 +88,7 @@ class OrderInfoSerializer(serializers.ModelSerializer):
         fields = ['buyer_name', 'buyer_email', 'buyer_phone', 'buyer_address']
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for Order model with nested order info and items.
     """
@@ -114,13 +144,16 @@ class OrderSerializer(serializers.ModelSerializer):
 
     def get_items_read(self, obj):
         """
-        Get items for read operations, optimizing with select_related.
+        Get items for read operations, using the items prefetched by the view if present.
         """
-        items = obj.orderitem_set.select_related('item')
-        return OrderItemSerializer(items, many=True).data
+        if 'orderitem_set' in getattr(obj, '_prefetched_objects_cache', {}):
+            items = obj.orderitem_set.all()
+        else:
+            items = obj.orderitem_set.select_related('item__item_details')
+        return OrderItemSerializer(items, many=True, context=self.context).data
 
 
-class UserRegistrationSerializer(serializers.ModelSerializer):
+class UserRegistrationSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=True)
     password_confirm = serializers.CharField(write_only=True, required=True)
 
@@ -145,7 +178,7 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         return user
 
 
-class UserShortSerializer(serializers.ModelSerializer):
+class UserShortSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = CustomUser
         fields = ['email',
@@ -162,31 +195,36 @@ class UserShortSerializer(serializers.ModelSerializer):
         }
 
 
-class AddressSerializer(serializers.ModelSerializer):
+class AddressSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Address
         fields = ['address_id', 'address', 'billing']
 
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = CartItem
         fields = ['item', 'quantity']
 
 
-class ShoppingCartSerializer(serializers.ModelSerializer):
+class ShoppingCartSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     items = serializers.SerializerMethodField()
+    total_price = serializers.SerializerMethodField()
 
     class Meta:
         model = ShoppingCart
-        fields = ['items', 'updated_at']
+        fields = ['items', 'total_price', 'updated_at']
 
     def get_items(self, obj):
         cart_items = obj.cartitem_set.all()
         return CartItemSerializer(cart_items, many=True).data
 
+    def get_total_price(self, obj):
+        total = obj.get_total_price(price_resolver=get_price_resolver(self.context))
+        return serializers.DecimalField(max_digits=10, decimal_places=2).to_representation(total)
+
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     addresses = AddressSerializer(many=True, read_only=True)
     billing_address = AddressSerializer(read_only=True)
     shopping_cart = ShoppingCartSerializer(read_only=True)
@@ -211,7 +249,7 @@ class UserSerializer(serializers.ModelSerializer):
         }
 
 
-class UserOrdersSerializer(serializers.ModelSerializer):
+class UserOrdersSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     orders = OrderSerializer(many=True)
 
     class Meta:
@@ -223,7 +261,7 @@ class UserOrdersSerializer(serializers.ModelSerializer):
         }
 
 
-class CompanyGroupMembershipSerializer(serializers.ModelSerializer):
+class CompanyGroupMembershipSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user = UserShortSerializer(read_only=True)
     class Meta:
         model = CompanyGroupMembership
@@ -234,7 +272,7 @@ class CompanyGroupMembershipSerializer(serializers.ModelSerializer):
         }
 
 
-class CompanyGroupSerializer(serializers.ModelSerializer):
+class CompanyGroupSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     members = CompanyGroupMembershipSerializer(many=True, read_only=True)
     class Meta:
         model = CompanyGroup
@@ -245,14 +283,14 @@ class CompanyGroupSerializer(serializers.ModelSerializer):
             'owner': {'read_only': True},
         }
 
-class GroupInvitationSerializer(serializers.ModelSerializer):
+class GroupInvitationSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = GroupInvitation
         fields = ['id', 'email', 'group', 'invited_by', 'status', 'group_invite_token', 'created_at']
         read_only_fields = ['id', 'invited_by', 'status', 'group_invite_token', 'created_at']
 
 
-class ShoppingListItemsSerializer(serializers.ModelSerializer):
+class ShoppingListItemsSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     item = ItemSerializer(read_only=True)
     item_id = serializers.PrimaryKeyRelatedField(queryset=Item.objects.all(), write_only=True, source='item')
 
@@ -266,7 +304,7 @@ class ShoppingListItemsSerializer(serializers.ModelSerializer):
             'quantity': {'required': True, 'min_value': 1},
         }
 
-class ShoppingListSerializer(serializers.ModelSerializer):
+class ShoppingListSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     items = ShoppingListItemsSerializer(source='shopping_list_items', many=True, read_only=True)
     items_data = serializers.ListField(
         child=serializers.DictField(),
@@ -299,4 +337,82 @@ class ShoppingListSerializer(serializers.ModelSerializer):
                 item_id=item_data['item_id'],
                 quantity=item_data.get('quantity', 1)
             )
-        return shopping_list
\ No newline at end of file
+        return shopping_list
+
+class ShoppingListConversionSerializer(TimedSerializerMixin, serializers.Serializer):
+    """
+    Serializer for converting approved shopping lists into orders.
+    """
+    shopping_lists = serializers.PrimaryKeyRelatedField(queryset=ShoppingList.objects.all(), many=True,
+                                                        allow_empty=False)
+    order_info = OrderInfoSerializer(required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is not None:
+            # Only own lists and lists of groups owned by the user can be converted
+            user = request.user
+            self.fields['shopping_lists'].child_relation.queryset = ShoppingList.objects.filter(
+                Q(created_by=user) | Q(group__owner=user)
+            ).distinct()
+
+    def validate_shopping_lists(self, shopping_lists):
+        not_approved = [shopping_list.pk for shopping_list in shopping_lists
+                        if shopping_list.status != ShoppingListStatus.APPROVED]
+        if not_approved:
+            raise serializers.ValidationError(f"Only approved shopping lists can be ordered: {not_approved}")
+        return shopping_lists
+
+
+
+class OrderSummarySerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Order without its items, expects the queryset to annotate item_count."""
+    item_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['order_id', 'order_status', 'order_date', 'order_total', 'item_count']
+
+
+class GroupMembershipSummarySerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    name = serializers.CharField(source='group.name', read_only=True)
+
+    class Meta:
+        model = CompanyGroupMembership
+        fields = ['group', 'name', 'role', 'joined_at']
+
+
+class BootstrapSerializer(TimedSerializerMixin, serializers.Serializer):
+    """Everything the storefront shell needs on page load, see BootstrapViewSet."""
+    profile = UserShortSerializer(read_only=True)
+    shopping_cart = ShoppingCartSerializer(read_only=True, allow_null=True)
+    addresses = AddressSerializer(many=True, read_only=True)
+    billing_address = AddressSerializer(read_only=True, allow_null=True)
+    recent_orders = OrderSummarySerializer(many=True, read_only=True)
+    groups = GroupMembershipSummarySerializer(many=True, read_only=True)
+
+class TokenObtainPairSerializer(jwt_serializers.TokenObtainPairSerializer):
+    """
+    Login serializer issuing tokens with the token_version of the user, which
+    CachedJWTAuthentication compares to reject revoked tokens. Access tokens created
+    by a refresh copy the claim from the refresh token.
+    """
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token[TOKEN_VERSION_CLAIM] = user.token_version
+        return token
+
+
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    """Refresh serializer rejecting refresh tokens issued before the current token_version of the user."""
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user_id = refresh.payload.get(jwt_settings.USER_ID_CLAIM)
+        if user_id and CustomUser.objects.filter(**{jwt_settings.USER_ID_FIELD: user_id}) \
+                .exclude(token_version=token_version(refresh)).exists():
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        return super().validate(attrs)
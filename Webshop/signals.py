@@ -0,0 +1,105 @@
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from utils.events import item_stock_event, order_status_event, publish_on_commit
+from utils.metrics import install_sql_timer
+from utils.pricing import invalidate_price_index
+from utils.principals import invalidate_principal
+from utils.sqlite import apply_pragmas
+from .models import CustomUser, Item, ItemImage, Order, PriceList, PriceListEntry
+
+
+@receiver(connection_created)
+def configure_sqlite_connection(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite' and settings.SQLITE_PRODUCTION_MODE:
+        apply_pragmas(connection)
+
+
+@receiver(connection_created)
+def time_sql_queries(sender, connection, **kwargs):
+    install_sql_timer(connection)
+
+
+@receiver([post_save, post_delete], sender=CustomUser)
+def invalidate_user_principal(sender, instance, **kwargs):
+    invalidate_principal(instance.pk, instance.token_version)
+
+
+@receiver([post_save, post_delete], sender=PriceList)
+def invalidate_price_list(sender, instance, **kwargs):
+    invalidate_price_index(instance.group_id)
+
+
+@receiver([post_save, post_delete], sender=PriceListEntry)
+def invalidate_price_list_entry(sender, instance, **kwargs):
+    # The price list may already be deleted when its entries are removed in cascade
+    group_id = PriceList.objects.filter(pk=instance.price_list_id).values_list('group_id', flat=True).first()
+    if group_id is not None:
+        invalidate_price_index(group_id)
+
+
+@receiver(pre_save, sender=Order)
+def remember_order_status(sender, instance, raw=False, update_fields=None, **kwargs):
+    if instance.pk and not raw and (update_fields is None or 'order_status' in update_fields):
+        instance._previous_status = Order.objects.filter(pk=instance.pk).values_list('order_status', flat=True).first()
+
+
+@receiver(post_save, sender=Order)
+def publish_order_status(sender, instance, created, raw=False, **kwargs):
+    previous = instance.__dict__.pop('_previous_status', instance.order_status)
+    if not raw and instance.user_id and (created or previous != instance.order_status):
+        publish_on_commit([order_status_event(instance)])
+
+
+@receiver(pre_save, sender=Item)
+def remember_item_stock(sender, instance, raw=False, update_fields=None, **kwargs):
+    if instance.pk and not raw and (update_fields is None or 'item_stock' in update_fields):
+        instance._previous_stock = Item.objects.filter(pk=instance.pk).values_list('item_stock', flat=True).first()
+
+
+@receiver(post_save, sender=Item)
+def publish_item_stock(sender, instance, created, raw=False, **kwargs):
+    previous = instance.__dict__.pop('_previous_stock', instance.item_stock)
+    # New items are in no shopping cart yet
+    if not raw and not created and previous != instance.item_stock:
+        publish_on_commit([item_stock_event(instance.pk, instance.item_stock)])
+
+
+def release_item_image_file(name):
+    """
+    Delete an image file after the transaction once no ItemImage references it any more.
+    Content-addressed files are shared by all rows with the same image; a file saved
+    again since the release was requested belongs to a concurrent writer and is kept.
+    """
+    requested = time.time()
+
+    def release():
+        if name:
+            ItemImage._meta.get_field('image').storage.delete_unless_touched(
+                name, requested, ItemImage.objects.filter(image=name).exists
+            )
+
+    transaction.on_commit(release)
+
+
+@receiver(pre_save, sender=ItemImage)
+def remember_item_image_file(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        instance._previous_image = ItemImage.objects.filter(pk=instance.pk).values_list('image', flat=True).first()
+
+
+@receiver(post_save, sender=ItemImage)
+def release_replaced_item_image(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_image', None)
+    if previous and previous != instance.image.name:
+        release_item_image_file(previous)
+
+
+@receiver(post_delete, sender=ItemImage)
+def release_deleted_item_image(sender, instance, **kwargs):
+    release_item_image_file(instance.image.name)
@@ -1 +1,80 @@
-# Create your tests here.
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from utils.principals import get_principal
+from .models import CustomUser
+from .serializers import TokenObtainPairSerializer
+
+
+@override_settings(THROTTLING=False)
+class PrincipalCacheWriteTests(TestCase):
+    """
+    Another worker deactivated the user and revoked their tokens, the principal cache of
+    this worker still holds the snapshot from before.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='kunde@example.com', password='geheim', verified=True)
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {TokenObtainPairSerializer.get_token(self.user).access_token}')
+        get_principal(self.user.pk, self.user.token_version)
+        # A queryset update, like a save in another process, leaves the cache of this one untouched
+        CustomUser.objects.filter(pk=self.user.pk).update(is_active=False, token_version=1)
+
+    def assert_still_revoked(self):
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertEqual(self.user.token_version, 1)
+
+    def test_profile_update_rejects_revoked_token(self):
+        response = self.client.post('/web/api/me/detail/', {'company_name': 'Neu GmbH'}, format='json')
+        self.assertEqual(response.status_code, 401)
+        self.assert_still_revoked()
+        self.assertEqual(self.user.company_name, '')
+
+    def test_profile_update_action_rejects_revoked_token(self):
+        response = self.client.patch('/web/api/me/profile/update/', {'company_name': 'Neu GmbH'}, format='json')
+        self.assertEqual(response.status_code, 401)
+        self.assert_still_revoked()
+
+    def test_saving_a_snapshot_keeps_protected_fields(self):
+        snapshot = get_principal(self.user.pk, 0)
+        self.assertTrue(snapshot.from_principal_cache)
+        snapshot.company_name = 'Neu GmbH'
+        snapshot.save()
+        self.assert_still_revoked()
+        self.assertEqual(self.user.company_name, 'Neu GmbH')
+
+    def test_deactivation_with_current_token(self):
+        CustomUser.objects.filter(pk=self.user.pk).update(is_active=True, token_version=0)
+        response = self.client.delete('/web/api/me/profile/delete/')
+        self.assertEqual(response.status_code, 204)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertEqual(self.user.token_version, 1)
+
+
+@override_settings(THROTTLING=False)
+class TokenRefreshRevocationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='kunde@example.com', password='geheim', verified=True)
+        self.refresh = str(TokenObtainPairSerializer.get_token(self.user))
+
+    def refresh_token(self, format='json'):
+        return APIClient().post('/web/api/auth/refresh/', {'refresh': self.refresh}, format=format)
+
+    def test_refresh_with_current_token_version(self):
+        response = self.refresh_token()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.json())
+
+    def test_refresh_rejects_revoked_token(self):
+        self.user.token_version += 1
+        self.user.save(update_fields=['token_version'])
+        self.assertEqual(self.refresh_token().status_code, 401)
+        # Form posts are answered by the sync simplejwt view
+        self.assertEqual(self.refresh_token(format='multipart').status_code, 401)
@@ -0,0 +1,64 @@
+import math
+
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.exceptions import Throttled
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from utils.metrics import THROTTLED_REQUESTS
+from utils.throttling import get_buckets, parse_rate
+from .middleware import bearer_api_request
+
+DEFAULT_SCOPE = 'default'
+
+
+def client_ident(request):
+    """
+    The kind of client and its key: authenticated users are counted per user and per
+    kind of credentials, so an integration with JWTs does not use up the browser
+    session of the same account. Anonymous requests are counted per IP address.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        client = 'jwt' if bearer_api_request(request) else 'session'
+        return client, f'{client}:{user.pk}'
+    return 'ip', f'ip:{BaseThrottle().get_ident(request)}'
+
+
+def throttle_wait(scope, request):
+    """
+    Take a token from the bucket of the request's client in `scope`. Returns 0 if the
+    request may pass, otherwise the seconds until it may retry. Scopes without a rate
+    in DEFAULT_THROTTLE_RATES are not throttled.
+    """
+    rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+    if not rate or not settings.THROTTLING:
+        return 0
+    client, ident = client_ident(request)
+    wait = get_buckets().take(f'{scope}:{ident}', *parse_rate(rate))
+    if wait:
+        THROTTLED_REQUESTS.inc(scope=scope, client=client)
+    return wait
+
+
+def throttled_response(wait):
+    """429 response for views outside of DRF, with the message and Retry-After of DRF's Throttled."""
+    response = HttpResponse(Throttled(wait).detail, status=429, content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(math.ceil(wait))
+    return response
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Throttle with the token buckets of utils.throttling. The view's `throttle_scope`
+    (DEFAULT_SCOPE if not set) selects the rate in DEFAULT_THROTTLE_RATES, e.g.
+    '120/min' allows bursts of 120 requests and 2 requests per second after that.
+    """
+
+    def allow_request(self, request, view):
+        self.wait_time = throttle_wait(getattr(view, 'throttle_scope', None) or DEFAULT_SCOPE, request)
+        return not self.wait_time
+
+    def wait(self):
+        return self.wait_time
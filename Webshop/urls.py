@@ -1,17 +1,17 @@
+from django.conf import settings
 from django.contrib.auth.views import PasswordResetDoneView
 from django.contrib.messages import success
 from django.urls import path, include, re_path
 from django.contrib.auth import views as auth_views
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
     TokenRefreshView,
     TokenVerifyView,
 )
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
 from rest_framework import permissions
 
+from utils.api_schema import api_info
+from .async_views import event_stream
 from .views import (
     OrderViewSet,
     ItemViewSet,
@@ -26,20 +26,30 @@ from .views import (
     GroupInvitationViewSet,
     ShoppingListViewSet,
     CustomPasswordResetView,
+    BootstrapViewSet,
+    LoginView,
+    api_schema_view,
 )
 
-schema_view = get_schema_view(
-    openapi.Info(
-        title="B2B API",
-        default_version='v1',
-        description="API documentation for B2B Webshop",
-        terms_of_service="https://www.google.com/policies/terms/",
-        contact=openapi.Contact(email="hothardwarehub@gmail.com"),
-        license=openapi.License(name="BSD License"),
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
+
+def schema_ui_view(renderer):
+    """
+    The Swagger or ReDoc UI, which loads the precomputed schema from api_schema_view.
+    The drf_yasg view is created on the first request, so workers start without drf_yasg.
+    """
+    view = None
+
+    def lazy_view(request, *args, **kwargs):
+        nonlocal view
+        if view is None:
+            from drf_yasg.views import get_schema_view
+
+            schema_view = get_schema_view(api_info(), public=True, permission_classes=(permissions.AllowAny,))
+            view = schema_view.with_ui(renderer, cache_timeout=0)
+        return view(request, *args, **kwargs)
+
+    return lazy_view
+
 
 # Register ViewSets with the router
 router = DefaultRouter()
@@ -52,16 +62,23 @@ me_router.register(r'orders', OrderViewSet, basename='my-orders')
 me_router.register(r'shopping-cart', ShoppingCartViewSet, basename='my-shoppingcart')
 me_router.register(r'addresses', AddressViewSet, basename='my-addresses')
 me_router.register(r'profile', UserShortView, basename='my-profile')
+me_router.register(r'bootstrap', BootstrapViewSet, basename='my-bootstrap')
 
 # Auth URL patterns
 auth_patterns = [
     # User Authentication
     path('register/', UserRegistrationView.as_view(), name='user-registration'),
-    path('login/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('login/', LoginView.as_view(), name='token_obtain_pair'),
     path('refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('verify/', TokenVerifyView.as_view(), name='token_verify'),
     ]
 
+if settings.ASYNC_LOGIN:
+    from .async_views import async_auth_urls
+
+    # Async JSON login and refresh take precedence and fall back to the simplejwt views
+    auth_patterns = async_auth_urls(auth_patterns) + auth_patterns
+
 # Password reset patterns
 selfservice_patterns = [
     path('password-reset/', CustomPasswordResetView.as_view(),
@@ -97,11 +114,18 @@ urlpatterns = [
     path('api-auth/', include('rest_framework.urls')),  # Enables login in the DRF UI
     path('auth/', include((auth_patterns, 'auth'), namespace='auth')),  # Grouped auth routes
     path('selfservice/', include((selfservice_patterns, 'selfservice'), namespace='selfservice')),
+    path('me/events/', event_stream, name='my-events'),  # Server-sent events for the storefront
     path('me/', include(me_router.urls)),  # Group all 'me/' routes under a single prefix
     path('verify-email/<uuid:token>/', EmailVerificationView.as_view({'get':'verify_email'}), name="verify-email"),
     path('group/', include(group_router.urls)),  # Include the group router
     path('group/', include(group_invitation_patterns)),  # Include invitation-specific patterns
-    re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name='schema-json'),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    re_path(r'^swagger(?P<format>\.json|\.yaml)$', api_schema_view, name='schema-json'),
+    path('swagger/', schema_ui_view('swagger'), name='schema-swagger-ui'),
+    path('redoc/', schema_ui_view('redoc'), name='schema-redoc'),
 ]
+
+if settings.ASYNC_READ_VIEWS:
+    from .async_views import async_read_urls
+
+    # Async read paths take precedence and fall back to the router views
+    urlpatterns = async_read_urls(router, me_router) + urlpatterns
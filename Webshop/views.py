@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model, login
 from django.contrib.auth.forms import PasswordResetForm, SetPasswordForm
 from django.contrib.auth.tokens import default_token_generator
@@ -6,40 +7,66 @@ from django.contrib.auth.views import PasswordResetView, PasswordResetConfirmVie
 from django.core.exceptions import ImproperlyConfigured
 from django.core.mail.message import utf8_charset
 from django.db import models
-from django.db.models import Q
-from django.http import JsonResponse, HttpResponseBadRequest, HttpResponseRedirect
+from django.db.models import Count, Prefetch, Q
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest, HttpResponseRedirect
 from django.shortcuts import redirect
 from django.utils.decorators import method_decorator
+from django.utils.crypto import constant_time_compare
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
-from django.views.decorators.cache import never_cache
+from django.views.decorators.cache import cache_control, never_cache
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.debug import sensitive_post_parameters
-from django_filters.rest_framework import DjangoFilterBackend
+from django.views.decorators.http import etag
+from django_filters.rest_framework import DjangoFilterBackend, FilterSet, NumberFilter
 from rest_framework import viewsets, status, serializers
 from rest_framework.decorators import action
 from rest_framework.exceptions import MethodNotAllowed, ValidationError
 from rest_framework.filters import OrderingFilter
 from rest_framework.generics import CreateAPIView, get_object_or_404
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, SAFE_METHODS
 from rest_framework.response import Response
 from rest_framework.viewsets import ViewSet
+from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework.permissions import IsAuthenticated
 
 
 
+from utils.api_schema import SCHEMA_FORMATS, get_schema, schema_etag
+from utils.db_routing import ReplicaReadMixin
 from utils.mail_service import send_group_invitation_mail, send_password_reset_mail, send_inactive_mail
-from .models import Order, Item, CustomUser as User, ShoppingCart, Address, VerificationToken, CompanyGroup, CompanyGroupMembership, CompanyGroupRole, GroupInvitation, ShoppingList, ShoppingListItem, GroupInvitationStatus
+from utils.metrics import REGISTRY
+from utils.pricing import PriceResolver
+from .authentication import CachedJWTAuthentication
+from .models import Order, OrderItem, Item, CustomUser as User, ShoppingCart, CartItem, Address, VerificationToken, CompanyGroup, CompanyGroupMembership, CompanyGroupRole, GroupInvitation, ShoppingList, ShoppingListItem, GroupInvitationStatus
 from .serializers import OrderSerializer, ItemSerializer, UserRegistrationSerializer, UserSerializer, \
     ShoppingCartSerializer, UserShortSerializer, \
     CartItemSerializer, AddressSerializer, CompanyGroupMembershipSerializer, CompanyGroupSerializer, \
-    GroupInvitationSerializer, ShoppingListSerializer, ShoppingListItemsSerializer
+    GroupInvitationSerializer, ShoppingListSerializer, ShoppingListItemsSerializer, ShoppingListConversionSerializer, \
+    BootstrapSerializer
+from .throttling import throttle_wait, throttled_response
 
 
 def default_view(request):
     return JsonResponse({"message": "OK"})
 
 
+@never_cache
+def metrics_view(request):
+    """Request metrics of all worker processes in the Prometheus text format."""
+    if settings.METRICS_TOKEN and not constant_time_compare(
+            request.headers.get('Authorization', ''), f"Bearer {settings.METRICS_TOKEN}"):
+        return HttpResponse(status=401)
+    return HttpResponse(REGISTRY.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@cache_control(no_cache=True)
+@etag(lambda request, format: schema_etag(format))
+def api_schema_view(request, format):
+    """The precomputed OpenAPI schema, revalidated by clients with its ETag."""
+    return HttpResponse(get_schema(format), content_type=SCHEMA_FORMATS[format])
+
+
 # 1. User Registration View
 class UserRegistrationView(CreateAPIView):
     serializer_class = UserRegistrationSerializer
@@ -55,7 +82,13 @@ class BaseUserViewSet(viewsets.ModelViewSet):
         return self.queryset.filter(pk=self.request.user.pk)
 
     def get_object(self):
-        return self.request.user
+        if self.request.method in SAFE_METHODS:
+            return self.request.user
+        # The user of a JWT may come from the principal cache, changes start from the database
+        user = get_object_or_404(self.get_queryset())
+        if isinstance(self.request.successful_authenticator, CachedJWTAuthentication):
+            CachedJWTAuthentication.check_user(user, self.request.auth)
+        return user
 
     def list(self, request, *args, **kwargs):
         return self.retrieve(request, *args, **kwargs)
@@ -114,8 +147,12 @@ class UserView(BaseUserViewSet):
 
 
 # 3. Order Management View
-class OrderViewSet(viewsets.ModelViewSet):
-    queryset = Order.objects.prefetch_related('orderitem_set__item')
+class OrderViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
+    queryset = Order.objects.select_related('order_info').prefetch_related(
+        Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('item__item_details').prefetch_related(
+            'item__item_details__images', 'item__item_details__categories'
+        ))
+    )
     serializer_class = OrderSerializer
     http_method_names = ['get', 'post', 'head']
 
@@ -152,6 +189,7 @@ class ShoppingCartViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = ShoppingCart.objects.prefetch_related('cartitem_set__item')
     serializer_class = ShoppingCartSerializer
     permission_classes = [IsAuthenticated]
+    throttle_scope = 'default'  # the cart mutations use 'cart'
 
     def get_queryset(self):
         # Return only the shopping cart of the logged-in user
@@ -164,7 +202,7 @@ class ShoppingCartViewSet(viewsets.ReadOnlyModelViewSet):
     def get_object(self):
         return self.request.user.shopping_cart
 
-    @action(detail=False, methods=['post'], url_path='set')
+    @action(detail=False, methods=['post'], url_path='set', throttle_scope='cart')
     def set_item(self, request, pk=None):
         """
         Add item to the shopping cart.
@@ -179,7 +217,7 @@ class ShoppingCartViewSet(viewsets.ReadOnlyModelViewSet):
             return Response({'status': 'Success'}, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    @action(detail=False, methods=['post'], url_path='clear')
+    @action(detail=False, methods=['post'], url_path='clear', throttle_scope='cart')
     def clear_cart(self, request, pk=None):
         """
         Clear all items from the shopping cart.
@@ -231,18 +269,40 @@ class AddressViewSet(viewsets.ModelViewSet):
 
 
 # 6. Item View (Product Listings)
-class ItemViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Item.objects.prefetch_related('item_details__images')
+class ItemFilter(FilterSet):
+    """The price filters compare list prices, negotiated group prices are not taken into account."""
+    item_price = NumberFilter(label="List price equals")
+    item_price__lte = NumberFilter(field_name='item_price', lookup_expr='lte', label="List price at most")
+    item_price__gte = NumberFilter(field_name='item_price', lookup_expr='gte', label="List price at least")
+
+    class Meta:
+        model = Item
+        fields = {
+            'item_details__categories__category_name': ['exact', 'icontains'],  # Dynamic category filtering
+            'item_details__item_name': ['exact', 'icontains'],  # Dynamic name filtering
+            'item_details__item_description': ['exact', 'icontains']  # Dynamic description filtering
+        }
+
+
+class ItemOrderingFilter(OrderingFilter):
+    ordering_description = "Which field to use when ordering the results. item_price orders by list price."
+
+
+class ItemViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Items with item_price as the effective price of the requesting user. Filtering and
+    ordering by item_price use the list price, as negotiated prices are resolved per
+    item after the query, so the order of a group customer's prices can differ.
+    """
+    queryset = Item.objects.select_related('item_details').prefetch_related(
+        'item_details__images', 'item_details__categories'
+    )
     serializer_class = ItemSerializer
-    filter_backends = [DjangoFilterBackend, OrderingFilter]
-    filterset_fields = {
-        'item_price': ['exact', 'lte', 'gte'],  # Dynamic price filtering
-        'item_details__categories__category_name': ['exact', 'icontains'],  # Dynamic category filtering
-        'item_details__item_name': ['exact', 'icontains'],  # Dynamic name filtering
-        'item_details__item_description': ['exact', 'icontains']  # Dynamic description filtering
-    }
+    throttle_scope = 'catalog'
+    filter_backends = [DjangoFilterBackend, ItemOrderingFilter]
+    filterset_class = ItemFilter
     ordering_fields = ['item_price', 'item_details__item_name']  # Specify sortable fields
-    ordering = ['item_price']  # Default ordering
+    ordering = ['item_price']  # Default ordering, by list price
 
 
 # 7. Email Verification
@@ -407,7 +467,7 @@ class CompanyGroupMembershipViewSet(viewsets.ModelViewSet):
         instance.delete()
 
 # 11. ShoppingList View
-class ShoppingListViewSet(viewsets.ModelViewSet):
+class ShoppingListViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = ShoppingList.objects.all()
     serializer_class = ShoppingListSerializer
     permission_classes = [IsAuthenticated]
@@ -476,6 +536,31 @@ class ShoppingListViewSet(viewsets.ModelViewSet):
         except ShoppingListItem.DoesNotExist:
             return Response({'error': 'Item not found in this shopping list.'}, status=status.HTTP_404_NOT_FOUND)
 
+    @action(detail=False, methods=['post'], url_path='convert-to-orders')
+    def convert_to_orders(self, request, pk=None):
+        """
+        Convert one or many approved shopping lists into orders in a single transaction.
+        Lists created by the user and lists of groups owned by the user can be converted.
+        """
+        serializer = ShoppingListConversionSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+
+        shopping_list_ids = [shopping_list.pk for shopping_list in serializer.validated_data['shopping_lists']]
+        try:
+            order_ids = Order.objects.create_from_shopping_lists(
+                shopping_list_ids,
+                order_info_data=serializer.validated_data.get('order_info'),
+                user=request.user,
+            )
+        except ValueError as e:
+            raise ValidationError({'shopping_lists': str(e)})
+
+        return Response(
+            {'orders': [{'shopping_list': shopping_list_id, 'order_id': order_id}
+                        for shopping_list_id, order_id in order_ids.items()]},
+            status=status.HTTP_201_CREATED
+        )
+
 
 # @TODO: Implement the following views, maybe combine with frontend view?:
 # 12. User Registration with Invitation View
@@ -485,6 +570,13 @@ class ShoppingListViewSet(viewsets.ModelViewSet):
 class CustomPasswordResetView(PasswordResetView):
     template_name = "password_reset_form.html"
     success_url = '/web/api/selfservice/password-reset/done/'
+
+    def post(self, request, *args, **kwargs):
+        wait = throttle_wait('password_reset', request)
+        if wait:
+            return throttled_response(wait)
+        return super().post(request, *args, **kwargs)
+
     def form_valid(self, form):
         """
         Override form_valid to handle email-based password reset securely.
@@ -501,3 +593,45 @@ class CustomPasswordResetView(PasswordResetView):
                 # Call the mail service to send email
                 send_password_reset_mail(user, token, uid)
         return redirect(self.success_url)
+
+
+# 14. Storefront Bootstrap View
+class BootstrapViewSet(viewsets.ViewSet):
+    """
+    Profile, shopping cart with its total, addresses, the latest orders and the group
+    memberships of the current user in one response, for the first page load of the
+    storefront. Five queries independent of the data (with cached price lists), plus one
+    for item categories when a group has category prices.
+    """
+    permission_classes = [IsAuthenticated]
+    recent_orders = 5
+
+    def get_view_name(self):
+        return "My Storefront Bootstrap"
+
+    def list(self, request, *args, **kwargs):
+        user = request.user
+        memberships = list(CompanyGroupMembership.objects.filter(user=user).select_related('group'))
+        price_resolver = PriceResolver([membership.group_id for membership in memberships])
+        shopping_cart = ShoppingCart.objects.filter(user=user).prefetch_related(
+            Prefetch('cartitem_set', queryset=CartItem.objects.select_related('item'))
+        ).first()
+        addresses = list(Address.objects.filter(user=user))
+        recent_orders = Order.objects.filter(user=user).annotate(item_count=Count('orderitem')).order_by(
+            '-order_date')[:self.recent_orders]
+
+        serializer = BootstrapSerializer({
+            'profile': user,
+            'shopping_cart': shopping_cart,
+            'addresses': addresses,
+            'billing_address': next((address for address in addresses if address.billing), None),
+            'recent_orders': recent_orders,
+            'groups': memberships,
+        }, context={'request': request, 'price_resolver': price_resolver})
+        return Response(serializer.data)
+
+
+# 15. Login View
+class LoginView(TokenObtainPairView):
+    """simplejwt's token view, throttled per IP address in the `login` scope."""
+    throttle_scope = 'login'
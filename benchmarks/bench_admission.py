@@ -0,0 +1,185 @@
+"""
+Measure a uvicorn worker with a slow database, with and without admission control.
+
+The worker runs with a delay of --query-delay ms on every SQL query. Catalog
+connections request the item list in a loop while a few checkout connections place
+orders. Every request gives up after --client-timeout seconds, like a browser or proxy
+would, and a shed request is retried after its Retry-After. Reported per variant and
+route are the successful requests per second, their latency percentiles and the
+requests that were shed with 503 or timed out.
+
+Usage: python benchmarks/bench_admission.py [--catalog 100] [--checkout 4] [--query-delay 20] [--duration 15]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'B2B_Backend.settings')
+os.environ.setdefault('DJANGO_DB_SQLITE', 'bench_admission.sqlite3')
+os.environ.setdefault('DJANGO_DEBUG', 'False')
+os.environ.setdefault('DJANGO_LOG_LEVEL', 'WARNING')
+# Load comes from a few clients on one IP address, which the throttles would turn away
+os.environ.setdefault('DJANGO_THROTTLING', 'False')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+from django.db.backends.signals import connection_created  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from rest_framework_simplejwt.tokens import AccessToken  # noqa: E402
+
+from Webshop.models import CustomUser, Item, ItemDetails  # noqa: E402
+
+BENCH_USER = 'bench-admission@example.com'
+ITEMS = 20
+VARIANTS = ('off', 'on')
+
+
+def slow_database_application():
+    """uvicorn factory of the regular application with BENCH_QUERY_DELAY ms added to every query."""
+    delay = float(os.environ['BENCH_QUERY_DELAY']) / 1000
+
+    def slow_execute(execute, sql, params, many, context):
+        time.sleep(delay)
+        return execute(sql, params, many, context)
+
+    def install(sender, connection, **kwargs):
+        connection.execute_wrappers.append(slow_execute)
+
+    connection_created.connect(install, weak=False)
+    from B2B_Backend.asgi import application
+    return application
+
+
+def seed():
+    # Migrations are generated at deploy time, so the schema is created from the models
+    with override_settings(MIGRATION_MODULES={'Webshop': None}):
+        call_command('migrate', run_syncdb=True, verbosity=0)
+    user = CustomUser.objects.filter(email=BENCH_USER).first()
+    if user is None:
+        user = CustomUser.objects.create_user(email=BENCH_USER, password='benchmark', verified=True)
+        for number in range(ITEMS):
+            details = ItemDetails.objects.create(item_name=f"Produkt {number}", item_description="Beschreibung")
+            Item.objects.create(item_details=details, item_price=10 + number, article_id=f'AC{number:06d}',
+                                item_stock=1000000)
+    return str(AccessToken.for_user(user)), list(Item.objects.values_list('pk', flat=True))
+
+
+async def request(reader, writer, method, path, token, body=b''):
+    head = (f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nAccept: application/json\r\n"
+            f"Authorization: Bearer {token}\r\n")
+    if body:
+        head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+    writer.write(head.encode() + b"\r\n" + body)
+    await writer.drain()
+    response = await reader.readuntil(b"\r\n\r\n")
+    headers = dict(line.lower().split(b": ", 1) for line in response.split(b"\r\n")[1:] if b": " in line)
+    await reader.readexactly(int(headers[b'content-length']))
+    return int(response.split(b" ", 2)[1]), float(headers.get(b'retry-after', 0))
+
+
+async def connection(port, route, method, path, body, token, deadline, timeout, results):
+    latencies, outcomes = results.setdefault(route, ([], {}))
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        if writer is None:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        start = time.perf_counter()
+        try:
+            status, retry_after = await asyncio.wait_for(request(reader, writer, method, path, token, body), timeout)
+        except asyncio.TimeoutError:
+            # The client gives up, the server may still be working on the request
+            outcomes['timeout'] = outcomes.get('timeout', 0) + 1
+            writer.close()
+            writer = None
+            continue
+        if status < 300:
+            latencies.append(time.perf_counter() - start)
+        outcomes[status] = outcomes.get(status, 0) + 1
+        if status == 503:
+            await asyncio.sleep(retry_after)
+    if writer is not None:
+        writer.close()
+
+
+def percentile(latencies, percent):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * percent / 100))] * 1000 if latencies else 0
+
+
+async def load(port, token, item_ids, catalog, checkout, duration, timeout):
+    deadline = time.perf_counter() + duration
+    results = {}
+    order = json.dumps({
+        'order_info': {'buyer_name': 'Lasttest', 'buyer_email': 'lasttest@example.com', 'buyer_phone': '0',
+                       'buyer_address': 'Teststraße 1'},
+        'items': [{'item_id': item_id, 'quantity': 1} for item_id in item_ids[:3]],
+    }).encode()
+    await asyncio.gather(
+        *(connection(port, 'catalog', 'GET', '/web/api/items/', b'', token, deadline, timeout, results)
+          for _ in range(catalog)),
+        *(connection(port, 'checkout', 'POST', '/web/api/me/orders/', order, token, deadline, timeout, results)
+          for _ in range(checkout)),
+    )
+    return results
+
+
+def start_server(port, variant, query_delay):
+    env = dict(os.environ, DJANGO_ADMISSION_CONTROL=str(variant == 'on'), BENCH_QUERY_DELAY=str(query_delay))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'benchmarks.bench_admission:slow_database_application', '--factory',
+         '--port', str(port), '--log-level', 'warning', '--no-access-log'],
+        cwd=BASE_DIR, env=env,
+    )
+    for _ in range(100):
+        try:
+            asyncio.run(asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), 1))
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("uvicorn did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--catalog', type=int, default=100, help="Concurrent catalog connections")
+    parser.add_argument('--checkout', type=int, default=4, help="Concurrent checkout connections")
+    parser.add_argument('--query-delay', type=float, default=20, help="Milliseconds added to every SQL query")
+    parser.add_argument('--client-timeout', type=float, default=10)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--port', type=int, default=8767)
+    args = parser.parse_args()
+
+    token, item_ids = seed()
+    print(f"catalog connections: {args.catalog}, checkout connections: {args.checkout}, "
+          f"query delay: {args.query_delay} ms, client timeout: {args.client_timeout}s, duration: {args.duration}s")
+    print(f"{'admission':9} {'route':8} {'ok/s':>7} {'p50 ms':>8} {'p99 ms':>8} {'503':>6} {'timeout':>8} {'other':>6}")
+    for variant in VARIANTS:
+        server = start_server(args.port, variant, args.query_delay)
+        try:
+            results = asyncio.run(load(args.port, token, item_ids, args.catalog, args.checkout, args.duration,
+                                       args.client_timeout))
+        finally:
+            server.terminate()
+            server.wait()
+        for route in ('checkout', 'catalog'):
+            latencies, outcomes = results.get(route, ([], {}))
+            latencies.sort()
+            other = sum(count for status, count in outcomes.items()
+                        if status not in ('timeout', 503) and status >= 300)
+            print(f"{variant:9} {route:8} {len(latencies) / args.duration:7.1f} {percentile(latencies, 50):8.1f} "
+                  f"{percentile(latencies, 99):8.1f} {outcomes.get(503, 0):6} {outcomes.get('timeout', 0):8} "
+                  f"{other:6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+Benchmark the async read views against the sync DRF views under uvicorn.
+
+Both variants run with the same number of uvicorn workers against a temporary SQLite
+database seeded with synthetic data, removed after the run. Each endpoint is loaded by concurrent
+keep-alive connections for a fixed duration; requests per second and latency
+percentiles are reported per variant.
+
+Usage: python benchmarks/bench_async_views.py [--workers 2] [--concurrency 64] [--duration 10]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from decimal import Decimal
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'B2B_Backend.settings')
+# Removed when the benchmark exits, the uvicorn workers inherit the path
+BENCH_DIR = tempfile.TemporaryDirectory(prefix='bench-async-views-')
+os.environ.setdefault('DJANGO_DB_NAME', str(Path(BENCH_DIR.name) / 'bench.sqlite3'))
+os.environ.setdefault('DJANGO_DEBUG', 'False')
+os.environ.setdefault('DJANGO_LOG_LEVEL', 'WARNING')
+# Load comes from a few clients on one IP address, which the throttles would turn away
+os.environ.setdefault('DJANGO_THROTTLING', 'False')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from rest_framework_simplejwt.tokens import AccessToken  # noqa: E402
+
+from Webshop.models import CustomUser, Item, ItemCategory, ItemDetails, Order, ShoppingCart  # noqa: E402
+
+BENCH_USER = 'bench@example.com'
+
+
+def seed(items):
+    """Create the catalog, a user with a filled cart and a few orders, once per database."""
+    # Migrations are generated at deploy time, so the schema is created from the models
+    with override_settings(MIGRATION_MODULES={'Webshop': None}):
+        call_command('migrate', run_syncdb=True, verbosity=0)
+    user = CustomUser.objects.filter(email=BENCH_USER).first()
+    if user is not None:
+        return user
+
+    category = ItemCategory.objects.create(category_name='Benchmark')
+    details = ItemDetails.objects.bulk_create(
+        [ItemDetails(item_name=f"Produkt {i}", item_description="Beschreibung") for i in range(items)]
+    )
+    category.items.add(*details)
+    catalog = Item.objects.bulk_create([
+        Item(item_details=detail, item_price=Decimal(i % 500 + 1), article_id=f"B{i:07d}", item_stock=10)
+        for i, detail in enumerate(details)
+    ])
+
+    user = CustomUser.objects.create_user(email=BENCH_USER, password='benchmark', verified=True)
+    cart, _ = ShoppingCart.objects.get_or_create(user=user)
+    for item in catalog[:10]:
+        cart.set_item(item, 2)
+    order_info = {'buyer_name': 'Bench', 'buyer_email': BENCH_USER, 'buyer_phone': '0', 'buyer_address': 'x'}
+    for start in range(0, 50, 5):
+        Order.objects.create_with_info_and_items(
+            order_info_data=order_info, user=user,
+            items_data=[{'item': item, 'quantity': 1} for item in catalog[start:start + 5]],
+        )
+    return user
+
+
+async def request(reader, writer, path, token):
+    writer.write(
+        f"GET {path} HTTP/1.1\r\nHost: localhost\r\nAccept: application/json\r\n"
+        f"Authorization: Bearer {token}\r\n\r\n".encode()
+    )
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = next(int(line.split(b":", 1)[1]) for line in head.split(b"\r\n")
+                  if line.lower().startswith(b"content-length:"))
+    await reader.readexactly(length)
+    return status
+
+
+async def connection(port, path, token, deadline, latencies, errors):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            status = await request(reader, writer, path, token)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def load(port, path, token, concurrency, duration):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(connection(port, path, token, deadline, latencies, errors) for _ in range(concurrency)))
+    latencies.sort()
+    return {
+        'rps': len(latencies) / duration,
+        'p50': statistics.median(latencies) * 1000,
+        'p99': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        'errors': len(errors),
+    }
+
+
+def start_server(port, workers, async_views):
+    env = dict(os.environ, DJANGO_ASYNC_READ_VIEWS=str(async_views))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'B2B_Backend.asgi:application', '--port', str(port),
+         '--workers', str(workers), '--log-level', 'warning', '--no-access-log'],
+        cwd=BASE_DIR, env=env,
+    )
+    for _ in range(100):
+        try:
+            asyncio.run(asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), 1))
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("uvicorn did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--items', type=int, default=50, help="Catalog size, all items are listed per request")
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    token = str(AccessToken.for_user(seed(args.items)))
+    item_id = Item.objects.values_list('pk', flat=True).first()
+    paths = ['/web/api/items/', f'/web/api/items/{item_id}/', '/web/api/me/shopping-cart/', '/web/api/me/orders/']
+
+    print(f"workers: {args.workers}, concurrency: {args.concurrency}, duration: {args.duration}s")
+    print(f"{'endpoint':32} {'variant':6} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for async_views in (False, True):
+        server = start_server(args.port, args.workers, async_views)
+        try:
+            for path in paths:
+                result = asyncio.run(load(args.port, path, token, args.concurrency, args.duration))
+                print(f"{path:32} {'async' if async_views else 'sync':6} {result['rps']:9.1f} "
+                      f"{result['p50']:9.1f} {result['p99']:9.1f} {result['errors']:7}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Measure how a login burst affects catalog requests on the same uvicorn worker.
+
+Catalog connections load an item detail page for a fixed duration, once alone and once
+while login connections post credentials in a loop. This runs with the sync simplejwt
+login (DJANGO_ASYNC_LOGIN=False) and with the async login that hashes in the bounded
+pool of utils.password_hashing. Reported are the catalog latency percentiles and the
+login throughput per run.
+
+Usage: python benchmarks/bench_login_isolation.py [--logins 16] [--catalog 8] [--duration 10]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'B2B_Backend.settings')
+os.environ.setdefault('DJANGO_DB_SQLITE', 'bench_login_isolation.sqlite3')
+os.environ.setdefault('DJANGO_DEBUG', 'False')
+os.environ.setdefault('DJANGO_LOG_LEVEL', 'WARNING')
+# Load comes from a few clients on one IP address, which the throttles would turn away
+os.environ.setdefault('DJANGO_THROTTLING', 'False')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+
+from Webshop.models import CustomUser, Item, ItemDetails  # noqa: E402
+
+BENCH_USER = 'bench-login@example.com'
+BENCH_PASSWORD = 'benchmark-password'
+
+
+def seed():
+    # Migrations are generated at deploy time, so the schema is created from the models
+    with override_settings(MIGRATION_MODULES={'Webshop': None}):
+        call_command('migrate', run_syncdb=True, verbosity=0)
+    if not CustomUser.objects.filter(email=BENCH_USER).exists():
+        CustomUser.objects.create_user(email=BENCH_USER, password=BENCH_PASSWORD, verified=True)
+        details = ItemDetails.objects.create(item_name="Produkt", item_description="Beschreibung")
+        Item.objects.create(item_details=details, item_price=10, article_id='BL000001', item_stock=10)
+    return Item.objects.values_list('pk', flat=True).first()
+
+
+async def request(reader, writer, method, path, body=b''):
+    head = f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nAccept: application/json\r\n"
+    if body:
+        head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+    writer.write(head.encode() + b"\r\n" + body)
+    await writer.drain()
+    response = await reader.readuntil(b"\r\n\r\n")
+    length = next(int(line.split(b":", 1)[1]) for line in response.split(b"\r\n")
+                  if line.lower().startswith(b"content-length:"))
+    await reader.readexactly(length)
+    return int(response.split(b" ", 2)[1])
+
+
+async def connection(port, method, path, body, deadline, latencies, errors):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            status = await request(reader, writer, method, path, body)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+def percentile(latencies, percent):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * percent / 100))] * 1000 if latencies else 0
+
+
+async def load(port, item_id, catalog, logins, duration):
+    deadline = time.perf_counter() + duration
+    catalog_latencies, login_latencies, errors = [], [], []
+    credentials = json.dumps({'email': BENCH_USER, 'password': BENCH_PASSWORD}).encode()
+    await asyncio.gather(
+        *(connection(port, 'GET', f'/web/api/items/{item_id}/', b'', deadline, catalog_latencies, errors)
+          for _ in range(catalog)),
+        *(connection(port, 'POST', '/web/api/auth/login/', credentials, deadline, login_latencies, errors)
+          for _ in range(logins)),
+    )
+    catalog_latencies.sort()
+    login_latencies.sort()
+    return {
+        'catalog_rps': len(catalog_latencies) / duration,
+        'catalog_p50': percentile(catalog_latencies, 50),
+        'catalog_p99': percentile(catalog_latencies, 99),
+        'login_rps': len(login_latencies) / duration,
+        'login_p50': percentile(login_latencies, 50),
+        'errors': len(errors),
+    }
+
+
+def start_server(port, async_login):
+    env = dict(os.environ, DJANGO_ASYNC_LOGIN=str(async_login))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'B2B_Backend.asgi:application', '--port', str(port),
+         '--log-level', 'warning', '--no-access-log'],
+        cwd=BASE_DIR, env=env,
+    )
+    for _ in range(100):
+        try:
+            asyncio.run(asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), 1))
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("uvicorn did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--catalog', type=int, default=8, help="Concurrent catalog connections")
+    parser.add_argument('--logins', type=int, default=16, help="Concurrent login connections during the burst")
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    item_id = seed()
+    print(f"catalog connections: {args.catalog}, login connections: {args.logins}, duration: {args.duration}s")
+    print(f"{'login':6} {'burst':6} {'catalog/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'logins/s':>9} "
+          f"{'login p50':>10} {'errors':>7}")
+    for async_login in (False, True):
+        server = start_server(args.port, async_login)
+        try:
+            for logins in (0, args.logins):
+                result = asyncio.run(load(args.port, item_id, args.catalog, logins, args.duration))
+                print(f"{'async' if async_login else 'sync':6} {'yes' if logins else 'no':6} "
+                      f"{result['catalog_rps']:10.1f} {result['catalog_p50']:8.1f} {result['catalog_p99']:8.1f} "
+                      f"{result['login_rps']:9.1f} {result['login_p50']:10.1f} {result['errors']:7}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+Measure the per-request overhead of the middleware stack for bearer token API requests.
+
+Requests are sent straight to the ASGI handler, without a server, one after another,
+each variant in a fresh process, so the difference between the variants is the time spent in middleware and
+authentication:
+
+- legacy: the full browser stack and Session, Basic and JWT authentication in that order
+- lean:   the current settings, browser-only middleware is skipped for bearer requests
+- bare:   no middleware at all, the lower bound
+
+The "basic" endpoint sends wrong basic credentials, which the legacy configuration
+checks with a full password hash on every request.
+
+Usage: python benchmarks/bench_middleware.py [--requests 2000] [--rounds 3]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'B2B_Backend.settings')
+os.environ.setdefault('DJANGO_DB_SQLITE', 'bench_middleware.sqlite3')
+os.environ.setdefault('DJANGO_DEBUG', 'False')
+os.environ.setdefault('DJANGO_LOG_LEVEL', 'WARNING')
+# Load comes from a few clients on one IP address, which the throttles would turn away
+os.environ.setdefault('DJANGO_THROTTLING', 'False')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.asgi import get_asgi_application  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from rest_framework_simplejwt.tokens import AccessToken  # noqa: E402
+
+from Webshop.models import CustomUser, Item, ItemDetails  # noqa: E402
+
+BENCH_USER = 'bench-middleware@example.com'
+
+LEGACY_MIDDLEWARE = [
+    'Webshop.middleware.metrics_middleware',
+    'Webshop.middleware.profiler_middleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'Webshop.middleware.primary_pin_middleware',
+]
+LEGACY_AUTHENTICATION = (
+    'rest_framework.authentication.SessionAuthentication',
+    'rest_framework.authentication.BasicAuthentication',
+    'rest_framework_simplejwt.authentication.JWTAuthentication',
+)
+
+
+def seed():
+    # Migrations are generated at deploy time, so the schema is created from the models
+    with override_settings(MIGRATION_MODULES={'Webshop': None}):
+        call_command('migrate', run_syncdb=True, verbosity=0)
+    user = CustomUser.objects.filter(email=BENCH_USER).first()
+    if user is None:
+        user = CustomUser.objects.create_user(email=BENCH_USER, password='benchmark', verified=True)
+        details = ItemDetails.objects.create(item_name="Produkt", item_description="Beschreibung")
+        Item.objects.create(item_details=details, item_price=10, article_id='BM000001', item_stock=10)
+    return user
+
+
+# DRF views read their authentication classes on import, so every variant runs in its own process
+VARIANTS = ('legacy', 'lean', 'bare')
+
+
+def variant_settings(variant):
+    if variant == 'legacy':
+        return {'MIDDLEWARE': LEGACY_MIDDLEWARE,
+                'REST_FRAMEWORK': {**settings.REST_FRAMEWORK, 'DEFAULT_AUTHENTICATION_CLASSES': LEGACY_AUTHENTICATION}}
+    if variant == 'bare':
+        return {'MIDDLEWARE': []}
+    return {}
+
+
+async def call(application, path, authorization):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'localhost'), (b'accept', b'application/json'), (b'authorization', authorization)],
+        'client': ('127.0.0.1', 50000), 'server': ('localhost', 80),
+    }
+    status = None
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Future()  # the client stays connected, Django cancels this wait after the response
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await application(scope, receive, send)
+    return status
+
+
+async def measure(application, path, authorization, requests):
+    for _ in range(min(50, requests)):  # warm up connections and caches
+        await call(application, path, authorization)
+    timings, statuses = [], set()
+    for _ in range(requests):
+        start = time.perf_counter()
+        statuses.add(await call(application, path, authorization))
+        timings.append(time.perf_counter() - start)
+    return statistics.mean(timings) * 1000, statistics.median(timings) * 1000, sorted(statuses)
+
+
+def run_variant(variant, requests):
+    user = seed()
+    bearer = f"Bearer {AccessToken.for_user(user)}".encode()
+    basic = b"Basic " + base64.b64encode(f"{BENCH_USER}:falsch".encode())
+    item_id = Item.objects.values_list('pk', flat=True).first()
+    endpoints = [
+        ('item', f'/web/api/items/{item_id}/', bearer, requests),
+        ('cart', '/web/api/me/shopping-cart/', bearer, requests),
+        ('basic', f'/web/api/items/{item_id}/', basic, max(1, requests // 20)),
+    ]
+    with override_settings(**variant_settings(variant)):
+        application = get_asgi_application()
+        return {name: asyncio.run(measure(application, path, authorization, count))
+                for name, path, authorization, count in endpoints}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000, help="Requests per endpoint and variant")
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--variant', choices=VARIANTS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(run_variant(args.variant, args.requests)))
+        return
+
+    seed()
+    # The variants take turns, per endpoint the fastest round counts, which evens out noisy neighbours
+    results = {}
+    for _ in range(args.rounds):
+        for variant in VARIANTS:
+            output = subprocess.run([sys.executable, __file__, '--variant', variant, '--requests', str(args.requests)],
+                                    capture_output=True, text=True, check=True).stdout
+            for name, result in json.loads(output.strip().splitlines()[-1]).items():
+                best = results.setdefault(variant, {}).get(name)
+                if best is None or result[1] < best[1]:
+                    results[variant][name] = result
+
+    print(f"{'endpoint':8} {'variant':8} {'mean ms':>9} {'p50 ms':>9} {'p50 overhead':>12} {'status':>8}")
+    for name in results['bare']:
+        bare_p50 = results['bare'][name][1]
+        for variant in VARIANTS:
+            mean, p50, statuses = results[variant][name]
+            print(f"{name:8} {variant:8} {mean:9.3f} {p50:9.3f} {p50 - bare_p50:12.3f} "
+                  f"{','.join(map(str, statuses)):>8}")
+
+
+if __name__ == '__main__':
+    main()
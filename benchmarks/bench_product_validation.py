@@ -0,0 +1,105 @@
+"""
+Benchmark the vectorized product CSV validation against the previous row-by-row implementation.
+
+Usage: python benchmarks/bench_product_validation.py [--rows 200000]
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'B2B_Backend.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from utils.product_upload import format_validation_errors, validate_product_data  # noqa: E402
+
+
+def legacy_validate_product_data(df):
+    """The iterrows() based implementation replaced by validate_product_data."""
+    errors = []
+
+    for index, row in df.iterrows():
+        try:
+            item_name = str(row.get('item_name', '')).strip()
+            item_description = str(row.get('item_description', '')).strip()
+            category_name = str(row.get('item_category', '')).strip()
+            item_price = str(row.get('item_price', '')).strip()
+            item_stock = str(row.get('item_stock', '')).strip()
+            article_id = str(row.get('article_id', '')).strip()
+
+            if not item_name or not item_description or not category_name:
+                errors.append(f"Zeile {index + 1}: Name, Beschreibung und Kategorie fehlen.")
+
+            try:
+                item_price = float(item_price.replace(",", ".")) if item_price else 0.0
+                if item_price <= 0:
+                    errors.append(f"Zeile {index + 1}: Der Preis muss eine Zahl größer als 0 sein.")
+            except ValueError:
+                errors.append(f"Zeile {index + 1}: Der Preis ist ungültig.")
+
+            if not item_stock.isdigit():
+                errors.append(f"Zeile {index + 1}: Der Lagerbestand muss eine gültige Zahl sein.")
+
+            if len(article_id) < 4:
+                errors.append(f"Zeile {index + 1}: Die Artikel-ID muss mindestens 4 Zeichen lang sein.")
+
+        except Exception as e:
+            errors.append(f"Zeile {index + 1}: Fehler beim Validieren - {e}")
+
+    return errors
+
+
+def build_feed(rows):
+    """Build a supplier feed with roughly 1% invalid rows."""
+    df = pd.DataFrame({
+        'article_id': [f"P{i:07d}" for i in range(rows)],
+        'item_name': [f"Produkt {i}" for i in range(rows)],
+        'item_category': ['Laptop'] * rows,
+        'item_price': [f"{i % 2000 + 1},99" for i in range(rows)],
+        'item_description': ['Beschreibung'] * rows,
+        'item_stock': [str(i % 50) for i in range(rows)],
+    })
+    invalid = df.index[::100]
+    df.loc[invalid[0::4], 'item_price'] = 'abc'
+    df.loc[invalid[1::4], 'item_stock'] = '-1'
+    df.loc[invalid[2::4], 'article_id'] = 'P1'
+    df.loc[invalid[3::4], 'item_name'] = ''
+    return df
+
+
+def measure(function, df):
+    start = time.perf_counter()
+    result = function(df)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=200_000)
+    args = parser.parse_args()
+
+    df = build_feed(args.rows)
+    legacy_errors, legacy_seconds = measure(legacy_validate_product_data, df)
+    errors, seconds = measure(validate_product_data, df)
+
+    # Both implementations must report the same errors, apart from the new duplicate check
+    messages = format_validation_errors(errors, limit=len(errors))
+    messages = [message for message in messages if 'mehrfach' not in message]
+    assert messages == legacy_errors, "validation results differ"
+
+    print(f"rows:        {args.rows}")
+    print(f"errors:      {len(errors)}")
+    print(f"iterrows:    {legacy_seconds:.3f}s")
+    print(f"vectorized:  {seconds:.3f}s")
+    print(f"speedup:     {legacy_seconds / seconds:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
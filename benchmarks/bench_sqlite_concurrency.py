@@ -0,0 +1,164 @@
+"""
+Benchmark concurrent checkout traffic against SQLite with and without production mode.
+
+Every variant gets a fresh database file. Several worker processes with a few threads
+each (like uvicorn workers running sync views in threads) fill their shopping carts
+with ShoppingCart.set_item, read them back and check out with
+Order.objects.create_with_info_and_items for a fixed duration. Reported are the
+completed operations per second, latency percentiles and the number of
+"database is locked" errors that reached the caller.
+
+- legacy: rollback journal, deferred transactions, no retries
+- production: WAL and SQLITE_PRAGMAS, BEGIN IMMEDIATE, retry_on_lock
+
+Usage: python benchmarks/bench_sqlite_concurrency.py [--processes 4] [--threads 4] [--duration 10]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+VARIANTS = {
+    'legacy': {'DJANGO_SQLITE_PRODUCTION_MODE': 'False', 'DJANGO_SQLITE_WRITE_ATTEMPTS': '1'},
+    'production': {'DJANGO_SQLITE_PRODUCTION_MODE': 'True'},
+}
+ITEMS = 200
+ITEMS_PER_ORDER = 3
+
+
+def setup_django():
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'B2B_Backend.settings')
+    import django
+    django.setup()
+
+
+def seed(users):
+    """Create the schema, the catalog and one user per worker thread."""
+    from django.core.management import call_command
+    from django.test.utils import override_settings
+
+    from Webshop.models import CustomUser, Item, ItemDetails
+
+    # Migrations are generated at deploy time, so the schema is created from the models
+    with override_settings(MIGRATION_MODULES={'Webshop': None}):
+        call_command('migrate', run_syncdb=True, verbosity=0)
+    details = ItemDetails.objects.bulk_create(
+        [ItemDetails(item_name=f"Produkt {i}", item_description="Beschreibung") for i in range(ITEMS)]
+    )
+    Item.objects.bulk_create([
+        Item(item_details=detail, item_price=Decimal(i % 50 + 1), article_id=f"S{i:05d}", item_stock=10)
+        for i, detail in enumerate(details)
+    ])
+    CustomUser.objects.bulk_create([
+        CustomUser(email=f"bench{i}@example.com", password='!', verified=True) for i in range(users)
+    ])
+
+
+def worker_thread(user_email, deadline, result):
+    from django.db import OperationalError, connection
+
+    from utils.sqlite import is_lock_error
+    from Webshop.models import CustomUser, Item, Order, ShoppingCart
+
+    try:
+        user = CustomUser.objects.get(email=user_email)
+        cart, _ = ShoppingCart.objects.get_or_create(user=user)
+        items = list(Item.objects.all())
+        order_info = {'buyer_name': 'Bench', 'buyer_email': user_email, 'buyer_phone': '0', 'buyer_address': 'x'}
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                for item in random.sample(items, ITEMS_PER_ORDER):
+                    cart.set_item(item, random.randint(1, 3))
+                cart_items = list(cart.cartitem_set.select_related('item'))
+                Order.objects.create_with_info_and_items(
+                    order_info_data=order_info, user=user,
+                    items_data=[{'item': cart_item.item, 'quantity': cart_item.quantity} for cart_item in cart_items],
+                )
+                cart.clear()
+            except OperationalError as e:
+                result['locked' if is_lock_error(e) else 'errors'] += 1
+                continue
+            result['latencies'].append(time.perf_counter() - start)
+    finally:
+        connection.close()
+
+
+def run_worker(users, duration):
+    """Run one thread per user until the deadline and print the results as JSON."""
+    setup_django()
+    deadline = time.perf_counter() + duration
+    results = [{'latencies': [], 'locked': 0, 'errors': 0} for _ in users]
+    threads = [threading.Thread(target=worker_thread, args=(user, deadline, result))
+               for user, result in zip(users, results)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(json.dumps({
+        'latencies': [latency for result in results for latency in result['latencies']],
+        'locked': sum(result['locked'] for result in results),
+        'errors': sum(result['errors'] for result in results),
+    }))
+
+
+def run_variant(variant, processes, threads, duration):
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, **VARIANTS[variant], DJANGO_DB_NAME=str(Path(directory) / 'bench.sqlite3'),
+                   DJANGO_DEBUG='False', DJANGO_LOG_LEVEL='ERROR')
+        command = [sys.executable, __file__]
+        subprocess.run([*command, '--seed', str(processes * threads)], env=env, check=True)
+
+        workers = [
+            subprocess.Popen([*command, '--worker', *(f"bench{p * threads + t}@example.com" for t in range(threads)),
+                              '--duration', str(duration)], env=env, stdout=subprocess.PIPE, text=True)
+            for p in range(processes)
+        ]
+        outputs = [json.loads(worker.communicate()[0]) for worker in workers]
+
+    latencies = sorted(latency for output in outputs for latency in output['latencies'])
+    return {
+        'checkouts/s': len(latencies) / duration,
+        'p50': statistics.median(latencies) * 1000 if latencies else 0,
+        'p99': latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000 if latencies else 0,
+        'locked': sum(output['locked'] for output in outputs),
+        'errors': sum(output['errors'] for output in outputs),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--seed', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--worker', nargs='+', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        setup_django()
+        return seed(args.seed)
+    if args.worker:
+        return run_worker(args.worker, args.duration)
+
+    print(f"processes: {args.processes}, threads: {args.threads}, duration: {args.duration}s")
+    print(f"{'variant':11} {'checkouts/s':>12} {'p50 ms':>9} {'p99 ms':>9} {'locked':>7} {'errors':>7}")
+    for variant in VARIANTS:
+        result = run_variant(variant, args.processes, args.threads, args.duration)
+        print(f"{variant:11} {result['checkouts/s']:12.1f} {result['p50']:9.1f} {result['p99']:9.1f} "
+              f"{result['locked']:7} {result['errors']:7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+Measure idle server-sent event connections and the delivery of their events.
+
+A uvicorn worker serves --connections event streams of --users users. Reported are the
+resident memory of the worker per idle connection and the latency from a commit in this
+process until the event arrived on every affected stream, which also covers the delivery
+between processes through utils.events:
+
+- order: the status of one user's order changes, the event goes to that user's streams
+- stock: the stock of an item in every cart changes, the event goes to all streams
+
+For comparison the time of one poll of /me/orders/, which the streams replace, is listed.
+
+Usage: python benchmarks/bench_sse.py [--connections 1000] [--users 100] [--rounds 20]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'B2B_Backend.settings')
+os.environ.setdefault('DJANGO_DB_SQLITE', 'bench_sse.sqlite3')
+os.environ.setdefault('DJANGO_DEBUG', 'False')
+os.environ.setdefault('DJANGO_LOG_LEVEL', 'WARNING')
+
+import django  # noqa: E402
+
+django.setup()
+
+from asgiref.sync import sync_to_async  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from rest_framework_simplejwt.tokens import AccessToken  # noqa: E402
+
+from Webshop.models import CustomUser, Item, ItemDetails, Order, OrderStatus  # noqa: E402
+
+BENCH_USER = 'bench-sse-{}@example.com'
+ORDERS_PER_USER = 20
+
+
+def seed(users):
+    # Migrations are generated at deploy time, so the schema is created from the models
+    with override_settings(MIGRATION_MODULES={'Webshop': None}):
+        call_command('migrate', run_syncdb=True, verbosity=0)
+    item = Item.objects.filter(article_id='SSE00001').first()
+    if item is None:
+        details = ItemDetails.objects.create(item_name="Produkt", item_description="Beschreibung")
+        item = Item.objects.create(item_details=details, item_price=10, article_id='SSE00001', item_stock=10)
+    tokens, orders = [], []
+    for number in range(users):
+        user = CustomUser.objects.filter(email=BENCH_USER.format(number)).first()
+        if user is None:
+            user = CustomUser.objects.create_user(email=BENCH_USER.format(number), password='benchmark', verified=True)
+            user.shopping_cart.set_item(item, 1)
+            Order.objects.bulk_create([Order(user=user) for _ in range(ORDERS_PER_USER)])
+        tokens.append(str(AccessToken.for_user(user)))
+        orders.append(Order.objects.filter(user=user).first())
+    return item, tokens, orders
+
+
+class Stream:
+    """One event stream, read as HTTP/1.0 so the events arrive without chunked encoding."""
+
+    def __init__(self, user, arrivals):
+        self.user = user
+        self.arrivals = arrivals
+
+    async def open(self, port, token):
+        self.reader, self.writer = await asyncio.open_connection('127.0.0.1', port)
+        self.writer.write(f"GET /web/api/me/events/ HTTP/1.0\r\nHost: localhost\r\n"
+                          f"Authorization: Bearer {token}\r\nAccept: text/event-stream\r\n\r\n".encode())
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        if not head.startswith(b"HTTP/1.1 200"):
+            raise RuntimeError(head.decode())
+        await self.reader.readuntil(b"\n\n")  # the ready event
+
+    async def read(self):
+        while True:
+            event = await self.reader.readuntil(b"\n\n")
+            lines = dict(line.split(': ', 1) for line in event.decode().splitlines() if ': ' in line)
+            if 'data' in lines:
+                data = json.loads(lines['data'])
+                self.arrivals.setdefault((lines['event'], data.get('order_status', data.get('item_stock'))),
+                                         []).append(time.perf_counter())
+
+    def close(self):
+        self.writer.close()
+
+
+def worker_rss_kib(pid):
+    return next(int(line.split()[1]) for line in open(f'/proc/{pid}/status') if line.startswith('VmRSS:'))
+
+
+def start_server(port):
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'B2B_Backend.asgi:application', '--port', str(port),
+         '--log-level', 'warning', '--no-access-log'],
+        cwd=BASE_DIR,
+    )
+    for _ in range(100):
+        try:
+            asyncio.run(asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), 1))
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("uvicorn did not start")
+
+
+async def poll_orders(port, token, requests=20):
+    timings = []
+    for _ in range(requests):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        start = time.perf_counter()
+        writer.write(f"GET /web/api/me/orders/ HTTP/1.0\r\nHost: localhost\r\nAccept: application/json\r\n"
+                     f"Authorization: Bearer {token}\r\n\r\n".encode())
+        await reader.read()
+        timings.append(time.perf_counter() - start)
+        writer.close()
+    return statistics.median(timings) * 1000
+
+
+async def wait_for(arrivals, key, count, timeout=10):
+    deadline = time.perf_counter() + timeout
+    while len(arrivals.get(key, ())) < count:
+        if time.perf_counter() > deadline:
+            raise RuntimeError(f"{len(arrivals.get(key, ()))} of {count} streams received {key}")
+        await asyncio.sleep(0.001)
+    return max(arrivals[key])
+
+
+async def run(port, server_pid, connections, users, rounds, item, tokens, orders):
+    poll_ms = await poll_orders(port, tokens[0])
+    rss_before = worker_rss_kib(server_pid)
+
+    arrivals = {}
+    streams = [Stream(number % users, arrivals) for number in range(connections)]
+    for start in range(0, connections, 100):
+        await asyncio.gather(*(stream.open(port, tokens[stream.user]) for stream in streams[start:start + 100]))
+    readers = [asyncio.create_task(stream.read()) for stream in streams]
+    await asyncio.sleep(1)
+    rss_after = worker_rss_kib(server_pid)
+
+    latencies = {'order': [], 'stock': []}
+    per_user = [sum(1 for stream in streams if stream.user == user) for user in range(users)]
+    for number in range(rounds):
+        user = number % users
+        order = orders[user]
+        order.order_status = OrderStatus.SHIPPED if order.order_status == OrderStatus.PENDING else OrderStatus.PENDING
+        start = time.perf_counter()
+        await sync_to_async(order.save)(update_fields=['order_status'])
+        latencies['order'].append(await wait_for(arrivals, ('order_status', order.order_status), per_user[user])
+                                  - start)
+        arrivals.clear()
+
+        item.item_stock += 1
+        start = time.perf_counter()
+        await sync_to_async(item.save)(update_fields=['item_stock'])
+        latencies['stock'].append(await wait_for(arrivals, ('item_stock', item.item_stock), connections) - start)
+        arrivals.clear()
+
+    for reader in readers:
+        reader.cancel()
+    for stream in streams:
+        stream.close()
+    return poll_ms, (rss_after - rss_before) / connections, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--connections', type=int, default=1000, help="Idle event streams")
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--port', type=int, default=8766)
+    args = parser.parse_args()
+
+    item, tokens, orders = seed(args.users)
+    server = start_server(args.port)
+    try:
+        poll_ms, rss_per_connection, latencies = asyncio.run(
+            run(args.port, server.pid, args.connections, args.users, args.rounds, item, tokens, orders))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"streams: {args.connections} of {args.users} users, worker RSS per idle stream: "
+          f"{rss_per_connection:.1f} KiB")
+    print(f"poll of /me/orders/ ({ORDERS_PER_USER} orders): {poll_ms:.1f} ms")
+    print(f"{'event':6} {'streams':>8} {'p50 ms':>8} {'max ms':>8}")
+    for name, streams in (('order', args.connections // args.users), ('stock', args.connections)):
+        timings = sorted(latencies[name])
+        print(f"{name:6} {streams:8} {statistics.median(timings) * 1000:8.1f} {timings[-1] * 1000:8.1f}")
+
+
+if __name__ == '__main__':
+    main()
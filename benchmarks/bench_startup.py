@@ -0,0 +1,84 @@
+"""
+Measure the cold start of a web worker: import time, startup wall time and resident memory.
+
+Each run starts a fresh interpreter with `python -X importtime` that does what a
+uvicorn worker does before serving its first request: set up Django, build the ASGI
+handler with its middleware and load the URL configuration. Reported are the median
+wall time, the import time of the slowest top-level modules, which heavy optional
+dependencies were imported and the resident memory (VmRSS) after startup.
+
+Usage: python benchmarks/bench_startup.py [--runs 5] [--top 15] [--json results.json]
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+# Only needed by single admin features, management commands or the API docs. chardet, yaml and
+# requests are not listed, rest_framework.compat imports them in every worker.
+HEAVY_MODULES = ('pandas', 'numpy', 'drf_yasg.views', 'drf_yasg.generators', 'PIL.Image')
+
+WORKER_STARTUP = """
+import json, os, sys, time
+start = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'B2B_Backend.settings')
+from django.core.asgi import get_asgi_application
+application = get_asgi_application()
+from django.urls import get_resolver
+get_resolver().url_patterns
+elapsed = time.perf_counter() - start
+rss = next(int(line.split()[1]) for line in open('/proc/self/status') if line.startswith('VmRSS:'))
+print(json.dumps({'seconds': elapsed, 'rss_kib': rss, 'heavy': [name for name in HEAVY if name in sys.modules]}))
+"""
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def run_worker():
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"HEAVY = {HEAVY_MODULES!r}\n{WORKER_STARTUP}"],
+        cwd=BASE_DIR, capture_output=True, text=True, env=dict(os.environ, DJANGO_LOG_LEVEL='WARNING'), check=True,
+    )
+    imports = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match and not match[3]:  # top-level imports carry the cumulative time of their dependencies
+            imports[match[4]] = int(match[2])
+    return json.loads(result.stdout.strip().splitlines()[-1]), imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help="Number of top-level imports to list")
+    parser.add_argument('--json', help="Write the results to this file")
+    args = parser.parse_args()
+
+    runs = [run_worker() for _ in range(args.runs)]
+    seconds = statistics.median(stats['seconds'] for stats, _ in runs)
+    rss = statistics.median(stats['rss_kib'] for stats, _ in runs)
+    imports = {name: statistics.median(run[name] for _, run in runs if name in run) for name in runs[0][1]}
+    heavy = runs[0][0]['heavy']
+
+    print(f"startup: {seconds * 1000:.0f} ms (median of {args.runs}), RSS: {rss / 1024:.1f} MiB, "
+          f"imports: {sum(imports.values()) / 1000:.0f} ms")
+    print(f"heavy modules loaded: {', '.join(heavy) or '-'}")
+    print(f"{'module':40} {'cumulative ms':>14}")
+    for name, microseconds in sorted(imports.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{name:40} {microseconds / 1000:14.1f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump({'startup_ms': round(seconds * 1000, 1), 'rss_mib': round(rss / 1024, 1),
+                       'heavy_modules': heavy, 'imports_ms': {name: value / 1000 for name, value in imports.items()}},
+                      file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+"""
+Replay a realistic endpoint mix against a local server and record per-route results.
+
+Every connection is a virtual user of the dataset created by
+`manage.py generate_synthetic_data` that loops over weighted steps: browsing a category,
+filtering by name and price, opening an item, setting cart items, checking out and
+reading its order history. Requests, errors, throughput and latency percentiles are
+reported per step and written as JSON together with the commit and the parameters of
+the run, so runs of different commits can be compared with --baseline.
+
+The script reads users, items and categories from the database of the current
+settings, so run it with the same DJANGO_* environment as the server.
+
+Usage:
+    python manage.py generate_synthetic_data
+    python benchmarks/loadgen.py --workers 2 --output results.json
+    python benchmarks/loadgen.py --url http://127.0.0.1:8000 --baseline results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'B2B_Backend.settings')
+os.environ.setdefault('DJANGO_DEBUG', 'False')
+os.environ.setdefault('DJANGO_LOG_LEVEL', 'WARNING')
+# Load comes from a few clients on one IP address, which the throttles would turn away
+os.environ.setdefault('DJANGO_THROTTLING', 'False')
+
+import django  # noqa: E402
+
+django.setup()
+
+from rest_framework_simplejwt.tokens import AccessToken  # noqa: E402
+
+from utils.synthetic_data import EMAIL_TEMPLATE  # noqa: E402
+from Webshop.models import CustomUser, Item, ItemCategory, Order  # noqa: E402
+
+API = '/web/api'
+# Step name -> (weight, DRF route name)
+STEPS = {
+    'browse': (30, 'items-list'),
+    'filter': (15, 'items-list'),
+    'item': (20, 'items-detail'),
+    'cart_set': (15, 'my-shoppingcart-set'),
+    'cart': (8, 'my-shoppingcart-list'),
+    'checkout': (4, 'my-orders-list'),
+    'order_history': (8, 'my-orders-list'),
+}
+SEARCH_TERMS = ('Laptop', 'Monitor', 'Drucker', 'Router', 'Server', 'Headset', 'Tablet', 'Maus')
+PERCENTILES = (50, 95, 99)
+
+
+class Connection:
+    """Minimal HTTP/1.1 keep-alive client, reconnects when the server closes the connection."""
+
+    def __init__(self, host, port, token):
+        self.host, self.port = host, port
+        self.token = token
+        self.reader = self.writer = None
+
+    async def request(self, method, path, data=None):
+        body = json.dumps(data).encode() if data is not None else b''
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nAccept: application/json\r\n"
+                f"Authorization: Bearer {self.token}\r\n")
+        if data is not None:
+            head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+        for attempt in range(2):
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                self.writer.write(head.encode() + b"\r\n" + body)
+                await self.writer.drain()
+                return await self._response()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.close()
+                if attempt:
+                    raise
+
+    async def _response(self):
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        lines = head.split(b"\r\n")
+        status = int(lines[0].split(b" ", 2)[1])
+        headers = dict(line.lower().split(b":", 1) for line in lines[1:] if b":" in line)
+        length = int(headers.get(b'content-length', 0))
+        body = await self.reader.readexactly(length) if length else b''
+        if headers.get(b'connection', b'').strip() == b'close':
+            self.close()
+        return status, body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class VirtualUser:
+    def __init__(self, connection, rng, item_ids, categories):
+        self.connection = connection
+        self.rng = rng
+        self.item_ids = item_ids
+        self.categories = categories
+
+    def step(self, name):
+        rng = self.rng
+        if name == 'browse':
+            query = {'item_details__categories__category_name': rng.choice(self.categories)}
+            return 'GET', f"{API}/items/?{urlencode(query)}", None
+        if name == 'filter':
+            query = {'item_details__item_name__icontains': rng.choice(SEARCH_TERMS),
+                     'item_price__lte': rng.choice((50, 100, 250, 500))}
+            return 'GET', f"{API}/items/?{urlencode(query)}", None
+        if name == 'item':
+            return 'GET', f"{API}/items/{rng.choice(self.item_ids)}/", None
+        if name == 'cart_set':
+            cart_item = {'item': rng.choice(self.item_ids), 'quantity': rng.randint(1, 5)}
+            return 'POST', f"{API}/me/shopping-cart/set/", cart_item
+        if name == 'cart':
+            return 'GET', f"{API}/me/shopping-cart/", None
+        if name == 'checkout':
+            order = {
+                'order_info': {'buyer_name': 'Lasttest', 'buyer_email': 'lasttest@example.com', 'buyer_phone': '0',
+                               'buyer_address': 'Teststraße 1'},
+                'items': [{'item_id': item_id, 'quantity': rng.randint(1, 3)}
+                          for item_id in rng.sample(self.item_ids, rng.randint(1, 4))],
+            }
+            return 'POST', f"{API}/me/orders/", order
+        return 'GET', f"{API}/me/orders/", None
+
+    async def run(self, deadline, results):
+        names = list(STEPS)
+        weights = [weight for weight, _ in STEPS.values()]
+        while time.perf_counter() < deadline:
+            name = self.rng.choices(names, weights)[0]
+            method, path, data = self.step(name)
+            start = time.perf_counter()
+            try:
+                status, _ = await self.connection.request(method, path, data)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                status = 0
+            results[name]['latencies'].append(time.perf_counter() - start)
+            if not 200 <= status < 300:
+                results[name]['errors'] += 1
+
+
+def percentile(values, percent):
+    return values[min(len(values) - 1, int(len(values) * percent / 100))] if values else 0
+
+
+def summarize(latencies, errors, duration):
+    latencies = sorted(latencies)
+    summary = {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / duration, 2),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0,
+    }
+    for percent in PERCENTILES:
+        summary[f"p{percent}_ms"] = round(percentile(latencies, percent) * 1000, 2)
+    return summary
+
+
+def load_dataset(users, seed):
+    rng = random.Random(seed)
+    accounts = list(CustomUser.objects.filter(email__in=[EMAIL_TEMPLATE.format(index=i) for i in range(users)]))
+    if not accounts:
+        raise SystemExit("No synthetic users found, run `manage.py generate_synthetic_data` first.")
+    item_ids = list(Item.objects.values_list('pk', flat=True))
+    categories = list(ItemCategory.objects.values_list('category_name', flat=True))
+    # One account per virtual user while the dataset has enough of them
+    tokens = [str(AccessToken.for_user(accounts[i] if i < len(accounts) else rng.choice(accounts)))
+              for i in range(users)]
+    dataset = {
+        'users': CustomUser.objects.count(),
+        'items': len(item_ids),
+        'categories': len(categories),
+        'orders': Order.objects.count(),
+    }
+    return tokens, item_ids, categories, dataset
+
+
+async def run_load(url, tokens, item_ids, categories, duration, seed):
+    parts = urlsplit(url)
+    results = {name: {'latencies': [], 'errors': 0} for name in STEPS}
+    users = [
+        VirtualUser(Connection(parts.hostname, parts.port or 80, token), random.Random(seed + i), item_ids, categories)
+        for i, token in enumerate(tokens)
+    ]
+    deadline = time.perf_counter() + duration
+    try:
+        await asyncio.gather(*(user.run(deadline, results) for user in users))
+    finally:
+        for user in users:
+            user.connection.close()
+    return results
+
+
+def start_server(port, workers):
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'B2B_Backend.asgi:application', '--port', str(port),
+         '--workers', str(workers), '--log-level', 'warning', '--no-access-log'],
+        cwd=BASE_DIR,
+    )
+    for _ in range(100):
+        try:
+            asyncio.run(asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), 1))
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("uvicorn did not start")
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(report, baseline=None):
+    columns = ('requests', 'errors', 'rps', 'p50_ms', 'p95_ms', 'p99_ms')
+    print(f"{'step':14} {'route':28} " + ' '.join(f"{column:>9}" for column in columns), file=sys.stderr)
+    rows = [(name, result['route'], result) for name, result in report['steps'].items()]
+    rows.append(('total', '', report['total']))
+    for name, route, result in rows:
+        print(f"{name:14} {route:28} " + ' '.join(f"{result[column]:9}" for column in columns), file=sys.stderr)
+        previous = (baseline['steps'].get(name) if name != 'total' else baseline['total']) if baseline else None
+        if previous:
+            deltas = ' '.join(
+                f"{(result[column] / previous[column] - 1) * 100:+8.1f}%" if previous[column] else f"{'-':>9}"
+                for column in columns
+            )
+            print(f"{'':14} {'vs ' + str(baseline['meta']['commit']):28} {deltas}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8765', help="Server to load")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="Start uvicorn with this many workers on the port of --url, 0 uses a running server")
+    parser.add_argument('--users', type=int, default=32, help="Concurrent virtual users (connections)")
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=3, help="Seconds of load before measuring")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="JSON result file, stdout if omitted")
+    parser.add_argument('--baseline', help="JSON result of an earlier run to compare with")
+    args = parser.parse_args()
+
+    tokens, item_ids, categories, dataset = load_dataset(args.users, args.seed)
+    server = start_server(urlsplit(args.url).port, args.workers) if args.workers else None
+    try:
+        if args.warmup:
+            asyncio.run(run_load(args.url, tokens, item_ids, categories, args.warmup, args.seed))
+        results = asyncio.run(run_load(args.url, tokens, item_ids, categories, args.duration, args.seed))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'args': vars(args),
+            'dataset': dataset,
+        },
+        'total': summarize([latency for result in results.values() for latency in result['latencies']],
+                           sum(result['errors'] for result in results.values()), args.duration),
+        'steps': {
+            name: {'route': STEPS[name][1], **summarize(result['latencies'], result['errors'], args.duration)}
+            for name, result in results.items()
+        },
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+    print_table(report, baseline)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
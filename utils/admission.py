@@ -0,0 +1,159 @@
+"""
+Admission control for the ASGI application of a worker process.
+
+At most ADMISSION_MAX_CONCURRENCY requests run in a worker at the same time, further
+requests wait in a queue of at most ADMISSION_QUEUE_SIZE requests. Waiting requests are
+admitted by priority class, in arrival order within a class, and each class has a
+deadline for the time in the queue. Requests that cannot be served in time are
+answered right away with 503 and Retry-After instead of piling up until they all
+time out: when the deadline of their class passes, when the queue is full, or when
+they are pushed out of a full queue by a request of a higher class.
+
+Classes, highest first: checkout and auth/, everything else, the catalog, the API
+docs. The metrics endpoint and the event stream, which stays open for hours, are not
+limited.
+"""
+import asyncio
+import json
+import time
+from collections import deque
+
+from django.conf import settings
+
+from utils.metrics import ADMISSION_QUEUE, ADMISSION_SHED, ADMISSION_WAIT
+
+PRIORITY_CLASSES = ('critical', 'default', 'catalog', 'docs')
+# (method or None for all, path below API_PATH_PREFIX, class), the first matching prefix wins
+ADMISSION_ROUTES = (
+    ('POST', 'me/orders/', 'critical'),
+    ('POST', 'group/shoppinglist/convert-to-orders/', 'critical'),
+    (None, 'auth/', 'critical'),
+    (None, 'items/', 'catalog'),
+    (None, 'swagger', 'docs'),
+    (None, 'redoc/', 'docs'),
+)
+UNLIMITED_PATHS = ('/web/metrics', '/web/api/me/events/')
+SHED_MESSAGE = "Der Server ist ausgelastet, bitte später erneut versuchen."
+
+
+def priority_class(method, path):
+    """The priority class of a request, None for requests that are not limited."""
+    if path in UNLIMITED_PATHS:
+        return None
+    if path.startswith(settings.API_PATH_PREFIX):
+        route = path[len(settings.API_PATH_PREFIX):]
+        for route_method, prefix, name in ADMISSION_ROUTES:
+            if route.startswith(prefix) and route_method in (None, method):
+                return name
+    return 'default'
+
+
+class AdmissionController:
+    """Slots and priority queues of one event loop. Not thread-safe, all calls happen in the loop."""
+
+    def __init__(self, max_concurrency, queue_size):
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.active = 0
+        self.queues = {name: deque() for name in PRIORITY_CLASSES}
+
+    @property
+    def waiting(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    async def acquire(self, name, timeout):
+        """
+        Wait for a slot. Returns None once admitted, or the reason the request was shed:
+        'queue_full', 'evicted' or 'deadline'. An admitted request must call release().
+        """
+        waiting = self.waiting
+        ADMISSION_QUEUE.observe(waiting)
+        if self.active < self.max_concurrency and not waiting:
+            self.active += 1
+            ADMISSION_WAIT.observe(0, priority=name)
+            return None
+        if waiting >= self.queue_size and not self._evict_below(name):
+            return 'queue_full'
+
+        start = time.perf_counter()
+        queue = self.queues[name]
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        try:
+            admitted = await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if not waiter.done():
+                queue.remove(waiter)
+                waiter.cancel()
+            elif waiter.result():
+                # Admitted just as the wait ended, the slot goes to the next request
+                self.release()
+            if isinstance(exc, asyncio.TimeoutError):
+                return 'deadline'
+            raise
+        if not admitted:
+            return 'evicted'
+        ADMISSION_WAIT.observe(time.perf_counter() - start, priority=name)
+        return None
+
+    def release(self):
+        """Hand the slot of a finished request to the next waiting request of the highest class."""
+        for queue in self.queues.values():
+            if queue:
+                queue.popleft().set_result(True)
+                return
+        self.active -= 1
+
+    def _evict_below(self, name):
+        """Shed the latest waiting request of the lowest class below `name` to make room."""
+        for lower in reversed(PRIORITY_CLASSES[PRIORITY_CLASSES.index(name) + 1:]):
+            if self.queues[lower]:
+                self.queues[lower].pop().set_result(False)
+                return True
+        return False
+
+
+def shed_response(retry_after):
+    body = json.dumps({'detail': SHED_MESSAGE}).encode()
+    return {
+        'type': 'http.response.start',
+        'status': 503,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+            (b'retry-after', str(retry_after).encode()),
+        ],
+    }, {'type': 'http.response.body', 'body': body}
+
+
+class AdmissionControlMiddleware:
+    """ASGI middleware that admits HTTP requests through the AdmissionController of the running loop."""
+
+    def __init__(self, app):
+        self.app = app
+        self.controller = None
+        self.loop = None
+
+    def get_controller(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.controller = AdmissionController(settings.ADMISSION_MAX_CONCURRENCY, settings.ADMISSION_QUEUE_SIZE)
+            self.loop = loop
+        return self.controller
+
+    async def __call__(self, scope, receive, send):
+        name = priority_class(scope['method'], scope['path']) if scope['type'] == 'http' else None
+        if name is None:
+            return await self.app(scope, receive, send)
+
+        controller = self.get_controller()
+        reason = await controller.acquire(name, settings.ADMISSION_QUEUE_TIMEOUTS[name])
+        if reason is not None:
+            ADMISSION_SHED.inc(priority=name, reason=reason)
+            for message in shed_response(settings.ADMISSION_RETRY_AFTER):
+                await send(message)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release()
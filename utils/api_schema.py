@@ -0,0 +1,113 @@
+"""
+Precomputed OpenAPI schema.
+
+Generating the schema introspects every viewset and serializer, so it is done once
+per code version: `manage.py generate_api_schema` writes versioned artifacts at build
+time, and a worker that finds no artifact for its version generates and stores it on
+first use. The version is a hash of the application code and of the packages that
+shape the schema; it also serves as ETag.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from functools import lru_cache
+from importlib.metadata import version as package_version
+from pathlib import Path
+
+from django.conf import settings
+
+SCHEMA_FORMATS = {
+    '.json': 'application/json',
+    '.yaml': 'application/yaml; charset=utf-8',
+}
+# Application code and packages the generated schema depends on
+SCHEMA_SOURCE_DIRS = ('B2B_Backend', 'Webshop', 'utils')
+SCHEMA_PACKAGES = ('Django', 'djangorestframework', 'drf-yasg', 'djangorestframework-simplejwt', 'django-filter')
+
+_schemas = {}
+_lock = threading.Lock()
+
+
+def api_info():
+    from drf_yasg import openapi
+
+    return openapi.Info(
+        title="B2B API",
+        default_version='v1',
+        description="API documentation for B2B Webshop",
+        terms_of_service="https://www.google.com/policies/terms/",
+        contact=openapi.Contact(email="hothardwarehub@gmail.com"),
+        license=openapi.License(name="BSD License"),
+    )
+
+
+@lru_cache(maxsize=None)
+def schema_version():
+    """Hash of the Python sources in SCHEMA_SOURCE_DIRS and the versions of SCHEMA_PACKAGES."""
+    digest = hashlib.sha256()
+    for directory in SCHEMA_SOURCE_DIRS:
+        for path in sorted((Path(settings.BASE_DIR) / directory).rglob('*.py')):
+            digest.update(str(path.relative_to(settings.BASE_DIR)).encode())
+            digest.update(path.read_bytes())
+    for package in SCHEMA_PACKAGES:
+        digest.update(f"{package}=={package_version(package)}".encode())
+    return digest.hexdigest()[:16]
+
+
+def schema_path(schema_format, version=None):
+    return Path(settings.API_SCHEMA_DIR) / f"openapi-{version or schema_version()}{schema_format}"
+
+
+def generate_schema():
+    """
+    Generate the public schema in all SCHEMA_FORMATS. It is generated without a request,
+    so it has no host and clients use the host that served it.
+    """
+    from drf_yasg.app_settings import swagger_settings
+    from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+
+    generator = swagger_settings.DEFAULT_GENERATOR_CLASS(info=api_info())
+    schema = generator.get_schema(request=None, public=True)
+    return {
+        '.json': OpenAPICodecJson(validators=[]).encode(schema),
+        '.yaml': OpenAPICodecYaml(validators=[]).encode(schema),
+    }
+
+
+def write_schema(schemas):
+    """Store the artifacts of the current version and remove those of other versions."""
+    directory = Path(settings.API_SCHEMA_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    for schema_format, content in schemas.items():
+        with tempfile.NamedTemporaryFile('wb', dir=directory, suffix='.tmp', delete=False) as file:
+            file.write(content)
+        os.replace(file.name, schema_path(schema_format))
+    current = {schema_path(schema_format).name for schema_format in SCHEMA_FORMATS}
+    for path in directory.glob('openapi-*'):
+        if path.name not in current:
+            path.unlink(missing_ok=True)
+
+
+def get_schema(schema_format):
+    """The schema of the current version from memory, the artifact, or generated once."""
+    content = _schemas.get(schema_format)
+    if content is not None:
+        return content
+    with _lock:
+        if not _schemas:
+            try:
+                _schemas.update({schema_format: schema_path(schema_format).read_bytes()
+                                 for schema_format in SCHEMA_FORMATS})
+            except FileNotFoundError:
+                schemas = generate_schema()
+                try:
+                    write_schema(schemas)
+                except OSError:
+                    pass  # Served from memory, regenerated by the next worker
+                _schemas.update(schemas)
+    return _schemas[schema_format]
+
+
+def schema_etag(schema_format):
+    return f"{schema_version()}{schema_format}"
@@ -0,0 +1,75 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+
+PRIMARY_PIN_CACHE_KEY = 'db-primary-pin:{user_id}'
+
+# Set while a request may read from the replicas, propagates into sync_to_async threads
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+class ReadReplicaRouter:
+    """
+    Send reads to a random replica from DATABASE_REPLICAS while replica reads are
+    enabled for the current request, and everything else to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if settings.DATABASE_REPLICAS and _replica_reads.get():
+            return random.choice(settings.DATABASE_REPLICAS)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def pin_to_primary(user_id):
+    """Keep the reads of a user on the primary after a write to cover replication lag."""
+    cache.set(PRIMARY_PIN_CACHE_KEY.format(user_id=user_id), True, timeout=settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+def is_pinned_to_primary(user):
+    return user.is_authenticated and cache.get(PRIMARY_PIN_CACHE_KEY.format(user_id=user.pk), False)
+
+
+def can_read_from_replica(request, user):
+    return bool(settings.DATABASE_REPLICAS) and request.method in SAFE_METHODS and not is_pinned_to_primary(user)
+
+
+class ReplicaReadMixin:
+    """
+    Viewset mixin that serves safe requests from the read replicas. Authentication
+    still reads from the primary; users who wrote recently stay on the primary.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if can_read_from_replica(request, request.user):
+            self._replica_reads_token = _replica_reads.set(True)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_replica_reads_token', None)
+        if token is not None:
+            _replica_reads.reset(token)
+            self._replica_reads_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -0,0 +1,206 @@
+"""
+Publish/subscribe of change events for the server-sent event stream.
+
+LocalBroker delivers events to subscribers in all worker processes of this host. Every
+process with subscribers binds a Unix datagram socket in EVENTS_DIR, publishers send
+their events to all sockets there and deliver to their own subscribers directly.
+Delivery is best effort: events for full socket buffers or slow consumers are dropped
+and the stream tells the client to reload. A broker shared by several hosts, e.g. on
+Redis pub/sub, only needs the publish_many/subscribe interface and is configured
+with EVENT_BROKER.
+"""
+import asyncio
+import atexit
+import json
+import os
+import socket
+import threading
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+# Datagrams stay below the default socket buffer size, larger batches are split
+MAX_DATAGRAM_SIZE = 32768
+
+
+def user_topic(user_id):
+    return f'user:{user_id}'
+
+
+def item_topic(item_id):
+    return f'item:{item_id}'
+
+
+def order_status_event(order):
+    return user_topic(order.user_id), {'type': 'order_status', 'order_id': order.pk, 'order_status': order.order_status}
+
+
+def item_stock_event(item_id, item_stock):
+    return item_topic(item_id), {'type': 'item_stock', 'item_id': item_id, 'item_stock': item_stock}
+
+
+class Subscription:
+    """The events of a set of topics for one consumer in an event loop, read with get()."""
+
+    def __init__(self, broker, topics, maxsize):
+        self.broker = broker
+        self.topics = frozenset(topics)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+        # Set when events were dropped because the consumer did not keep up
+        self.overflowed = False
+
+    def deliver(self, topic, data):
+        """Queue an event, only called in the loop of the subscription."""
+        try:
+            self.queue.put_nowait((topic, data))
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self):
+        """The next (topic, data) event."""
+        return await self.queue.get()
+
+    def update(self, topics):
+        self.broker.resubscribe(self, topics)
+
+    def close(self):
+        self.broker.resubscribe(self, ())
+
+
+class LocalBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+        self._pid = None
+        self._receiver = None
+        self._receiver_loop = None
+        self._sender = None
+        self._sender_pid = None
+
+    @property
+    def path(self):
+        return Path(settings.EVENTS_DIR) / f"{os.getpid()}.sock"
+
+    def publish(self, topic, data):
+        self.publish_many([(topic, data)])
+
+    def publish_many(self, events):
+        """Deliver (topic, data) events to the subscribers of all processes, from any thread."""
+        events = list(events)
+        if not events:
+            return
+        self._dispatch(events)
+        own = self.path
+        payloads = list(_datagrams(events))
+        for path in Path(settings.EVENTS_DIR).glob('*.sock'):
+            if path != own:
+                self._send(path, payloads)
+
+    def subscribe(self, topics, maxsize=None):
+        """Subscribe to `topics` in the running event loop."""
+        subscription = Subscription(self, topics, maxsize or settings.SSE_QUEUE_SIZE)
+        self._listen(subscription.loop)
+        self.resubscribe(subscription, topics)
+        return subscription
+
+    def resubscribe(self, subscription, topics):
+        with self._lock:
+            for topic in subscription.topics:
+                self._subscriptions[topic].discard(subscription)
+                if not self._subscriptions[topic]:
+                    del self._subscriptions[topic]
+            subscription.topics = frozenset(topics)
+            for topic in subscription.topics:
+                self._subscriptions[topic].add(subscription)
+
+    def _dispatch(self, events):
+        with self._lock:
+            deliveries = [(subscription, topic, data)
+                          for topic, data in events for subscription in self._subscriptions.get(topic, ())]
+        for subscription, topic, data in deliveries:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, topic, data)
+            except RuntimeError:  # the loop is closed
+                pass
+
+    def _send(self, path, payloads):
+        if self._sender_pid != os.getpid():
+            self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sender.setblocking(False)
+            self._sender_pid = os.getpid()
+        for payload in payloads:
+            try:
+                self._sender.sendto(payload, str(path))
+            except (ConnectionRefusedError, FileNotFoundError):
+                # The process of the socket has exited
+                path.unlink(missing_ok=True)
+                return
+            except BlockingIOError:
+                # The receiver's buffer is full, its subscribers miss these events
+                return
+
+    def _listen(self, loop):
+        """Bind the socket of this process and read it in `loop`, once per process and loop."""
+        with self._lock:
+            if self._pid == os.getpid() and self._receiver_loop is loop:
+                return
+            if self._receiver is not None:
+                if self._pid == os.getpid() and not self._receiver_loop.is_closed():
+                    self._receiver_loop.remove_reader(self._receiver.fileno())
+                self._receiver.close()
+            path = self.path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.unlink(missing_ok=True)
+            self._receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._receiver.setblocking(False)
+            self._receiver.bind(str(path))
+            self._receiver_loop = loop
+            if self._pid != os.getpid():
+                atexit.register(path.unlink, missing_ok=True)
+            self._pid = os.getpid()
+        loop.add_reader(self._receiver.fileno(), self._receive)
+
+    def _receive(self):
+        while True:
+            try:
+                payload = self._receiver.recv(MAX_DATAGRAM_SIZE)
+            except (BlockingIOError, OSError):
+                return
+            try:
+                self._dispatch(json.loads(payload))
+            except ValueError:
+                continue
+
+
+def _datagrams(events):
+    batch, size = [], 2
+    for event in events:
+        encoded = json.dumps(event, separators=(',', ':'))
+        if batch and size + len(encoded) + 1 > MAX_DATAGRAM_SIZE:
+            yield f"[{','.join(batch)}]".encode()
+            batch, size = [], 2
+        batch.append(encoded)
+        size += len(encoded) + 1
+    if batch:
+        yield f"[{','.join(batch)}]".encode()
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(settings.EVENT_BROKER)()
+    return _broker
+
+
+def publish_on_commit(events):
+    """Publish (topic, data) events once the current transaction commits."""
+    events = list(events)
+    if events:
+        transaction.on_commit(lambda: get_broker().publish_many(events))
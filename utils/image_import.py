@@ -0,0 +1,189 @@
+import hashlib
+import multiprocessing
+import os
+import posixpath
+import re
+import tempfile
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import File
+from django.db import transaction
+from django.template.defaultfilters import filesizeformat
+
+from utils.image_processing import MAX_IMAGE_EDGE, process_image
+from utils.storage import ContentAddressedStorage
+from Webshop.models import Item, ItemImage, UPLOAD_PATH_ITEM_IMAGES
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.tiff'}
+IMAGE_IMPORT_WORKERS = min(4, os.cpu_count() or 1)
+# Images read from the archive but not yet processed, per worker
+PENDING_IMAGES_PER_WORKER = 2
+ARTICLE_ID_LOOKUP_SIZE = 1000
+# "P001.jpg", "P001_2.jpg" and "P001-2.jpg" all belong to article P001
+IMAGE_NAME_PATTERN = re.compile(r'^(?P<article_id>.+?)(?:[_-](?P<index>\d+))?$')
+
+
+def check_archive_limits(archive):
+    """
+    Reject archives with more than IMAGE_IMPORT_MAX_FILES members or more than
+    IMAGE_IMPORT_MAX_SIZE uncompressed bytes, from the central directory alone.
+    Members cannot be extracted beyond their declared size, so this also stops zip bombs.
+    """
+    members = archive.infolist()
+    if len(members) > settings.IMAGE_IMPORT_MAX_FILES:
+        raise ValidationError(f"Das Archiv enthält {len(members)} Dateien, erlaubt sind höchstens "
+                              f"{settings.IMAGE_IMPORT_MAX_FILES}.")
+    size = sum(info.file_size for info in members)
+    if size > settings.IMAGE_IMPORT_MAX_SIZE:
+        raise ValidationError(f"Das Archiv ist entpackt {filesizeformat(size)} groß, erlaubt sind höchstens "
+                              f"{filesizeformat(settings.IMAGE_IMPORT_MAX_SIZE)}.")
+
+
+def import_images_from_zip(file, max_edge=MAX_IMAGE_EDGE, workers=IMAGE_IMPORT_WORKERS, on_progress=None):
+    """
+    Attach the images of a ZIP archive to the items named by their file names.
+    Members are extracted one at a time and deduplicated by content hash, so an image
+    used for many variants is processed once. Validation and resizing run
+    in a process pool with a bounded number of pending images, or with `workers=0` in
+    one thread of this process; the results are staged in a temporary directory and
+    moved into the storage after the ItemImage rows are created with one bulk insert.
+    Images an item already has are skipped. `on_progress` is called with the number
+    of handled files. Returns counters and the names of unmatched and invalid files.
+    """
+    stats = {'files': 0, 'duplicates': 0, 'created': 0, 'existing': 0, 'unmatched': [], 'invalid': []}
+
+    with zipfile.ZipFile(file) as archive, tempfile.TemporaryDirectory(prefix='image-import-') as staging:
+        check_archive_limits(archive)
+        members = [info for info in archive.infolist() if _is_image(info)]
+        stats['files'] = len(members)
+        matches = _match_article_ids(info.filename for info in members)
+
+        targets = {}    # source hash -> [(article_id, index, item_details_id)]
+        processed = {}  # source hash -> (storage name, content hash)
+        if workers:
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        else:
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='image-import')
+        max_pending = max(workers, 1) * PENDING_IMAGES_PER_WORKER
+        with executor as pool:
+            pending = {}
+            for handled, info in enumerate(members, 1):
+                match = matches.get(info.filename)
+                if match is None:
+                    stats['unmatched'].append(info.filename)
+                    continue
+
+                data = archive.read(info)
+                digest = hashlib.sha256(data).hexdigest()
+                if digest in targets:
+                    stats['duplicates'] += 1
+                else:
+                    targets[digest] = []
+                    pending[pool.submit(process_image, data, max_edge)] = (digest, info.filename)
+                targets[digest].append(match)
+                del data
+
+                if len(pending) >= max_pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    _stage_results(done, pending, processed, stats, staging)
+                    if on_progress is not None:
+                        on_progress(handled)
+            _stage_results(list(pending), pending, processed, stats, staging)
+
+        stats['created'], stats['existing'] = _create_item_images(targets, processed)
+        _store_files(processed, staging)
+    return stats
+
+
+def _is_image(info):
+    name = posixpath.basename(info.filename)
+    return (not info.is_dir() and not name.startswith('.') and not info.filename.startswith('__MACOSX/')
+            and posixpath.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+
+
+def _match_article_ids(filenames):
+    """
+    Map file names to (article_id, index, item_details_id). The whole file name is
+    tried as article_id first, so article ids containing '_' or '-' are matched as well.
+    """
+    candidates = {}
+    for filename in filenames:
+        stem = posixpath.splitext(posixpath.basename(filename))[0].strip()
+        match = IMAGE_NAME_PATTERN.match(stem)
+        candidates[filename] = [(stem, 0), (match['article_id'], int(match['index'] or 0))]
+
+    article_ids = list({article_id for options in candidates.values() for article_id, _ in options})
+    details_ids = {}
+    for start in range(0, len(article_ids), ARTICLE_ID_LOOKUP_SIZE):
+        details_ids.update(Item.objects.filter(article_id__in=article_ids[start:start + ARTICLE_ID_LOOKUP_SIZE])
+                           .values_list('article_id', 'item_details_id'))
+
+    matches = {}
+    for filename, options in candidates.items():
+        for article_id, index in options:
+            if article_id in details_ids:
+                matches[filename] = (article_id, index, details_ids[article_id])
+                break
+    return matches
+
+
+def _stage_results(done, pending, processed, stats, staging):
+    """Write the processed images of finished futures to the staging directory."""
+    for future in done:
+        digest, filename = pending.pop(future)
+        try:
+            content, extension = future.result()
+        except ValueError as e:
+            stats['invalid'].append(f"{filename}: {e}")
+            continue
+        # The content-addressed storage keeps a single file per distinct image, named
+        # with the extension of the format process_image encoded it in
+        content_hash = hashlib.sha256(content).hexdigest()
+        name = ContentAddressedStorage.addressed_name(UPLOAD_PATH_ITEM_IMAGES, content_hash, f'.{extension}')
+        with open(os.path.join(staging, digest), 'wb') as staged:
+            staged.write(content)
+        processed[digest] = (name, content_hash)
+
+
+def _store_files(processed, staging):
+    """
+    Move the staged images into the storage once their rows are committed, so a
+    concurrent release of the same file sees the rows or the freshly saved file.
+    Files of already existing rows are saved as well, which restores missing ones.
+    """
+    storage = ItemImage._meta.get_field('image').storage
+    for digest, (name, _) in processed.items():
+        with open(os.path.join(staging, digest), 'rb') as staged:
+            storage.save(name, File(staged))
+
+
+def _create_item_images(targets, processed):
+    """
+    Create one ItemImage per item details and distinct image, ordered by article_id
+    and suffix index. Returns the number of created and of already existing images.
+    """
+    rows = {}
+    for digest, matches in targets.items():
+        if digest not in processed:
+            continue
+        name, content_hash = processed[digest]
+        for article_id, index, item_details_id in matches:
+            rows.setdefault((item_details_id, content_hash), (article_id, index, name))
+
+    existing = set()
+    content_hashes = list({content_hash for _, content_hash in rows})
+    for start in range(0, len(content_hashes), ARTICLE_ID_LOOKUP_SIZE):
+        existing.update(ItemImage.objects.filter(content_hash__in=content_hashes[start:start + ARTICLE_ID_LOOKUP_SIZE])
+                        .values_list('item_details_id', 'content_hash'))
+
+    images = [
+        ItemImage(item_details_id=item_details_id, image=name, content_hash=content_hash)
+        for (item_details_id, content_hash), (_, _, name) in sorted(rows.items(), key=lambda row: row[1][:2])
+        if (item_details_id, content_hash) not in existing
+    ]
+    with transaction.atomic():
+        ItemImage.objects.bulk_create(images, batch_size=500)
+    return len(images), len(rows) - len(images)
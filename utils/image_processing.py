@@ -0,0 +1,35 @@
+"""
+Image processing for the bulk image import. This module only depends on Pillow,
+so that it can be imported cheaply by the worker processes of the import.
+"""
+import io
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+MAX_IMAGE_EDGE = 1600
+JPEG_QUALITY = 85
+
+
+def process_image(data, max_edge=MAX_IMAGE_EDGE):
+    """
+    Validate an image and scale it down to at most `max_edge` pixels on its longer side.
+    Images with transparency are stored as PNG, all others as JPEG.
+    Returns a tuple (content, extension) or raises ValueError for invalid images.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.verify()
+        with Image.open(io.BytesIO(data)) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+            output = io.BytesIO()
+            if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+                image.save(output, format='PNG', optimize=True)
+                return output.getvalue(), 'png'
+            image.convert('RGB').save(output, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+            return output.getvalue(), 'jpg'
+    except UnidentifiedImageError as e:
+        raise ValueError("Unbekanntes Bildformat.") from e
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Ungültige Bilddatei: {e}") from e
@@ -0,0 +1,197 @@
+import logging
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import pandas as pd
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, connections, models, transaction
+from django.utils import timezone
+
+from utils.product_upload import MAX_STORED_ERRORS, STREAM_CHUNK_SIZE, detect_encoding, file_fingerprint, \
+    preview_product_upload, stream_product_upload
+from Webshop.models import ImportJob, ImportJobKind, ImportJobStatus
+
+logger = logging.getLogger(__name__)
+
+# One import at a time per web worker, outside of the request
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='product-import')
+# Seconds between progress updates of an image import
+IMAGE_PROGRESS_INTERVAL = 1
+
+
+def enqueue_import(uploaded_file, user=None, chunk_size=STREAM_CHUNK_SIZE, replace_stock=False,
+                   kind=ImportJobKind.PRODUCTS):
+    """
+    Store an uploaded product file and create a pending ImportJob for it, which
+    imports the file or, as a PREVIEW job, only computes what an import would change.
+    With IMPORT_JOBS_IN_PROCESS the job starts in a background thread of this
+    worker, otherwise it is picked up by `manage.py process_import_jobs`.
+    """
+    if kind == ImportJobKind.PREVIEW:
+        delete_expired_previews()
+    job = ImportJob(
+        kind=kind,
+        source=uploaded_file.name,
+        fingerprint=file_fingerprint(uploaded_file),
+        encoding=detect_encoding(uploaded_file),
+        chunk_size=chunk_size,
+        replace_stock=replace_stock,
+        status=ImportJobStatus.PENDING,
+        created_by=user,
+    )
+    return _enqueue(job, uploaded_file)
+
+
+def enqueue_image_import(zip_file, user=None):
+    """
+    Check the limits of an uploaded ZIP archive of item images and create a pending
+    ImportJob for it, which runs like a product import.
+    """
+    from utils.image_import import check_archive_limits
+
+    with zipfile.ZipFile(zip_file) as archive:
+        check_archive_limits(archive)
+    zip_file.seek(0)
+    job = ImportJob(kind=ImportJobKind.IMAGES, source=zip_file.name, chunk_size=0, status=ImportJobStatus.PENDING,
+                    created_by=user)
+    return _enqueue(job, zip_file)
+
+
+def _enqueue(job, uploaded_file):
+    job.file.save(uploaded_file.name, uploaded_file, save=False)
+    job.save()
+
+    if settings.IMPORT_JOBS_IN_PROCESS:
+        transaction.on_commit(lambda: _executor.submit(_run_in_thread, job.pk))
+    return job
+
+
+def claim_job(job_id):
+    """
+    Atomically take over a pending job or a running job that made no progress for
+    IMPORT_JOB_STALE_AFTER seconds (its worker died). Returns True if claimed.
+    """
+    claimable = ImportJob.objects.filter(models.Q(status=ImportJobStatus.PENDING) | ImportJob.stale(), pk=job_id) \
+        .exclude(file='')
+    return claimable.update(status=ImportJobStatus.RUNNING, updated_at=timezone.now()) == 1
+
+
+def claimable_job_ids():
+    pending = ImportJob.objects.filter(status=ImportJobStatus.PENDING)
+    stale = ImportJob.objects.filter(ImportJob.stale()).exclude(file='')
+    return list((pending | stale).order_by('pk').values_list('pk', flat=True))
+
+
+def run_import_job(job_id, image_workers=None):
+    """
+    Run a claimed job, resuming after its last committed chunk.
+    The stored file is removed once the import completed. Images are processed by
+    `image_workers` processes, 0 processes them in a thread of this process.
+    """
+    job = ImportJob.objects.get(pk=job_id)
+    try:
+        with job.file.open('rb') as file:
+            if job.kind == ImportJobKind.PREVIEW:
+                _run_preview(job, file)
+            elif job.kind == ImportJobKind.IMAGES:
+                _run_image_import(job, file, image_workers)
+            else:
+                stream_product_upload(file, job=job)
+    except Exception as e:
+        # stream_product_upload already marked the job as failed if the import itself broke
+        logger.exception(f"Import job {job_id} failed: {e}")
+        ImportJob.objects.filter(pk=job_id).exclude(status=ImportJobStatus.FAILED).update(
+            status=ImportJobStatus.FAILED, error_message=str(e), finished_at=timezone.now()
+        )
+        return
+
+    job.file.delete(save=False)
+    ImportJob.objects.filter(pk=job_id).update(file='')
+
+
+def _run_preview(job, file):
+    """Store the summary of a preview on the job and its changes as a CSV file next to the upload."""
+    ImportJob.objects.filter(pk=job.pk).update(started_at=timezone.now())
+
+    def on_progress(rows):
+        # Per chunk, like the checkpoints of an import, so the job does not look stale to process_import_jobs
+        ImportJob.objects.filter(pk=job.pk).update(rows_processed=rows, updated_at=timezone.now())
+
+    summary, changes = preview_product_upload(file, chunk_size=job.chunk_size, replace_stock=job.replace_stock,
+                                              on_progress=on_progress)
+    summary['changes'] = len(changes)
+    job.result_file.save(f'preview-{job.pk}.csv', ContentFile(changes.to_csv(sep=';', index=False).encode()),
+                         save=False)
+    ImportJob.objects.filter(pk=job.pk).update(
+        status=ImportJobStatus.COMPLETED, result=summary, result_file=job.result_file.name,
+        rows_processed=summary['rows'], rows_invalid=summary['invalid_rows'], finished_at=timezone.now(),
+    )
+
+
+def _run_image_import(job, file, workers=None):
+    """Attach the images of the archive, the unmatched and invalid files are the job's errors."""
+    from utils.image_import import import_images_from_zip
+
+    ImportJob.objects.filter(pk=job.pk).update(started_at=timezone.now())
+    last_update = time.monotonic()
+
+    def on_progress(files):
+        # Keeps the job from looking stale to process_import_jobs
+        nonlocal last_update
+        if time.monotonic() - last_update >= IMAGE_PROGRESS_INTERVAL:
+            ImportJob.objects.filter(pk=job.pk).update(rows_processed=files, updated_at=timezone.now())
+            last_update = time.monotonic()
+
+    options = {} if workers is None else {'workers': workers}
+    stats = import_images_from_zip(file, on_progress=on_progress, **options)
+    errors = [[name, "Keine passende article_id."] for name in stats['unmatched']]
+    errors += [error.split(': ', 1) for error in stats['invalid']]
+    ImportJob.objects.filter(pk=job.pk).update(
+        status=ImportJobStatus.COMPLETED,
+        result={key: len(value) if isinstance(value, list) else value for key, value in stats.items()},
+        rows_processed=stats['files'], rows_created=stats['created'], rows_invalid=len(errors),
+        errors=errors[:MAX_STORED_ERRORS], finished_at=timezone.now(),
+    )
+
+
+class PreviewChanges:
+    """
+    The changes of a finished preview job for a Paginator, only the rows of the
+    requested page are read from the CSV file.
+    """
+
+    def __init__(self, job):
+        self.job = job
+
+    def __len__(self):
+        return self.job.result['changes']
+
+    def __getitem__(self, page):
+        with self.job.result_file.open('rb') as file:
+            return pd.read_csv(file, sep=';', dtype=str, keep_default_na=False,
+                               skiprows=range(1, page.start + 1), nrows=page.stop - page.start)
+
+
+def delete_expired_previews():
+    """Delete the preview jobs older than IMPORT_PREVIEW_RETENTION together with their files."""
+    expired = ImportJob.objects.filter(
+        kind=ImportJobKind.PREVIEW,
+        created_at__lt=timezone.now() - timedelta(seconds=settings.IMPORT_PREVIEW_RETENTION),
+    ).exclude(status__in=[ImportJobStatus.PENDING, ImportJobStatus.RUNNING])
+    for job in expired:
+        job.file.delete(save=False)
+        job.result_file.delete(save=False)
+    expired.delete()
+
+
+def _run_in_thread(job_id):
+    close_old_connections()
+    try:
+        if claim_job(job_id):
+            # No process pool inside the web worker
+            run_import_job(job_id, image_workers=0)
+    finally:
+        connections.close_all()
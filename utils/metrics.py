@@ -0,0 +1,305 @@
+"""
+Process-local metrics with a Prometheus text exposition that covers all worker processes.
+
+Every process keeps its counters and histograms in memory and a background thread
+writes them to METRICS_DIR/<pid>.json every METRICS_FLUSH_INTERVAL seconds with an
+atomic rename. The exposition merges the files of all processes, so any worker can
+answer a scrape. Files of exited processes are kept, which keeps the totals monotonic.
+"""
+import atexit
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, registry, name, documentation, labelnames):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self):
+        return [[list(key), value] for key, value in self.values.items()]
+
+    @staticmethod
+    def merge(value, other):
+        return value + other
+
+    def samples(self, values):
+        for key, value in values:
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram(Counter):
+    """Histogram with cumulative buckets. Values are stored as [bucket counts..., sum]."""
+    type = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames, buckets=DURATION_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self.registry.lock:
+            counts = self.values.setdefault(key, [0] * (len(self.buckets) + 2))
+            counts[index] += 1
+            counts[-1] += value
+
+    def snapshot(self):
+        return [[list(key), list(counts)] for key, counts in self.values.items()]
+
+    @staticmethod
+    def merge(value, other):
+        return [a + b for a, b in zip(value, other)]
+
+    def samples(self, values):
+        for key, counts in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, 'le': _format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, counts[-1]
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self._flusher_pid = None
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self):
+        with self.lock:
+            return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    @property
+    def path(self):
+        return Path(settings.METRICS_DIR) / f"{os.getpid()}.json"
+
+    def flush(self):
+        """Write the metrics of this process to its file in METRICS_DIR."""
+        directory = Path(settings.METRICS_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as file:
+            json.dump(self.snapshot(), file)
+        os.replace(file.name, self.path)
+
+    def start_flusher(self):
+        """Start the flush thread once per process, also in processes forked after the first call."""
+        if self._flusher_pid == os.getpid():
+            return
+        with self.lock:
+            if self._flusher_pid == os.getpid():
+                return
+            if self._flusher_pid is not None:
+                # Forked from a process with metrics: start from zero like a new process
+                for metric in self.metrics.values():
+                    metric.values = {}
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+        atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            self.flush()
+
+    def collect(self):
+        """Merge the metrics of all processes, the current process from memory."""
+        merged = {name: {} for name in self.metrics}
+        sources = []
+        for path in Path(settings.METRICS_DIR).glob('*.json'):
+            if path == self.path:
+                continue
+            try:
+                sources.append(json.loads(path.read_text()))
+            except (OSError, ValueError):
+                continue
+        sources.append(self.snapshot())
+
+        for source in sources:
+            for name, values in source.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                for key, value in values:
+                    key = tuple(key)
+                    merged[name][key] = metric.merge(merged[name][key], value) if key in merged[name] else value
+        return merged
+
+    def exposition(self):
+        """Render all metrics in the Prometheus text format."""
+        lines = []
+        for name, values in self.collect().items():
+            metric = self.metrics[name]
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for sample, labels, value in metric.samples(sorted(values.items())):
+                label_text = ','.join(f'{label}="{_escape(label_value)}"' for label, label_value in labels.items())
+                lines.append(f"{sample}{{{label_text}}} {_format_value(value)}" if label_text
+                             else f"{sample} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter(
+    'b2b_http_requests_total', "HTTP requests by route, method and status.", ('route', 'method', 'status'))
+REQUEST_DURATION = REGISTRY.histogram(
+    'b2b_http_request_duration_seconds', "Time to produce the response.", ('route',))
+SQL_QUERIES = REGISTRY.histogram(
+    'b2b_http_sql_queries', "SQL queries per request.", ('route',), QUERY_COUNT_BUCKETS)
+SQL_DURATION = REGISTRY.histogram(
+    'b2b_http_sql_duration_seconds', "Time spent in SQL queries per request.", ('route',))
+SERIALIZER_DURATION = REGISTRY.histogram(
+    'b2b_http_serializer_duration_seconds', "Time spent in serializers per request.", ('route',))
+RESPONSE_SIZE = REGISTRY.histogram(
+    'b2b_http_response_size_bytes', "Size of non-streaming response bodies.", ('route',), SIZE_BUCKETS)
+PASSWORD_HASH_QUEUE = REGISTRY.histogram(
+    'b2b_password_hash_queue_depth', "Hashes queued or running when a hash is submitted to the hashing pool.",
+    (), QUERY_COUNT_BUCKETS)
+PASSWORD_HASH_WAIT = REGISTRY.histogram(
+    'b2b_password_hash_wait_seconds', "Time a hash waited for a thread of the hashing pool.")
+PASSWORD_HASH_DURATION = REGISTRY.histogram(
+    'b2b_password_hash_duration_seconds', "Time to compute a password hash in the hashing pool.", ('operation',))
+PASSWORD_HASH_REJECTED = REGISTRY.counter(
+    'b2b_password_hash_rejected_total', "Logins turned away because the hashing pool queue was full.")
+THROTTLED_REQUESTS = REGISTRY.counter(
+    'b2b_throttled_requests_total', "Requests rejected with 429, by throttle scope and kind of client.",
+    ('scope', 'client'))
+ADMISSION_QUEUE = REGISTRY.histogram(
+    'b2b_admission_queue_depth', "Requests waiting for admission when a request arrives.", (), QUERY_COUNT_BUCKETS)
+ADMISSION_WAIT = REGISTRY.histogram(
+    'b2b_admission_wait_seconds', "Time admitted requests waited in the admission queue.", ('priority',))
+ADMISSION_SHED = REGISTRY.counter(
+    'b2b_admission_shed_total', "Requests answered with 503 by the admission control, by the reason.",
+    ('priority', 'reason'))
+
+
+class RequestMetrics:
+    """Timings of the current request, shared with the threads it runs code in."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_queries = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.serializing = False
+
+    def server_timing(self, total):
+        return (f'total;dur={total * 1000:.1f}, '
+                f'db;dur={self.sql_time * 1000:.1f};desc="{self.sql_queries} queries", '
+                f'serialize;dur={self.serializer_time * 1000:.1f}')
+
+
+# Set by the metrics middleware for the duration of a request, sync_to_async copies it into threads
+_request_metrics = ContextVar('request_metrics', default=None)
+
+
+@contextmanager
+def measure_request():
+    metrics = RequestMetrics()
+    token = _request_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _request_metrics.reset(token)
+
+
+def sql_timer(execute, sql, params, many, context):
+    """Database execute wrapper adding query count and time to the current request."""
+    metrics = _request_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.sql_queries += 1
+        metrics.sql_time += time.perf_counter() - start
+
+
+def install_sql_timer(connection):
+    if sql_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_timer)
+
+
+class TimedSerializerMixin:
+    """
+    Serializer mixin adding the time of to_representation to the current request.
+    Nested serializers are part of the outermost measurement.
+    """
+
+    def to_representation(self, instance):
+        metrics = _request_metrics.get()
+        if metrics is None or metrics.serializing:
+            return super().to_representation(instance)
+        metrics.serializing = True
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            metrics.serializer_time += time.perf_counter() - start
+            metrics.serializing = False
+
+
+def record_request(request, response, metrics):
+    """Add a finished request to the route metrics and return its total time."""
+    total = time.perf_counter() - metrics.start
+    match = getattr(request, 'resolver_match', None)
+    route = (match.url_name or match.route) if match is not None else 'unmatched'
+
+    REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+    REQUEST_DURATION.observe(total, route=route)
+    SQL_QUERIES.observe(metrics.sql_queries, route=route)
+    SQL_DURATION.observe(metrics.sql_time, route=route)
+    SERIALIZER_DURATION.observe(metrics.serializer_time, route=route)
+    if not response.streaming:
+        RESPONSE_SIZE.observe(len(response.content), route=route)
+    return total
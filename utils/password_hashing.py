@@ -0,0 +1,73 @@
+"""
+Password hashing off the event loop for the async login.
+
+Hashes run in a dedicated pool of PASSWORD_HASHING_WORKERS threads (hashlib releases
+the GIL while hashing), so a burst of logins occupies at most that many cores and no
+thread that serves the rest of the API. Logins wait for a thread as coroutines; beyond
+PASSWORD_HASHING_QUEUE waiting hashes further logins are turned away instead of
+piling up. Queue depth, wait and hash times are recorded in utils.metrics.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password, verify_password
+
+from utils.metrics import PASSWORD_HASH_DURATION, PASSWORD_HASH_QUEUE, PASSWORD_HASH_REJECTED, PASSWORD_HASH_WAIT
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+# Hashes queued or running in this process, only changed in the event loop
+_pending = 0
+
+
+class HashingPoolFull(Exception):
+    """Raised when PASSWORD_HASHING_QUEUE hashes are already waiting for a thread."""
+
+
+def _get_executor():
+    """The pool of this process, created on first use and again in forked processes."""
+    global _executor, _executor_pid
+    if _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(settings.PASSWORD_HASHING_WORKERS, thread_name_prefix='password-hashing')
+                _executor_pid = os.getpid()
+    return _executor
+
+
+async def run_hash(operation, function, *args):
+    """Run `function(*args)` in the hashing pool, `operation` labels its duration metric."""
+    global _pending
+    if _pending >= settings.PASSWORD_HASHING_WORKERS + settings.PASSWORD_HASHING_QUEUE:
+        PASSWORD_HASH_REJECTED.inc()
+        raise HashingPoolFull
+    PASSWORD_HASH_QUEUE.observe(_pending)
+    submitted = time.perf_counter()
+
+    def job():
+        start = time.perf_counter()
+        PASSWORD_HASH_WAIT.observe(start - submitted)
+        try:
+            return function(*args)
+        finally:
+            PASSWORD_HASH_DURATION.observe(time.perf_counter() - start, operation=operation)
+
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), job)
+    finally:
+        _pending -= 1
+
+
+async def averify_password(password, encoded):
+    """verify_password() in the hashing pool: (is_correct, must_update)."""
+    return await run_hash('verify', verify_password, password, encoded)
+
+
+async def amake_password(password, operation='upgrade'):
+    return await run_hash(operation, make_password, password)
@@ -0,0 +1,156 @@
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from Webshop.models import CompanyGroupMembership, ItemDetails, PriceListEntry
+
+PRICE_INDEX_CACHE_KEY = 'price-index:{group_id}'
+CENT = Decimal('0.01')
+
+
+def _cache_key(group_id):
+    return PRICE_INDEX_CACHE_KEY.format(group_id=group_id)
+
+
+def build_price_indexes(group_ids):
+    """
+    Build the price index of several company groups with a single query.
+    An index maps item ids and category ids to their quantity tiers, sorted by
+    descending minimum quantity.
+    """
+    indexes = {group_id: {'items': defaultdict(list), 'categories': defaultdict(list)} for group_id in group_ids}
+    entries = PriceListEntry.objects.filter(
+        price_list__group_id__in=group_ids,
+        price_list__is_active=True,
+    ).values_list(
+        'price_list__group_id', 'item_id', 'category_id', 'min_quantity', 'price', 'discount_percent',
+        'price_list__valid_from', 'price_list__valid_until',
+    )
+    for group_id, item_id, category_id, min_quantity, price, discount, valid_from, valid_until in entries:
+        tier = (min_quantity, price, discount, valid_from, valid_until)
+        if item_id:
+            indexes[group_id]['items'][item_id].append(tier)
+        else:
+            indexes[group_id]['categories'][category_id].append(tier)
+
+    for index in indexes.values():
+        for tiers in (*index['items'].values(), *index['categories'].values()):
+            tiers.sort(key=lambda tier: tier[0], reverse=True)
+        index['items'] = dict(index['items'])
+        index['categories'] = dict(index['categories'])
+    return indexes
+
+
+def get_price_indexes(group_ids):
+    """
+    Return the price indexes of the given groups from the cache,
+    building all missing indexes with one query.
+    """
+    group_ids = sorted(set(group_ids))
+    if not group_ids:
+        return []
+
+    cached = cache.get_many([_cache_key(group_id) for group_id in group_ids])
+    missing = [group_id for group_id in group_ids if _cache_key(group_id) not in cached]
+    if missing:
+        built = build_price_indexes(missing)
+        cache.set_many({_cache_key(group_id): index for group_id, index in built.items()},
+                       timeout=settings.PRICE_INDEX_CACHE_TIMEOUT)
+        cached.update({_cache_key(group_id): index for group_id, index in built.items()})
+    return [cached[_cache_key(group_id)] for group_id in group_ids]
+
+
+def invalidate_price_index(group_id):
+    cache.delete(_cache_key(group_id))
+
+
+class PriceResolver:
+    """
+    Resolve effective unit prices for the company groups of a buyer.
+    Item overrides win over category overrides; within a level the tier with the
+    highest applicable minimum quantity is used. If several groups grant a price,
+    the lowest one applies, and a negotiated price never exceeds the list price.
+    """
+
+    def __init__(self, group_ids=(), item_categories=None):
+        self.indexes = get_price_indexes(group_ids)
+        self.has_category_prices = any(index['categories'] for index in self.indexes)
+        # Maps item_details_id to its category ids, can be shared between resolvers
+        self.item_categories = item_categories if item_categories is not None else {}
+        self.today = timezone.localdate()
+
+    @classmethod
+    def for_user(cls, user, **kwargs):
+        if user is None or not user.is_authenticated:
+            return cls(**kwargs)
+        group_ids = CompanyGroupMembership.objects.filter(user=user).values_list('group_id', flat=True)
+        return cls(list(group_ids), **kwargs)
+
+    def prime(self, items):
+        """
+        Load the categories of all given items with one query, unless they are prefetched.
+        """
+        items = list(items)
+        for item in items:
+            self._use_prefetched_categories(item)
+        self.prime_categories(item.item_details_id for item in items)
+
+    def _use_prefetched_categories(self, item):
+        if not self.has_category_prices or item.item_details_id in self.item_categories:
+            return
+        details = item._state.fields_cache.get('item_details')
+        if details is not None and 'categories' in getattr(details, '_prefetched_objects_cache', {}):
+            self.item_categories[details.pk] = [category.pk for category in details.categories.all()]
+
+    def prime_categories(self, item_details_ids):
+        if not self.has_category_prices:
+            return
+        missing = set(item_details_ids) - self.item_categories.keys()
+        if not missing:
+            return
+        for item_details_id in missing:
+            self.item_categories[item_details_id] = []
+        rows = ItemDetails.categories.through.objects.filter(itemdetails_id__in=missing).values_list(
+            'itemdetails_id', 'itemcategory_id'
+        )
+        for item_details_id, category_id in rows:
+            self.item_categories[item_details_id].append(category_id)
+
+    def unit_price(self, item, quantity=1):
+        self._use_prefetched_categories(item)
+        return self.resolve(item.pk, item.item_details_id, item.item_price, quantity)
+
+    def resolve(self, item_id, item_details_id, list_price, quantity=1):
+        if not self.indexes:
+            return list_price
+
+        best = list_price
+        for index in self.indexes:
+            price = self._match(index['items'].get(item_id), list_price, quantity)
+            if price is None and self.has_category_prices and index['categories']:
+                self.prime_categories([item_details_id])
+                prices = [
+                    self._match(index['categories'].get(category_id), list_price, quantity)
+                    for category_id in self.item_categories[item_details_id]
+                ]
+                prices = [price for price in prices if price is not None]
+                price = min(prices) if prices else None
+            if price is not None and price < best:
+                best = price
+        return best
+
+    def _match(self, tiers, list_price, quantity):
+        if not tiers:
+            return None
+        for min_quantity, price, discount, valid_from, valid_until in tiers:
+            if min_quantity > quantity:
+                continue
+            if (valid_from and valid_from > self.today) or (valid_until and valid_until < self.today):
+                continue
+            if price is not None:
+                return price
+            return (list_price * (100 - discount) / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+        return None
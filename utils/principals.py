@@ -0,0 +1,87 @@
+"""
+Cache of the users behind JWTs.
+
+An access token carries the id of its user and the token_version of the user at the
+time it was issued. The user is cached as a compact snapshot under both, so
+authenticated requests reach the view without querying the user or its shopping cart.
+Saving a user drops its snapshots, and a password change or deactivation raises the
+token_version, which revokes all tokens issued before.
+
+A snapshot can be older than the database, as other workers with a process-local cache
+keep theirs until PRINCIPAL_CACHE_TIMEOUT. Views that change the user reload it, and
+saving a snapshot never writes is_active, is_staff, is_superuser or token_version.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from Webshop.models import CustomUser, ShoppingCart
+
+PRINCIPAL_CACHE_KEY = 'principal:{user_id}:{version}'
+TOKEN_VERSION_CLAIM = 'token_version'
+# Everything but the password hash, which stays deferred and is loaded when accessed
+SNAPSHOT_FIELDS = tuple(
+    field.attname for field in CustomUser._meta.concrete_fields if field.attname != 'password'
+)
+
+
+def _cache_key(user_id, version):
+    return PRINCIPAL_CACHE_KEY.format(user_id=user_id, version=version)
+
+
+def token_version(token):
+    """The token_version a token was issued for, tokens from before the claim existed have 0."""
+    return token.get(TOKEN_VERSION_CLAIM, 0)
+
+
+def _principal_queryset(user_id):
+    return CustomUser.objects.select_related('shoppingcart').filter(pk=user_id)
+
+
+def _snapshot(user):
+    cart = getattr(user, 'shoppingcart', None)
+    return {
+        'fields': [getattr(user, name) for name in SNAPSHOT_FIELDS],
+        'cart_id': cart.pk if cart is not None else None,
+    }
+
+
+def _from_snapshot(snapshot):
+    """A user instance as if loaded from the database, with its shopping cart (only the id) attached."""
+    user = CustomUser.from_db(DEFAULT_DB_ALIAS, SNAPSHOT_FIELDS, snapshot['fields'])
+    user.from_principal_cache = True
+    if snapshot['cart_id'] is not None:
+        cart = ShoppingCart.from_db(DEFAULT_DB_ALIAS, ['cart_id', 'user_id'], [snapshot['cart_id'], user.pk])
+        cart._state.fields_cache['user'] = user
+        user._state.fields_cache['shoppingcart'] = cart
+    return user
+
+
+def get_principal(user_id, version):
+    """
+    The user for a token of `user_id` issued for token_version `version`, or None if the
+    user does not exist. Callers check is_active and token_version of the returned user.
+    """
+    snapshot = cache.get(_cache_key(user_id, version))
+    if snapshot is not None:
+        return _from_snapshot(snapshot)
+    user = _principal_queryset(user_id).first()
+    if user is not None:
+        cache.set(_cache_key(user.pk, user.token_version), _snapshot(user), timeout=settings.PRINCIPAL_CACHE_TIMEOUT)
+    return user
+
+
+async def aget_principal(user_id, version):
+    snapshot = await cache.aget(_cache_key(user_id, version))
+    if snapshot is not None:
+        return _from_snapshot(snapshot)
+    user = await _principal_queryset(user_id).afirst()
+    if user is not None:
+        await cache.aset(_cache_key(user.pk, user.token_version), _snapshot(user),
+                         timeout=settings.PRINCIPAL_CACHE_TIMEOUT)
+    return user
+
+
+def invalidate_principal(user_id, version):
+    # A save raises token_version by at most one, so the snapshot of the previous version goes as well
+    cache.delete_many([_cache_key(user_id, version), _cache_key(user_id, version - 1)])
@@ -0,0 +1,96 @@
+import csv
+import io
+import json
+
+from asgiref.sync import sync_to_async
+from django.db.models import Aggregate, CharField, OuterRef, Subquery
+
+from Webshop.models import Item, ItemDetails
+from utils.product_upload import CATEGORY_SEPARATOR, PRODUCT_COLUMNS
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class GroupConcat(Aggregate):
+    """
+    Concatenate the values of a group with a separator, in the dialect of the database.
+    """
+    function = 'GROUP_CONCAT'
+    template = "%(function)s(%(expressions)s, '%(separator)s')"
+    output_field = CharField()
+
+    def __init__(self, expression, separator=CATEGORY_SEPARATOR, **extra):
+        super().__init__(expression, separator=separator, **extra)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, template="%(function)s(%(expressions)s SEPARATOR '%(separator)s')",
+                              **extra_context)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, function='STRING_AGG', **extra_context)
+
+
+def catalog_rows(item_ids=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield the catalog in pages of at most `chunk_size` rows in the column order of the importer.
+    Each page is one keyset query (`item_id > last`) with the categories of an item
+    aggregated in SQL, so memory stays constant and no transaction is held open
+    between pages. `item_ids` optionally restricts the export to a subset.
+    """
+    queryset = Item.objects.order_by('item_id')
+    if item_ids is not None:
+        queryset = queryset.filter(item_id__in=item_ids)
+    # A correlated subquery instead of GROUP BY keeps every page an index range scan
+    categories = ItemDetails.categories.through.objects.filter(itemdetails_id=OuterRef('item_details_id')).values(
+        'itemdetails_id').annotate(names=GroupConcat('itemcategory__category_name')).values('names')
+    queryset = queryset.annotate(item_category=Subquery(categories)).values_list(
+        'item_id', 'article_id', 'item_details__item_name', 'item_category', 'item_price',
+        'item_details__item_description', 'item_stock',
+    )
+
+    last_id = 0
+    while True:
+        page = list(queryset.filter(item_id__gt=last_id)[:chunk_size])
+        if not page:
+            return
+        last_id = page[-1][0]
+        yield [(article_id, name, categories or '', str(price), description, str(stock))
+               for _, article_id, name, categories, price, description, stock in page]
+
+
+def export_catalog(export_format='csv', item_ids=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield the catalog as text blocks of one page each, either as ';'-separated CSV in the
+    format read by the product import or as newline-delimited JSON with the same keys.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unbekanntes Exportformat: {export_format}")
+
+    if export_format == 'csv':
+        yield _csv_block([PRODUCT_COLUMNS])
+        for page in catalog_rows(item_ids, chunk_size):
+            yield _csv_block(page)
+    else:
+        for page in catalog_rows(item_ids, chunk_size):
+            yield ''.join(json.dumps(dict(zip(PRODUCT_COLUMNS, row)), ensure_ascii=False) + '\n' for row in page)
+
+
+def _csv_block(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer, delimiter=';', quotechar='"', lineterminator='\n').writerows(rows)
+    return buffer.getvalue()
+
+
+async def aexport_catalog(*args, **kwargs):
+    """
+    Async variant of export_catalog for streaming responses under ASGI.
+    Every page is produced in the sync thread, so the response is not buffered in memory.
+    """
+    blocks = export_catalog(*args, **kwargs)
+    next_block = sync_to_async(next)
+    while (block := await next_block(blocks, None)) is not None:
+        yield block
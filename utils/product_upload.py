@@ -1,129 +1,514 @@
+import codecs
+import hashlib
+import logging
+from decimal import Decimal
+
+import numpy as np
 import pandas as pd
 import chardet
 from django.core.exceptions import ValidationError
-from Webshop.models import Item, ItemDetails, ItemCategory
+from django.db import models, transaction
+from django.db.models import F
+from django.utils import timezone
+from utils.events import item_stock_event, publish_on_commit
+from Webshop.models import Item, ItemDetails, ItemCategory, ImportJob, ImportJobKind, ImportJobStatus
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_COLUMNS = ['article_id', 'item_name', 'item_category', 'item_price', 'item_description', 'item_stock']
+MAX_DISPLAYED_ERRORS = 100
+MAX_STORED_ERRORS = 10000
+IMPORT_BATCH_SIZE = 1000
+STREAM_CHUNK_SIZE = 10000
+ENCODING_SAMPLE_SIZE = 64 * 1024
+# Western European supplier feeds that are neither UTF-8 nor recognised by chardet
+FALLBACK_ENCODING = 'cp1252'
+PREVIEW_COLUMNS = ['row', 'article_id', 'change', 'old', 'new']
+CATEGORY_SEPARATOR = '|'
+CENT = Decimal('0.01')
+# The largest price Item.item_price can store
+_price_field = Item._meta.get_field('item_price')
+MAX_PRICE = Decimal(10) ** (_price_field.max_digits - _price_field.decimal_places) - CENT
+# The largest stock of the PositiveIntegerField, on every database backend
+MAX_STOCK = 2147483647
+# Longer values abort the bulk upsert of their whole batch on strict backends
+MAX_ARTICLE_ID_LENGTH = Item._meta.get_field('article_id').max_length
+MAX_NAME_LENGTH = ItemDetails._meta.get_field('item_name').max_length
+MAX_CATEGORY_LENGTH = ItemCategory._meta.get_field('category_name').max_length
+STOCK_ERROR = "Der Lagerbestand muss eine gültige Zahl sein."
+
+
+def parse_prices(prices):
+    """
+    Parse a column of price strings with a decimal point or comma as floats, NaN where
+    they are not a number. Validation and import share it, so every price that passes
+    validation can be imported.
+    """
+    return pd.to_numeric(prices.str.strip().str.replace(",", ".", regex=False), errors='coerce')
 
 
 def validate_product_data(df):
-    errors = []
+    """
+    Validate the product data with vectorized column operations.
+    Returns a DataFrame with one row per error (`row`, `message`), ordered by row number.
+    Row numbers are 1-based and refer to the data rows of the file.
+    """
+    values = {
+        column: df[column].astype(str).str.strip() if column in df.columns else pd.Series('', index=df.index)
+        for column in PRODUCT_COLUMNS
+    }
+    rows = pd.Series(df.index + 1, index=df.index)
+    checks = []
 
-    for index, row in df.iterrows():
-        try:
-            item_name = str(row.get('item_name', '')).strip()
-            item_description = str(row.get('item_description', '')).strip()
-            category_name = str(row.get('item_category', '')).strip()
-            item_price = str(row.get('item_price', '')).strip()
-            item_stock = str(row.get('item_stock', '')).strip()
-            article_id = str(row.get('article_id', '')).strip()
+    missing = (values['item_name'] == '') | (values['item_description'] == '') | (values['item_category'] == '')
+    checks.append((missing, "Name, Beschreibung und Kategorie fehlen."))
+    checks.append((values['item_name'].str.len() > MAX_NAME_LENGTH,
+                   f"Der Name darf höchstens {MAX_NAME_LENGTH} Zeichen lang sein."))
+    category_length = (values['item_category'].str.split(CATEGORY_SEPARATOR, regex=False).explode()
+                       .str.strip().str.len().groupby(level=0).max())
+    checks.append((category_length > MAX_CATEGORY_LENGTH,
+                   f"Eine Kategorie darf höchstens {MAX_CATEGORY_LENGTH} Zeichen lang sein."))
 
-            if not item_name or not item_description or not category_name:
-                errors.append(f"Zeile {index + 1}: Name, Beschreibung und Kategorie fehlen.")
+    price = values['item_price']
+    price_value = parse_prices(price)
+    price_finite = np.isfinite(price_value)
+    price_invalid = (price != '') & ~price_finite
+    checks.append(((price == '') | (price_value <= 0), "Der Preis muss eine Zahl größer als 0 sein."))
+    checks.append((price_invalid, "Der Preis ist ungültig."))
+    checks.append((price_finite & (price_value > float(MAX_PRICE)), f"Der Preis darf höchstens {MAX_PRICE} betragen."))
 
-            try:
-                item_price = float(item_price.replace(",", ".")) if item_price else 0.0
-                if item_price <= 0:
-                    errors.append(f"Zeile {index + 1}: Der Preis muss eine Zahl größer als 0 sein.")
-            except ValueError:
-                errors.append(f"Zeile {index + 1}: Der Preis ist ungültig.")
+    # ASCII digits only, str.isdigit() also accepts '²' and other Unicode digits
+    stock = values['item_stock']
+    stock_valid = stock.str.fullmatch(r'[0-9]+')
+    checks.append((~stock_valid, STOCK_ERROR))
+    checks.append((stock_valid & (pd.to_numeric(stock.where(stock_valid), errors='coerce') > MAX_STOCK),
+                   f"Der Lagerbestand darf höchstens {MAX_STOCK} betragen."))
 
-            if not item_stock.isdigit():
-                errors.append(f"Zeile {index + 1}: Der Lagerbestand muss eine gültige Zahl sein.")
+    article_id = values['article_id']
+    checks.append((article_id.str.len() < 4, "Die Artikel-ID muss mindestens 4 Zeichen lang sein."))
+    checks.append((article_id.str.len() > MAX_ARTICLE_ID_LENGTH,
+                   f"Die Artikel-ID darf höchstens {MAX_ARTICLE_ID_LENGTH} Zeichen lang sein."))
 
-            if len(article_id) < 4:
-                errors.append(f"Zeile {index + 1}: Die Artikel-ID muss mindestens 4 Zeichen lang sein.")
+    duplicated = article_id.duplicated(keep='first') & (article_id != '')
+    if duplicated.any():
+        first_rows = rows.groupby(article_id).transform('first')
+        messages = ("Die Artikel-ID '" + article_id[duplicated] + "' kommt mehrfach vor (erstmals in Zeile "
+                    + first_rows[duplicated].astype(str) + ").")
+        checks.append((duplicated, messages))
 
-        except Exception as e:
-            errors.append(f"Zeile {index + 1}: Fehler beim Validieren - {e}")
+    frames = [
+        pd.DataFrame({'row': rows[mask], 'check': position,
+                      'message': message[mask] if isinstance(message, pd.Series) else message})
+        for position, (mask, message) in enumerate(checks) if mask.any()
+    ]
+    if not frames:
+        return pd.DataFrame({'row': pd.Series(dtype='int64'), 'message': pd.Series(dtype='object')})
 
-    return errors
+    errors = pd.concat(frames, ignore_index=True)
+    return errors.sort_values(['row', 'check'], kind='stable').drop(columns='check').reset_index(drop=True)
 
 
-def process_product_upload(file):
-    try:
-        # Detect encoding
-        raw_data = file.read()
-        encoding_detected = chardet.detect(raw_data)['encoding']
+def format_validation_errors(errors, limit=MAX_DISPLAYED_ERRORS):
+    """
+    Render an error table as messages for display, capped at `limit` entries.
+    """
+    messages = [f"Zeile {row}: {message}" for row, message in errors.head(limit).itertuples(index=False)]
+    if len(errors) > limit:
+        messages.append(f"... und {len(errors) - limit} weitere Fehler.")
+    return messages
 
-        # Set default encoding to UTF-8
-        if encoding_detected is None:
-            encoding_detected = "UTF-8"
 
-        print(f"Erkannte Kodierung: {encoding_detected}")
+def _ids_by_name(model, field, names):
+    """
+    Map names to primary keys with one IN query. Names are not unique, so the
+    oldest row wins, like get_or_create would have returned it.
+    """
+    ids = {}
+    rows = model.objects.filter(**{f"{field}__in": names}).order_by('pk').values_list(field, 'pk')
+    for name, pk in rows:
+        ids.setdefault(name, pk)
+    return ids
 
-        # Reset file pointer
-        file.seek(0)
 
-        df = pd.read_csv(file, dtype=str, sep=";", keep_default_na=False, encoding=encoding_detected, quotechar='"')
-        df.columns = df.columns.str.strip().str.lower()
-        expected_columns = {'article_id', 'item_name', 'item_category', 'item_price', 'item_description', 'item_stock'}
+def split_categories(df, key='item_name'):
+    """
+    Return the distinct (`key`, item_category) pairs of a DataFrame. A row can name
+    several categories separated by CATEGORY_SEPARATOR, as written by the catalog export.
+    """
+    categories = df['item_category'].str.split(CATEGORY_SEPARATOR, regex=False).explode().str.strip()
+    pairs = pd.DataFrame({key: df[key].loc[categories.index], 'item_category': categories})
+    return pairs[pairs['item_category'] != ''].drop_duplicates()
 
-        if not expected_columns.issubset(set(df.columns)):
-            fehlende_spalten = expected_columns - set(df.columns)
-            print(f"Fehlende Spalten in der Datei: {fehlende_spalten}")
-            return
 
-        validation_errors = validate_product_data(df)
-        if validation_errors:
-            raise ValidationError("\n".join(validation_errors))
+def _import_batch(batch, replace_stock=False):
+    """
+    Upsert one batch of validated rows with a fixed number of queries:
+    existing items, details and categories are preloaded with IN queries,
+    missing details and categories are bulk inserted, items are written with a
+    single upsert and all category assignments with one through-table insert.
+    """
+    article_ids = batch['article_id'].tolist()
+    existing = {
+        article_id: (item_id, item_stock) for article_id, item_id, item_stock
+        in Item.objects.filter(article_id__in=article_ids).values_list('article_id', 'pk', 'item_stock')
+    }
+
+    category_pairs = split_categories(batch)
+    category_names = set(category_pairs['item_category'])
+    category_ids = _ids_by_name(ItemCategory, 'category_name', category_names)
+    new_categories = category_names - category_ids.keys()
+    if new_categories:
+        ItemCategory.objects.bulk_create([ItemCategory(category_name=name) for name in new_categories])
+        category_ids = _ids_by_name(ItemCategory, 'category_name', category_names)
+
+    # Like get_or_create, the description is only used for new item details
+    descriptions = dict(zip(batch['item_name'], batch['item_description']))
+    details_ids = _ids_by_name(ItemDetails, 'item_name', descriptions.keys())
+    new_details = descriptions.keys() - details_ids.keys()
+    if new_details:
+        ItemDetails.objects.bulk_create([
+            ItemDetails(item_name=name, item_description=descriptions[name]) for name in new_details
+        ])
+        details_ids = _ids_by_name(ItemDetails, 'item_name', descriptions.keys())
+
+    # From the shortest decimal representation of the validated float, which is finite and below MAX_PRICE
+    prices = parse_prices(batch['item_price']).map(lambda price: Decimal(str(price)).quantize(CENT))
+    stock = pd.to_numeric(batch['item_stock'], errors='coerce').fillna(0).astype(int)
+
+    items = [
+        Item(
+            article_id=article_id,
+            item_price=price,
+            item_stock=stock if replace_stock else existing.get(article_id, (None, 0))[1] + stock,
+            item_details_id=details_ids[item_name],
+        )
+        for article_id, price, stock, item_name in zip(article_ids, prices, stock, batch['item_name'])
+    ]
+    Item.objects.bulk_create(
+        items,
+        update_conflicts=True,
+        unique_fields=['article_id'],
+        update_fields=['item_price', 'item_stock', 'item_details', 'updated_at'],
+    )
+    # New items are in no shopping cart yet, so only stock changes of existing items are published
+    publish_on_commit(
+        item_stock_event(existing[item.article_id][0], int(item.item_stock)) for item in items
+        if item.article_id in existing and existing[item.article_id][1] != item.item_stock
+    )
+
+    ItemDetailsCategory = ItemDetails.categories.through
+    ItemDetailsCategory.objects.bulk_create(
+        [
+            ItemDetailsCategory(itemdetails_id=details_ids[item_name], itemcategory_id=category_ids[category_name])
+            for item_name, category_name in category_pairs.itertuples(index=False)
+        ],
+        ignore_conflicts=True,
+    )
 
-        for index, row in df.iterrows():
+    return {
+        'rows': len(batch),
+        'created': len(article_ids) - len(existing),
+        'updated': len(existing),
+        'categories_created': len(new_categories),
+    }
+
+
+def import_products(df, batch_size=IMPORT_BATCH_SIZE, replace_stock=False):
+    """
+    Create or update the products of a validated DataFrame in batches.
+    Each batch is written in its own transaction. Prices are replaced and stock is
+    added to the existing stock, or replaces it with `replace_stock` (e.g. when
+    re-importing a catalog export). Returns the number of processed, created and
+    updated rows and of newly created categories.
+    """
+    df = df[PRODUCT_COLUMNS].apply(lambda column: column.astype(str).str.strip())
+    stats = {'rows': 0, 'created': 0, 'updated': 0, 'categories_created': 0}
+
+    for start in range(0, len(df), batch_size):
+        with transaction.atomic():
+            batch_stats = _import_batch(df.iloc[start:start + batch_size], replace_stock=replace_stock)
+        for key, value in batch_stats.items():
+            stats[key] += value
+    return stats
+
+
+def detect_encoding(file, sample_size=ENCODING_SAMPLE_SIZE):
+    """
+    Detect the file encoding from a bounded sample and rewind the file.
+    An ASCII sample says nothing about the rest of the file: it is read as UTF-8 if
+    all of the file is valid UTF-8, otherwise the encoding is detected from the
+    block with the first invalid byte (cp1252 if that fails as well).
+    """
+    sample = file.read(sample_size)
+    encoding = chardet.detect(sample)['encoding']
+    if encoding is None or encoding.lower() == 'ascii':
+        encoding = "UTF-8"
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        block = sample
+        while block:
             try:
-                item_name = str(row['item_name']).strip()
-                item_description = str(row['item_description']).strip()
-                category_name = str(row['item_category']).strip()
-                article_id = str(row['article_id']).strip()
-
-                existing_item = Item.objects.filter(article_id=article_id).first()
-                existing_price = existing_item.item_price if existing_item else 0.0
-                existing_stock = existing_item.item_stock if existing_item else 0
-
-                try:
-                    new_price = float(row['item_price'].replace(",", ".")) if row['item_price'] else existing_price
-                except ValueError:
-                    new_price = existing_price
-
-                updated_price = new_price
-                try:
-                    added_stock = int(float(row['item_stock'])) if row['item_stock'].isdigit() else 0
-                except ValueError:
-                    added_stock = 0
-
-                new_stock = existing_stock + added_stock
-
-                if not item_name or not category_name:
-                    print(f"Zeile {index + 1}: Fehlende Werte! {row}")
-                    continue
-
-                category, created = ItemCategory.objects.get_or_create(category_name=category_name)
-                if created:
-                    print(f"Neue Kategorie '{category_name}' wurde angelegt.")
-
-                item_details, _ = ItemDetails.objects.get_or_create(
-                    item_name=item_name,
-                    defaults={'item_description': item_description}
-                )
+                decoder.decode(block)
+            except UnicodeDecodeError:
+                encoding = chardet.detect(block)['encoding']
+                if encoding is None or encoding.lower() in ('ascii', 'utf-8'):
+                    encoding = FALLBACK_ENCODING
+                break
+            block = file.read(sample_size)
+    file.seek(0)
+    return encoding
+
+
+def read_product_csv(file, encoding, **kwargs):
+    """
+    Read the product CSV as strings with normalized column names.
+    With `chunksize` an iterator of DataFrames is returned.
+    """
+    reader = pd.read_csv(file, dtype=str, sep=";", keep_default_na=False, encoding=encoding, quotechar='"', **kwargs)
+    if 'chunksize' not in kwargs:
+        return _normalize_columns(reader)
+    return (_normalize_columns(chunk) for chunk in reader)
+
+
+def _normalize_columns(df):
+    df.columns = df.columns.str.strip().str.lower()
+    missing_columns = set(PRODUCT_COLUMNS) - set(df.columns)
+    if missing_columns:
+        raise ValidationError(f"Fehlende Spalten in der Datei: {', '.join(sorted(missing_columns))}")
+    return df
+
+
+def file_fingerprint(file, block_size=ENCODING_SAMPLE_SIZE):
+    """
+    Identify a file by the hash of its content, so an edited file does not resume the
+    checkpoint of its previous version.
+    """
+    digest = hashlib.sha256()
+    file.seek(0)
+    while block := file.read(block_size):
+        digest.update(block)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def _skip_records(chunks, count):
+    """
+    Drop the first `count` records of an iterator of DataFrame chunks. Records are
+    counted like the checkpoint counts them, a quoted value can span several lines.
+    """
+    for chunk in chunks:
+        if count >= len(chunk):
+            count -= len(chunk)
+            continue
+        if count:
+            chunk = chunk.iloc[count:]
+            count = 0
+        yield chunk
 
-                item, _ = Item.objects.update_or_create(
-                    article_id=article_id,
-                    defaults={
-                        "item_price": updated_price,  # actualized price
-                        "item_stock": new_stock,  # actualized stock
-                        "item_details": item_details,
-                    }
+
+def stream_product_upload(file, source='', chunk_size=STREAM_CHUNK_SIZE, resume=True, job=None,
+                          replace_stock=False):
+    """
+    Import a product file of any size with bounded memory.
+    The CSV is read in chunks; each chunk is validated on its own, invalid rows are
+    skipped and reported, and valid rows are imported in one transaction together
+    with the checkpoint and counters of the ImportJob. Without an explicit job, an
+    unfinished import of the same file is resumed after its last committed chunk.
+    Duplicate article_ids are only detected within a chunk.
+    """
+    if job is None:
+        job = _get_or_create_import_job(file, source, chunk_size, resume, replace_stock)
+    ImportJob.objects.filter(pk=job.pk).update(status=ImportJobStatus.RUNNING, started_at=job.started_at or timezone.now())
+
+    stats = {'rows': 0, 'created': 0, 'updated': 0, 'categories_created': 0, 'invalid_rows': 0,
+             'resumed_at_row': job.rows_processed}
+    errors = list(job.errors)
+    # The committed chunks are parsed again but not imported, the index keeps counting the rows of the file
+    chunks = _skip_records(read_product_csv(file, job.encoding, chunksize=job.chunk_size), job.rows_processed)
+    try:
+        for chunk in chunks:
+            chunk_errors = validate_product_data(chunk)
+            valid_rows = chunk[~chunk.index.isin(chunk_errors['row'] - 1)]
+            invalid_rows = len(chunk) - len(valid_rows)
+            errors.extend([int(row), message] for row, message
+                          in chunk_errors.head(MAX_STORED_ERRORS - len(errors)).itertuples(index=False))
+
+            with transaction.atomic():
+                chunk_stats = import_products(valid_rows, replace_stock=job.replace_stock)
+                ImportJob.objects.filter(pk=job.pk).update(
+                    chunks_committed=F('chunks_committed') + 1,
+                    rows_processed=F('rows_processed') + len(chunk),
+                    rows_created=F('rows_created') + chunk_stats['created'],
+                    rows_updated=F('rows_updated') + chunk_stats['updated'],
+                    rows_invalid=F('rows_invalid') + invalid_rows,
+                    errors=errors,
+                    updated_at=timezone.now(),
                 )
 
-                item_details.categories.add(category)
+            for key, value in chunk_stats.items():
+                stats[key] += value
+            stats['invalid_rows'] += invalid_rows
+    except Exception as e:
+        ImportJob.objects.filter(pk=job.pk).update(status=ImportJobStatus.FAILED, error_message=str(e),
+                                                   finished_at=timezone.now())
+        raise
+
+    ImportJob.objects.filter(pk=job.pk).update(status=ImportJobStatus.COMPLETED, finished_at=timezone.now())
+    stats['errors'] = [f"Zeile {row}: {message}" for row, message in errors[:MAX_DISPLAYED_ERRORS]]
+    return stats
+
+
+def _get_or_create_import_job(file, source, chunk_size, resume, replace_stock):
+    fingerprint = file_fingerprint(file)
+    if resume:
+        # Like claim_job: a job that is still running belongs to its worker
+        resumable = ImportJob.objects.filter(models.Q(status=ImportJobStatus.FAILED) | ImportJob.stale(),
+                                             kind=ImportJobKind.PRODUCTS, fingerprint=fingerprint,
+                                             replace_stock=replace_stock)
+        job = resumable.last()
+        if job is not None and resumable.filter(pk=job.pk).update(status=ImportJobStatus.RUNNING,
+                                                                  updated_at=timezone.now()):
+            return job
+    return ImportJob.objects.create(source=source, fingerprint=fingerprint, encoding=detect_encoding(file),
+                                    chunk_size=chunk_size, replace_stock=replace_stock)
+
+
+def preview_product_upload(file, chunk_size=STREAM_CHUNK_SIZE, replace_stock=False, on_progress=None):
+    """
+    Compute what an import of the file would change, without writing to the database.
+    The current state of all article_ids of a chunk is loaded with a few IN queries
+    and compared with the file using DataFrame joins.
+    `on_progress` is called with the number of rows read after each chunk.
+    Returns a summary dict and a DataFrame of changes with the columns
+    `row`, `article_id`, `change`, `old` and `new`, ordered by row.
+    """
+    encoding = detect_encoding(file)
+    summary = {'rows': 0, 'invalid_rows': 0, 'new_items': 0, 'price_changes': 0, 'stock_changes': 0,
+               'name_changes': 0, 'category_assignments': 0, 'new_categories': []}
+    known_categories = set()
+    changes = []
+
+    for chunk in read_product_csv(file, encoding, chunksize=chunk_size):
+        chunk_errors = validate_product_data(chunk)
+        summary['rows'] += len(chunk)
+        summary['invalid_rows'] += chunk_errors['row'].nunique()
+        if on_progress is not None:
+            on_progress(summary['rows'])
+        chunk = chunk[~chunk.index.isin(chunk_errors['row'] - 1)]
+        if chunk.empty:
+            continue
+
+        chunk_changes, new_categories = _diff_chunk(chunk, known_categories, replace_stock)
+        summary['invalid_rows'] += int((chunk_changes['change'] == 'error').sum())
+        known_categories.update(new_categories)
+        summary['new_categories'].extend(sorted(new_categories))
+        changes.append(chunk_changes)
+
+    changes = pd.concat(changes, ignore_index=True) if changes else pd.DataFrame(columns=PREVIEW_COLUMNS)
+    counts = changes['change'].value_counts()
+    for key, change in (('new_items', 'new'), ('price_changes', 'price'), ('stock_changes', 'stock'),
+                        ('name_changes', 'name'), ('category_assignments', 'category')):
+        summary[key] = int(counts.get(change, 0))
+    return summary, changes
+
 
-                print(f"Produkt '{item_details.item_name}' erfolgreich hinzugefügt!")
+def _diff_chunk(chunk, known_categories, replace_stock=False):
+    """
+    Diff one validated chunk against the database. `known_categories` holds the
+    new category names of previous chunks, which are not reported as new again.
+    Rows whose stock cannot be read are returned as `error` changes.
+    """
+    df = pd.DataFrame({
+        'row': chunk.index + 1,
+        'article_id': chunk['article_id'].str.strip(),
+        'item_name': chunk['item_name'].str.strip(),
+        'item_category': chunk['item_category'],
+        'price': parse_prices(chunk['item_price']).round(2),
+        'stock': pd.to_numeric(chunk['item_stock'].str.strip(), errors='coerce'),
+    })
+    # Validation rejects these already, a stock that still cannot be read is reported for its row
+    invalid_stock = df['stock'].isna()
+    errors = pd.DataFrame({'row': df['row'], 'article_id': df['article_id'], 'change': 'error', 'old': '',
+                           'new': STOCK_ERROR})[invalid_stock]
+    df = df[~invalid_stock].astype({'stock': int})
+    article_ids = df['article_id'].tolist()
+
+    existing = pd.DataFrame.from_records(
+        Item.objects.filter(article_id__in=article_ids).values_list(
+            'article_id', 'item_price', 'item_stock', 'item_details__item_name'
+        ),
+        columns=['article_id', 'old_price', 'old_stock', 'old_name'],
+    )
+    existing['old_price'] = existing['old_price'].astype(float)
+    assigned = pd.DataFrame.from_records(
+        ItemDetails.categories.through.objects.filter(itemdetails__items__article_id__in=article_ids).values_list(
+            'itemdetails__items__article_id', 'itemcategory__category_name'
+        ),
+        columns=['article_id', 'item_category'],
+    )
+    category_pairs = split_categories(df, key='article_id')
+    category_names = set(category_pairs['item_category'])
+    existing_categories = set(ItemCategory.objects.filter(category_name__in=category_names)
+                              .values_list('category_name', flat=True))
+
+    df = df.merge(existing, on='article_id', how='left', indicator='state')
+    is_new = df['state'] == 'left_only'
+    is_existing = ~is_new
+    changes = [
+        errors,
+        pd.DataFrame({'row': df['row'], 'article_id': df['article_id'], 'change': 'new', 'old': '',
+                      'new': df['item_name'] + ' / ' + df['price'].map('{:.2f}'.format)})[is_new],
+    ]
+
+    price_changed = is_existing & ((df['price'] - df['old_price']).abs() >= 0.005)
+    changes.append(pd.DataFrame({'row': df['row'], 'article_id': df['article_id'], 'change': 'price',
+                                 'old': df['old_price'].map('{:.2f}'.format),
+                                 'new': df['price'].map('{:.2f}'.format)})[price_changed])
+
+    old_stock = df['old_stock'].fillna(0).astype(int)
+    new_stock = df['stock'] if replace_stock else old_stock + df['stock']
+    stock_changed = is_existing & (new_stock != old_stock)
+    changes.append(pd.DataFrame({'row': df['row'], 'article_id': df['article_id'], 'change': 'stock',
+                                 'old': old_stock.astype(str), 'new': new_stock.astype(str)})[stock_changed])
+
+    name_changed = is_existing & (df['item_name'] != df['old_name'])
+    changes.append(pd.DataFrame({'row': df['row'], 'article_id': df['article_id'], 'change': 'name',
+                                 'old': df['old_name'], 'new': df['item_name']})[name_changed])
+
+    # Existing items that get a category they do not have yet
+    unchanged = df.loc[is_existing & ~name_changed, ['row', 'article_id']]
+    category_rows = unchanged.merge(category_pairs, on='article_id').merge(
+        assigned, on=['article_id', 'item_category'], how='left', indicator='assignment')
+    category_added = category_rows['assignment'] == 'left_only'
+    changes.append(pd.DataFrame({'row': category_rows['row'], 'article_id': category_rows['article_id'],
+                                 'change': 'category', 'old': '',
+                                 'new': category_rows['item_category']})[category_added])
+
+    changes = pd.concat(changes, ignore_index=True).sort_values('row', kind='stable')
+    return changes[PREVIEW_COLUMNS], category_names - existing_categories - known_categories
+
+
+def process_product_upload(file):
+    try:
+        # Detect encoding from a sample instead of reading the whole file
+        encoding_detected = detect_encoding(file)
+        logger.info(f"Erkannte Kodierung: {encoding_detected}")
+
+        df = read_product_csv(file, encoding_detected)
+
+        validation_errors = validate_product_data(df)
+        if not validation_errors.empty:
+            raise ValidationError("\n".join(format_validation_errors(validation_errors)))
 
-            except Exception as e:
-                print(f"Fehler in Zeile {index + 1}: {e}")
+        stats = import_products(df)
+        logger.info(f"Import abgeschlossen: {stats['created']} Produkte angelegt, {stats['updated']} aktualisiert, "
+                    f"{stats['categories_created']} neue Kategorien.")
+        return stats
 
     except ValidationError as e:
-        print(f"Validierungsfehler: {e}")
+        logger.error(f"Validierungsfehler: {e}")
     except UnicodeDecodeError:
-        print("Fehler beim Dekodieren der Datei. Stelle sicher, dass die Datei UTF-8 oder ISO-8859-1 kodiert ist.")
+        logger.error("Fehler beim Dekodieren der Datei. Stelle sicher, dass die Datei UTF-8 oder ISO-8859-1 kodiert ist.")
     except pd.errors.ParserError as e:
-        print(f"Fehler beim Einlesen der CSV: {e}")
+        logger.error(f"Fehler beim Einlesen der CSV: {e}")
     except Exception as e:
-        print(f"Unerwarteter Fehler: {e}")
\ No newline at end of file
+        logger.exception(f"Unerwarteter Fehler: {e}")
\ No newline at end of file
@@ -0,0 +1,149 @@
+"""
+Sampling profiler for single requests.
+
+A background thread reads the stacks of the threads working on a request from
+sys._current_frames() at a fixed interval and counts them in the collapsed-stack
+format of flamegraph.pl and speedscope. The profiled code runs unmodified, so the
+measured timings stay close to those of unprofiled requests.
+"""
+import os
+import random
+import sys
+import sysconfig
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_QUERY_PARAMETER = '_profile'
+MAX_STACK_DEPTH = 200
+# Leaf frames of threads that wait for work instead of running it
+IDLE_FRAMES = {('threading.py', 'wait'), ('selectors.py', 'select'), ('queue.py', 'get')}
+
+_PATH_PREFIXES = sorted(
+    {os.path.join(path, '') for path in (*sys.path, sysconfig.get_paths()['stdlib']) if path},
+    key=len, reverse=True,
+)
+
+
+def _short_path(filename):
+    for prefix in _PATH_PREFIXES:
+        if filename.startswith(prefix):
+            return filename[len(prefix):]
+    return filename
+
+
+def collapse_stack(frame):
+    """
+    The stack of `frame` as "function (file:line);..." from the root to the leaf, or None
+    if the thread is idle. Frames are identified by the first line of their function, so
+    samples anywhere in a function are merged.
+    """
+    code = frame.f_code
+    if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+        return None
+    frames = []
+    while frame is not None and len(frames) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(frames))
+
+
+class StackSampler:
+    """Count the stacks of the given threads every `interval` seconds until stopped."""
+
+    def __init__(self, thread_ids, interval):
+        self.thread_ids = set(thread_ids)
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in self.thread_ids:
+                frame = frames.get(thread_id)
+                stack = collapse_stack(frame) if frame is not None else None
+                if stack is not None:
+                    self.stacks[stack] += 1
+            del frames
+
+
+def format_collapsed(stacks):
+    """Render stack counts as collapsed-stack lines, most frequent first."""
+    return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def parse_collapsed(text):
+    stacks = Counter()
+    for line in text.splitlines():
+        stack, _, count = line.rpartition(' ')
+        if stack:
+            stacks[stack] += int(count)
+    return stacks
+
+
+def hot_functions(stacks, limit=20):
+    """The functions with the most samples at the top of the stack, as (function, samples) pairs."""
+    functions = Counter()
+    for stack, count in stacks.items():
+        functions[stack.rpartition(';')[2]] += count
+    return functions.most_common(limit)
+
+
+def requested_profile(request):
+    """Whether the client asked to profile the request. Only kept for staff users."""
+    return request.headers.get(PROFILE_HEADER) == '1' or request.GET.get(PROFILE_QUERY_PARAMETER) == '1'
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return 'unmatched'
+    return match.url_name or match.route
+
+
+def sampled_profile(request):
+    """Whether the request is part of the random sample of its route, see PROFILER_SAMPLE_RATES."""
+    rates = settings.PROFILER_SAMPLE_RATES
+    if not rates:
+        return False
+    rate = rates.get(route_name(request), rates.get('*', 0))
+    return rate > 0 and random.random() < rate
+
+
+def store_profile(request, response, stacks, duration, trigger):
+    """Save the samples of a request and prune profiles beyond PROFILER_MAX_PROFILES."""
+    from Webshop.models import RequestProfile
+
+    user = getattr(request, 'user', None)
+    profile = RequestProfile.objects.create(
+        route=route_name(request),
+        method=request.method,
+        path=request.get_full_path()[:2048],
+        status_code=response.status_code,
+        duration_ms=duration * 1000,
+        sample_count=sum(stacks.values()),
+        stacks=format_collapsed(stacks),
+        trigger=trigger,
+        user=user if user is not None and user.is_authenticated else None,
+    )
+    if profile.pk % 100 == 0:
+        RequestProfile.objects.filter(pk__lte=profile.pk - settings.PROFILER_MAX_PROFILES).delete()
+    return profile
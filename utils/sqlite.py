@@ -0,0 +1,45 @@
+import logging
+import random
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+
+logger = logging.getLogger(__name__)
+
+LOCK_ERROR_MESSAGES = ('database is locked', 'database table is locked')
+
+
+def apply_pragmas(connection):
+    """Apply SQLITE_PRAGMAS to a new SQLite connection."""
+    with connection.cursor() as cursor:
+        for pragma, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+
+
+def is_lock_error(error):
+    return isinstance(error, OperationalError) and any(message in str(error) for message in LOCK_ERROR_MESSAGES)
+
+
+def retry_on_lock(func):
+    """
+    Retry a write path up to SQLITE_WRITE_ATTEMPTS times when SQLite reports a lock,
+    with exponential backoff and jitter. The wrapped function must open its own
+    transaction; inside an outer atomic block the error is raised immediately, since
+    only the outermost transaction can be retried.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        attempts = settings.SQLITE_WRITE_ATTEMPTS
+        for attempt in range(1, attempts + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                if not is_lock_error(e) or attempt == attempts or transaction.get_connection().in_atomic_block:
+                    raise
+                delay = settings.SQLITE_RETRY_DELAY * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                logger.warning(f"{func.__qualname__}: {e}, retry {attempt}/{attempts - 1} in {delay:.3f}s")
+                time.sleep(delay)
+
+    return wrapper
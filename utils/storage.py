@@ -0,0 +1,92 @@
+import hashlib
+import os
+import posixpath
+import re
+import uuid
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+HASH_CHUNK_SIZE = 64 * 1024
+CONTENT_HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+# Seconds a file modification time may lag behind time.time() on coarse file system clocks
+MTIME_SLACK = 1
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage that names files by the SHA-256 of their content, sharded by
+    the first two hash bytes: `item_images/ab/cd/abcd....jpg`. Saving content that is
+    already stored touches the existing file instead of writing it, so identical files
+    are stored once and a URL never changes its content.
+
+    Files are shared by all rows with the same content. Writers save the file after
+    their row is committed and deletes go through `delete_unless_touched`, so a
+    delete never removes a file a concurrent writer still relies on.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('allow_overwrite', True)
+        super().__init__(**kwargs)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        name = self.hashed_name(name, content)
+        try:
+            # The new modification time keeps a pending delete from removing the file
+            os.utime(self.path(name))
+            return name
+        except FileNotFoundError:
+            pass
+        # Concurrent saves of the same content write identical bytes, hence allow_overwrite
+        return super().save(name, content, max_length=max_length)
+
+    def delete_unless_touched(self, name, since, in_use):
+        """
+        Delete a file unless it was saved after the timestamp `since` or `in_use()`
+        is true. The file is moved aside while checking, so a concurrent save either
+        touched it before and keeps it, or finds it missing and writes it again.
+        Returns whether the file was deleted.
+        """
+        path = self.path(name)
+        aside = f'{path}.{uuid.uuid4().hex}.delete'
+        try:
+            os.rename(path, aside)
+        except FileNotFoundError:
+            return False
+        if os.path.getmtime(aside) > since - MTIME_SLACK or in_use():
+            # A concurrent save may have written the same content again meanwhile
+            os.replace(aside, path)
+            return False
+        os.remove(aside)
+        return True
+
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+        content.seek(0)
+        content_hash = digest.hexdigest()
+
+        directory, filename = posixpath.split(name.replace('\\', '/'))
+        stem, extension = posixpath.splitext(filename)
+        if stem == content_hash:
+            # Already the content-addressed name, e.g. saving a file after its row
+            return posixpath.join(directory, filename)
+        return self.addressed_name(directory, content_hash, extension)
+
+    @staticmethod
+    def addressed_name(directory, content_hash, extension):
+        """The name of content with the hash `content_hash`, for callers that already hashed it."""
+        return posixpath.join(directory, content_hash[:2], content_hash[2:4], content_hash + extension.lower())
+
+    @staticmethod
+    def content_hash(name):
+        """The content hash of a stored name, or '' for names not created by this storage."""
+        content_hash = posixpath.splitext(posixpath.basename(name or ''))[0]
+        return content_hash if CONTENT_HASH_PATTERN.match(content_hash) else ''
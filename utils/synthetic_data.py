@@ -0,0 +1,221 @@
+"""
+Reproducible synthetic datasets for benchmarks and load tests.
+
+All rows are created with bulk inserts in one transaction; model save() hooks
+(verification mails, carts, owner memberships) are replaced by explicit bulk inserts
+of the same rows. The same seed and sizes always produce the same data.
+"""
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from Webshop.models import Address, CartItem, CompanyGroup, CompanyGroupMembership, CompanyGroupRole, CustomUser, \
+    Item, ItemCategory, ItemDetails, Order, OrderInfo, OrderItem, OrderStatus, PriceList, PriceListEntry, \
+    ShoppingCart, ShoppingList, ShoppingListItem, ShoppingListStatus
+
+BATCH_SIZE = 2000
+SYNTHETIC_PASSWORD = 'synthetic'
+# Article ids are "<prefix><8 digits>", the prefix has two characters to fit max_length=10
+ARTICLE_ID_PREFIX = 'SY'
+EMAIL_TEMPLATE = 'synthetic-{index}@example.com'
+
+ADJECTIVES = ('Kompakter', 'Leiser', 'Robuster', 'Schneller', 'Mobiler', 'Flacher', 'Professioneller', 'Smarter')
+PRODUCTS = ('Laptop', 'Monitor', 'Drucker', 'Router', 'Switch', 'Server', 'Scanner', 'Headset', 'Dockingstation',
+            'Tastatur', 'Maus', 'Webcam', 'Beamer', 'Tablet', 'Festplatte', 'Netzteil')
+FIRST_NAMES = ('Anna', 'Ben', 'Clara', 'David', 'Eva', 'Felix', 'Greta', 'Hannes', 'Ida', 'Jonas', 'Lena', 'Max')
+LAST_NAMES = ('Müller', 'Schmidt', 'Schneider', 'Fischer', 'Weber', 'Meyer', 'Wagner', 'Becker', 'Hoffmann')
+CITIES = ('Berlin', 'Hamburg', 'München', 'Köln', 'Frankfurt', 'Stuttgart', 'Leipzig', 'Dresden')
+
+
+def generate_synthetic_data(items=1000, categories=20, users=100, groups=10, years=2, orders_per_month=2,
+                            seed=0, log=None):
+    """
+    Create a catalog of `items` items in `categories` categories, `users` users with
+    addresses and filled carts, `groups` company groups with members, price lists and
+    shopping lists, and `years` of order history with about `orders_per_month` orders
+    per user and month. Users log in with SYNTHETIC_PASSWORD.
+    Returns the number of created rows per model.
+    """
+    if CustomUser.objects.filter(email=EMAIL_TEMPLATE.format(index=0)).exists() \
+            or Item.objects.filter(article_id__startswith=ARTICLE_ID_PREFIX).exists():
+        raise ValueError("The database already contains synthetic data.")
+
+    rng = random.Random(seed)
+    counts = {}
+    log = log or (lambda message: None)
+
+    def create(model, objects):
+        start = time.perf_counter()
+        created = model.objects.bulk_create(objects, batch_size=BATCH_SIZE)
+        counts[model.__name__] = counts.get(model.__name__, 0) + len(created)
+        log(f"{model.__name__}: {len(created)} rows in {time.perf_counter() - start:.1f}s")
+        return created
+
+    with transaction.atomic():
+        catalog, category_rows = _create_catalog(create, rng, items, categories)
+        user_rows = _create_users(create, rng, users, catalog)
+        _create_groups(create, rng, groups, user_rows, catalog, category_rows)
+        _create_orders(create, rng, user_rows, catalog, years, orders_per_month)
+    return counts
+
+
+def _create_catalog(create, rng, items, categories):
+    category_rows = create(ItemCategory, [ItemCategory(category_name=f"Kategorie {i:03d}") for i in range(categories)])
+    details = create(ItemDetails, [
+        ItemDetails(
+            item_name=f"{rng.choice(ADJECTIVES)} {rng.choice(PRODUCTS)} {i}",
+            item_description=f"<p>Synthetisches Produkt {i} für Last- und Performancetests.</p>",
+        )
+        for i in range(items)
+    ])
+    through = ItemDetails.categories.through
+    create(through, [
+        through(itemdetails_id=detail.pk, itemcategory_id=category.pk)
+        for detail in details
+        for category in rng.sample(category_rows, min(len(category_rows), rng.choice((1, 1, 2))))
+    ])
+    catalog = create(Item, [
+        Item(
+            item_details_id=detail.pk,
+            item_price=Decimal(rng.randint(500, 250000)) / 100,
+            article_id=f"{ARTICLE_ID_PREFIX}{i:08d}",
+            item_stock=rng.randint(0, 500),
+        )
+        for i, detail in enumerate(details)
+    ])
+    return catalog, category_rows
+
+
+def _create_users(create, rng, users, catalog):
+    password = make_password(SYNTHETIC_PASSWORD)
+    user_rows = create(CustomUser, [
+        CustomUser(
+            email=EMAIL_TEMPLATE.format(index=i),
+            password=password,
+            first_name=rng.choice(FIRST_NAMES),
+            last_name=rng.choice(LAST_NAMES),
+            company_name=f"Firma {i // 5}",
+            phone=f"0{rng.randint(100000000, 999999999)}",
+            verified=True,
+        )
+        for i in range(users)
+    ])
+    create(Address, [
+        Address(user_id=user.pk, address=f"Hauptstraße {rng.randint(1, 200)}, {rng.choice(CITIES)}", billing=billing)
+        for user in user_rows
+        for billing in ((True, False) if rng.random() < 0.5 else (True,))
+    ])
+    carts = create(ShoppingCart, [ShoppingCart(user_id=user.pk) for user in user_rows])
+    create(CartItem, [
+        CartItem(cart_id=cart.pk, item_id=item.pk, quantity=rng.randint(1, 10))
+        for cart in carts
+        for item in rng.sample(catalog, min(len(catalog), rng.randint(0, 5)))
+    ])
+    return user_rows
+
+
+def _create_groups(create, rng, groups, user_rows, catalog, category_rows):
+    if not groups or not user_rows:
+        return
+    owners = rng.sample(user_rows, min(groups, len(user_rows)))
+    group_rows = create(CompanyGroup, [
+        CompanyGroup(name=f"Synthetische Gruppe {i}", owner_id=owner.pk) for i, owner in enumerate(owners)
+    ])
+
+    memberships, members = [], {}
+    for group in group_rows:
+        members[group.pk] = [group.owner_id]
+        memberships.append(CompanyGroupMembership(user_id=group.owner_id, group_id=group.pk,
+                                                  role=CompanyGroupRole.OWNER))
+        for user in rng.sample(user_rows, min(len(user_rows), rng.randint(2, 10))):
+            if user.pk != group.owner_id:
+                members[group.pk].append(user.pk)
+                memberships.append(CompanyGroupMembership(user_id=user.pk, group_id=group.pk))
+    create(CompanyGroupMembership, memberships)
+
+    price_lists = create(PriceList, [PriceList(group_id=group.pk, name=f"Rahmenvertrag {group.name}")
+                                     for group in group_rows])
+    create(PriceListEntry, [
+        entry
+        for price_list in price_lists
+        for entry in (
+            PriceListEntry(price_list_id=price_list.pk, category_id=rng.choice(category_rows).pk,
+                           discount_percent=Decimal(rng.choice((5, 10, 15)))),
+            *(PriceListEntry(price_list_id=price_list.pk, item_id=item.pk, min_quantity=rng.choice((1, 10)),
+                             price=(item.item_price * Decimal('0.9')).quantize(Decimal('0.01')))
+              for item in rng.sample(catalog, min(len(catalog), 5))),
+        )
+    ])
+
+    shopping_lists = create(ShoppingList, [
+        ShoppingList(title=f"Bedarf {group.name} {i}", group_id=group.pk, created_by_id=rng.choice(members[group.pk]),
+                     status=rng.choice(ShoppingListStatus.values))
+        for group in group_rows
+        for i in range(rng.randint(1, 5))
+    ])
+    create(ShoppingListItem, [
+        ShoppingListItem(shopping_list_id=shopping_list.pk, item_id=item.pk, quantity=rng.randint(1, 20))
+        for shopping_list in shopping_lists
+        for item in rng.sample(catalog, min(len(catalog), rng.randint(1, 8)))
+    ])
+
+
+@contextmanager
+def _insert_order_dates():
+    """Let inserts keep the order_date of the objects, which is auto_now_add otherwise."""
+    field = Order._meta.get_field('order_date')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+def _create_orders(create, rng, user_rows, catalog, years, orders_per_month):
+    """Orders spread over the last `years` years, older ones delivered, recent ones still open."""
+    if not catalog:
+        return
+    now = timezone.now()
+    span = timedelta(days=365 * years)
+    orders, lines = [], []
+    for user in user_rows:
+        for _ in range(round(12 * years * orders_per_month * rng.uniform(0.5, 1.5))):
+            order_date = now - span * rng.random()
+            age = now - order_date
+            if age < timedelta(days=3):
+                order_status = OrderStatus.PENDING
+            elif age < timedelta(days=10):
+                order_status = OrderStatus.SHIPPED
+            else:
+                order_status = rng.choices(
+                    (OrderStatus.DELIVERED, OrderStatus.CANCELLED, OrderStatus.RETURNED), (90, 7, 3))[0]
+            order_lines = [(item, rng.randint(1, 10))
+                           for item in rng.sample(catalog, min(len(catalog), rng.randint(1, 5)))]
+            orders.append(Order(
+                user_id=user.pk, order_date=order_date, order_status=order_status,
+                order_active=order_status in (OrderStatus.PENDING, OrderStatus.SHIPPED),
+                order_total=sum(item.item_price * quantity for item, quantity in order_lines),
+            ))
+            lines.append((user, order_lines))
+
+    # Insert in chronological order like real traffic, with the generated order dates
+    history = sorted(zip(orders, lines), key=lambda row: row[0].order_date)
+    with _insert_order_dates():
+        orders = create(Order, [order for order, _ in history])
+    lines = [order_lines for _, order_lines in history]
+    create(OrderInfo, [
+        OrderInfo(order_id=order.pk, buyer_name=f"{user.first_name} {user.last_name}", buyer_email=user.email,
+                  buyer_phone=user.phone, buyer_address=f"{user.company_name}, {rng.choice(CITIES)}")
+        for order, (user, _) in zip(orders, lines)
+    ])
+    create(OrderItem, [
+        OrderItem(order_id=order.pk, item_id=item.pk, quantity=quantity, unit_price=item.item_price)
+        for order, (_, order_lines) in zip(orders, lines)
+        for item, quantity in order_lines
+    ])
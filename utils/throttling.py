@@ -0,0 +1,86 @@
+"""
+Token buckets for the request throttling of Webshop.throttling.
+
+A bucket holds up to `capacity` tokens and refills at `rate` tokens per second, every
+request takes one token. A client can therefore send bursts of `capacity` requests
+and sustain `rate` requests per second, and a rejected request learns exactly how long
+it has to wait for the next token. A bucket is only a (tokens, timestamp) pair that
+is brought up to date when it is used, there are no timers.
+
+LocalBuckets keep the buckets in process memory, so every worker counts on its own.
+CacheBuckets keep them in a Django cache shared by all workers.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+THROTTLE_CACHE_KEY = 'throttle:{key}'
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+@lru_cache
+def parse_rate(rate):
+    """The capacity and the refill rate per second of a DRF rate like '120/min'."""
+    number, period = rate.split('/')
+    capacity = int(number)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+def take_token(bucket, capacity, rate, now):
+    """
+    Take a token from `bucket`, a (tokens, updated) pair or None for a full bucket.
+    Returns the new bucket and 0, or the seconds until a token is available.
+    """
+    tokens, updated = bucket or (capacity, now)
+    tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return (tokens - 1, now), 0
+    return (tokens, now), (1 - tokens) / rate
+
+
+class LocalBuckets:
+    """Buckets in process memory, the least recently used ones beyond THROTTLE_MAX_BUCKETS are dropped."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, key, capacity, rate):
+        now = time.monotonic()
+        with self._lock:
+            bucket, wait = take_token(self._buckets.pop(key, None), capacity, rate, now)
+            self._buckets[key] = bucket
+            if len(self._buckets) > settings.THROTTLE_MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class CacheBuckets:
+    """
+    Buckets in the THROTTLE_CACHE cache. Reading and writing a bucket are two cache
+    calls, so concurrent requests of one client may pass a few more requests than
+    the capacity. A bucket expires once it would be full again.
+    """
+
+    def take(self, key, capacity, rate):
+        cache = caches[settings.THROTTLE_CACHE]
+        cache_key = THROTTLE_CACHE_KEY.format(key=key)
+        bucket, wait = take_token(cache.get(cache_key), capacity, rate, time.time())
+        cache.set(cache_key, bucket, timeout=math.ceil(capacity / rate))
+        return wait
+
+
+_buckets = None
+
+
+def get_buckets():
+    global _buckets
+    if _buckets is None:
+        _buckets = import_string(settings.THROTTLE_BUCKETS)()
+    return _buckets